@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Приемник исходящих событий Bitrix24
+
+Небольшое aiohttp-приложение принимает события ONUSERADD/ONUSERUPDATE и
+изменения отделов и в течение нескольких секунд применяет изменения
+отдельных пользователей к хранилищу контактов. Периодическая полная
+синхронизация исправляет пропущенные события.
+
+Запуск: python bitrix24_events.py
+В Bitrix24 адрес http://<хост>:<порт><путь> указывается в исходящем вебхуке,
+его application_token — в BITRIX24_EVENT_TOKEN (без токена приемник не
+запускается: иначе любой, кто знает адрес, мог бы запускать синхронизацию).
+"""
+
+import asyncio
+import hmac
+import logging
+from typing import Optional, Set
+
+from aiohttp import web
+
+from bitrix24_sync import Bitrix24Client, apply_user_events, get_department_tree, sync_bitrix24
+from config import (BITRIX24_WEBHOOK, BITRIX24_EVENT_TOKEN, BITRIX24_EVENTS_HOST, BITRIX24_EVENTS_PORT,
+                    BITRIX24_EVENTS_PATH, BITRIX24_RECONCILE_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+# События изменения пользователей
+USER_EVENTS = {'ONUSERADD', 'ONUSERUPDATE'}
+# События изменения структуры отделов
+DEPARTMENT_EVENTS = {'ONDEPARTMENTADD', 'ONDEPARTMENTUPDATE', 'ONDEPARTMENTDELETE'}
+# Сколько секунд копить события перед применением (несколько изменений одного
+# пользователя и события нескольких пользователей применяются одним запросом)
+EVENT_DEBOUNCE_SECONDS = 2.0
+# Через сколько секунд после изменения отделов выполняется полная синхронизация
+DEPARTMENT_RECONCILE_DELAY = 30.0
+
+
+class Bitrix24EventReceiver:
+    """Очередь событий Bitrix24 и их применение к хранилищу контактов"""
+
+    def __init__(self, webhook_url: str, application_token: str,
+                 reconcile_interval: float = BITRIX24_RECONCILE_INTERVAL,
+                 excel_file: str = None):
+        if not application_token:
+            raise ValueError("Не задан application_token исходящего вебхука Bitrix24 (BITRIX24_EVENT_TOKEN)")
+        self.webhook_url = webhook_url
+        self.application_token = application_token
+        self.reconcile_interval = reconcile_interval
+        self.excel_file = excel_file
+        self.client = Bitrix24Client(webhook_url)
+        self.pending_users: Set[str] = set()
+        self.reconcile_requested = False
+        self._wakeup = asyncio.Event()
+        # Применение событий и полная синхронизация не выполняются одновременно
+        self._lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _start_task(self, coro) -> asyncio.Task:
+        """Запускает фоновую задачу; завершенная задача удаляется из self._tasks"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _check_token(self, token: Optional[str]) -> bool:
+        """Проверяет application_token события"""
+        return bool(token) and hmac.compare_digest(token, self.application_token)
+
+    async def handle_event(self, request: web.Request) -> web.Response:
+        """Принимает событие Bitrix24 (application/x-www-form-urlencoded) и ставит его в очередь"""
+        form = await request.post()
+
+        if not self._check_token(form.get('auth[application_token]')):
+            logger.warning(f"Событие Bitrix24 с неверным application_token от {request.remote}")
+            return web.Response(status=403, text='forbidden')
+
+        event = (form.get('event') or '').upper()
+        if event in USER_EVENTS:
+            user_id = form.get('data[FIELDS][ID]')
+            if not user_id:
+                return web.Response(status=400, text='missing data[FIELDS][ID]')
+            self.pending_users.add(str(user_id))
+            self._wakeup.set()
+            logger.info(f"Событие {event}: пользователь {user_id}")
+        elif event in DEPARTMENT_EVENTS:
+            logger.info(f"Событие {event}: структура отделов будет обновлена")
+            self._schedule_department_refresh()
+        else:
+            logger.info(f"Событие Bitrix24 {event or '<пусто>'} пропущено")
+
+        return web.Response(text='ok')
+
+    def _schedule_department_refresh(self):
+        """Откладывает полную синхронизацию, чтобы серия изменений отделов применилась один раз"""
+        if self.reconcile_requested:
+            return
+        self.reconcile_requested = True
+
+        async def delayed():
+            await asyncio.sleep(DEPARTMENT_RECONCILE_DELAY)
+            await self.reconcile(refresh_departments=True)
+
+        self._start_task(delayed())
+
+    async def _event_worker(self):
+        """Применяет накопленные события пользователей"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(EVENT_DEBOUNCE_SECONDS)
+            self._wakeup.clear()
+
+            user_ids, self.pending_users = self.pending_users, set()
+            if not user_ids:
+                continue
+
+            try:
+                async with self._lock:
+                    result = await apply_user_events(self.client, sorted(user_ids), self.excel_file)
+                if result is None:
+                    logger.info("Хранилище контактов не заполнено, выполняем полную синхронизацию")
+                    await self.reconcile()
+            except Exception as e:
+                logger.error(f"Ошибка применения событий Bitrix24: {e}")
+                # Пользователи вернутся в очередь и будут применены со следующими событиями
+                self.pending_users |= user_ids
+
+    async def reconcile(self, refresh_departments: bool = False):
+        """Полная синхронизация: исправляет пропущенные и потерянные события"""
+        self.reconcile_requested = False
+        async with self._lock:
+            try:
+                if refresh_departments:
+                    await get_department_tree(self.client, force=True)
+                result = await sync_bitrix24(self.webhook_url, self.excel_file)
+                if result.get('success'):
+                    logger.info(f"Сверка с Bitrix24 выполнена: {result.get('details', {})}")
+                else:
+                    logger.error(f"Ошибка сверки с Bitrix24: {result.get('error')}")
+            except Exception as e:
+                logger.error(f"Ошибка сверки с Bitrix24: {e}")
+
+    async def _reconcile_worker(self):
+        """Периодическая полная синхронизация"""
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            await self.reconcile()
+
+    async def on_startup(self, app: web.Application):
+        self._start_task(self._event_worker())
+        if self.reconcile_interval > 0:
+            self._start_task(self._reconcile_worker())
+
+    async def on_cleanup(self, app: web.Application):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.close()
+
+
+RECEIVER_KEY = web.AppKey('receiver', Bitrix24EventReceiver)
+
+
+def create_app(receiver: Bitrix24EventReceiver = None, path: str = BITRIX24_EVENTS_PATH) -> web.Application:
+    """
+    Создает aiohttp-приложение приемника событий
+
+    Raises:
+        ValueError: Не задан BITRIX24_EVENT_TOKEN
+    """
+    if receiver is None:
+        receiver = Bitrix24EventReceiver(BITRIX24_WEBHOOK, BITRIX24_EVENT_TOKEN)
+
+    app = web.Application()
+    app[RECEIVER_KEY] = receiver
+    app.router.add_post(path, receiver.handle_event)
+    app.on_startup.append(receiver.on_startup)
+    app.on_cleanup.append(receiver.on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not BITRIX24_WEBHOOK:
+        raise SystemExit("BITRIX24_WEBHOOK не найден в переменных окружения")
+    if not BITRIX24_EVENT_TOKEN:
+        raise SystemExit("BITRIX24_EVENT_TOKEN не найден в переменных окружения: "
+                         "укажите application_token исходящего вебхука Bitrix24")
+    web.run_app(create_app(), host=BITRIX24_EVENTS_HOST, port=BITRIX24_EVENTS_PORT)
@@ -0,0 +1,193 @@
+"""
+Модуль для загрузки фотографий сотрудников из Bitrix24 в локальное хранилище
+
+Файлы хранятся по хэшу содержимого (одинаковые фото сохраняются один раз),
+для каждой ссылки запоминаются ETag/Last-Modified, поэтому неизменившиеся
+фото повторно не скачиваются.
+"""
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Поле пользователя Bitrix24 со ссылкой на фото
+PHOTO_FIELD = 'PERSONAL_PHOTO'
+# Сколько фото скачивается одновременно
+PHOTO_CONCURRENCY = 4
+# Расширения, которые берутся из ссылки без проверки Content-Type
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+class PhotoSync:
+    """
+    Загрузка фотографий пользователей Bitrix24
+
+    Использует HTTP-сессию клиента Bitrix24; скачивание фото не расходует
+    лимит REST-запросов, поэтому ограничивается только числом одновременных загрузок.
+    """
+
+    def __init__(self, client, store_dir: str, concurrency: int = PHOTO_CONCURRENCY):
+        self.client = client
+        self.store_dir = store_dir
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {'downloaded': 0, 'not_modified': 0, 'failed': 0}
+        self._unsaved: List[Dict[str, Any]] = []
+
+    def _photo_url(self, user: Dict) -> Optional[str]:
+        """Абсолютная ссылка на фото пользователя (портал может отдавать путь от корня)"""
+        url = user.get(PHOTO_FIELD)
+        if not url:
+            return None
+        url = str(url).strip()
+        if not urlparse(url).scheme:
+            url = urljoin(self.client.webhook_url, url)
+        return url
+
+    def _store(self, content: bytes, url: str, content_type: str) -> Tuple[str, str]:
+        """Сохраняет файл под именем хэша содержимого; существующий файл не перезаписывается"""
+        digest = hashlib.sha256(content).hexdigest()
+
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if extension not in PHOTO_EXTENSIONS:
+            extension = mimetypes.guess_extension(content_type or '') or '.jpg'
+
+        directory = os.path.join(self.store_dir, digest[:2])
+        path = os.path.join(directory, digest + extension)
+        if os.path.exists(path):
+            return digest, path
+
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return digest, path
+
+    async def _fetch_one(self, url: str, known: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Скачивает одно фото условным запросом
+
+        Returns:
+            Запись о фото (changed=True, если файл был загружен) или None
+        """
+        if known and not (known.get('path') and os.path.exists(known['path'])):
+            known = None
+
+        headers = {}
+        if known:
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+            if not headers:
+                # Сервер не отдает валидаторы: ссылка на фото Bitrix24 меняется вместе с файлом
+                return {**known, 'changed': False}
+
+        async with self.semaphore:
+            try:
+                session = await self.client._get_session()
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and known:
+                        self.stats['not_modified'] += 1
+                        return {**known, 'changed': False}
+                    if response.status != 200:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=response.reason or ''
+                        )
+                    content = await response.read()
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+                    content_type = response.content_type
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.stats['failed'] += 1
+                logger.warning(f"Не удалось загрузить фото {url}: {e}")
+                return {**known, 'changed': False} if known else None
+
+        loop = asyncio.get_running_loop()
+        content_hash, path = await loop.run_in_executor(None, self._store, content, url, content_type)
+        self.stats['downloaded'] += 1
+
+        return {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'path': path,
+            'changed': True
+        }
+
+    async def fetch(self, users: List[Dict], save: bool = True) -> Dict[str, str]:
+        """
+        Загружает фото пользователей
+
+        Args:
+            users: Пользователи Bitrix24
+            save: Сразу сохранить сведения о загруженных фото. При записи
+                справочника передается False, а сведения сохраняются вызовом
+                save() после переноса страниц в справочник.
+
+        Returns:
+            Словарь {ID пользователя: локальный путь к фото}; пользователи без фото
+            и с неудачной первой загрузкой в него не попадают
+        """
+        from database import init_bitrix24_tables, get_bitrix24_photos
+
+        user_urls = {}
+        for user in users:
+            url = self._photo_url(user)
+            if url:
+                user_urls[str(user.get('ID'))] = url
+        if not user_urls:
+            return {}
+
+        await init_bitrix24_tables()
+        urls = list(set(user_urls.values()))
+        known = await get_bitrix24_photos(urls)
+        results = await asyncio.gather(*(self._fetch_one(url, known.get(url)) for url in urls))
+
+        photos = {url: result for url, result in zip(urls, results) if result}
+        self._unsaved.extend(photo for photo in photos.values() if photo['changed'])
+        if save:
+            await self.save()
+
+        return {
+            user_id: photos[url]['path']
+            for user_id, url in user_urls.items() if url in photos
+        }
+
+    async def save(self):
+        """Сохраняет сведения о загруженных фото (ETag, Last-Modified, путь)"""
+        from database import save_bitrix24_photos
+
+        await save_bitrix24_photos(self._unsaved)
+        self._unsaved = []
+        logger.info(
+            f"Фото сотрудников: загружено {self.stats['downloaded']}, "
+            f"без изменений {self.stats['not_modified']}, ошибок {self.stats['failed']}"
+        )
+
+
+def create_photo_sync(client) -> Optional[PhotoSync]:
+    """Создает загрузчик фото, если синхронизация фото включена в настройках"""
+    from config import BITRIX24_SYNC_PHOTOS, BITRIX24_PHOTO_DIR
+
+    if not BITRIX24_SYNC_PHOTOS:
+        return None
+    return PhotoSync(client, BITRIX24_PHOTO_DIR)
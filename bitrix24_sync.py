@@ -1,88 +1,922 @@
 """
-Модуль для синхронизации сотрудников из Bitrix24 в Excel файл
+Модуль для синхронизации сотрудников из Bitrix24 в Excel файл или справочник SQLite
 """
 
 import asyncio
+import hashlib
+import json
 import aiohttp
 import pandas as pd
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timedelta
+from collections import deque
+from typing import Any, AsyncIterable, AsyncIterator, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
 import os
 
+from bitrix24_photos import PhotoSync, create_photo_sync
+from excel_handler import write_contacts_file
+from utils.rate_limit import TokenBucket, backoff_delay
+
 logger = logging.getLogger(__name__)
 
+# Размер страницы списочных методов Bitrix24 (фиксирован на стороне портала)
+PAGE_SIZE = 50
+# Максимальное количество команд в одном вызове batch
+BATCH_SIZE = 50
+# Сколько batch-запросов выполняется одновременно
+MAX_CONCURRENT_BATCHES = 2
+# Лимиты webhook'ов Bitrix24: 2 запроса в секунду с накоплением до 50
+# (для тарифа «Энтерпрайз» — 5 и 250)
+DEFAULT_RATE_LIMIT = 2.0
+DEFAULT_BURST = 50
+# Таймаут одного HTTP-запроса, секунд
+REQUEST_TIMEOUT = 60
+# Количество повторов запроса при ограничении частоты, ошибках 5xx и сети
+MAX_RETRIES = 5
+# Ошибки API, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = {'QUERY_LIMIT_EXCEEDED', 'OPERATION_TIME_LIMIT', 'INTERNAL_SERVER_ERROR', 'NETWORK_ERROR'}
+# Ключ курсора инкрементальной синхронизации в таблице sync_state
+SYNC_CURSOR_KEY = 'bitrix24_users_cursor'
+# Ключ времени последней загрузки отделов и срок жизни их кэша, секунд
+DEPARTMENTS_FETCHED_KEY = 'bitrix24_departments_fetched_at'
+DEPARTMENT_CACHE_TTL = 6 * 60 * 60
+# Запас курсора назад, чтобы не потерять изменения на границе запусков
+CURSOR_OVERLAP_SECONDS = 60
+# Поля файла контактов, изменения которых учитываются в статистике синхронизации
+DIFF_FIELDS = ['ФИО', 'Должность', 'Отдел', 'Email', 'Телефон']
+
+# Кэш количества записей в файлах контактов: {путь: ((mtime, размер), количество)}
+_row_count_cache: Dict[str, Tuple[Tuple[float, int], int]] = {}
+
+
+def _parse_bitrix_datetime(value: Any) -> Optional[datetime]:
+    """Разбирает дату Bitrix24 (ISO 8601 с часовым поясом)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.astimezone()
+    return parsed
+
+
+class Bitrix24Error(Exception):
+    """Ошибка вызова API Bitrix24"""
+    
+    def __init__(self, code: str, description: str = '', status: int = None):
+        super().__init__(f"{code}: {description}" if description else code)
+        self.code = code
+        self.description = description
+        self.status = status
+    
+    @property
+    def retryable(self) -> bool:
+        """Можно ли повторить запрос (ограничение частоты, 5xx, сетевые ошибки)"""
+        return self.code in RETRYABLE_ERRORS or (self.status or 0) >= 500
+
+
 class Bitrix24Client:
     """Клиент для работы с API Bitrix24"""
     
-    def __init__(self, webhook_url: str):
+    def __init__(self, webhook_url: str, max_concurrency: int = MAX_CONCURRENT_BATCHES,
+                 rate_limit: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_BURST):
         self.webhook_url = webhook_url
         self.base_url = webhook_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.limiter = TokenBucket(rate_limit, burst)
+        self._session: Optional[aiohttp.ClientSession] = None
     
-    async def _make_request(self, method: str, params: Dict = None) -> Dict:
-        """Выполняет запрос к API Bitrix24"""
+    async def __aenter__(self) -> 'Bitrix24Client':
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую HTTP-сессию клиента (соединения переиспользуются)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        return self._session
+    
+    async def close(self):
+        """Закрывает HTTP-сессию клиента"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    @staticmethod
+    def _build_query(params: Dict) -> str:
+        """Кодирует параметры в формате PHP http_build_query (нужно для команд batch)"""
+        pairs: List[Tuple[str, str]] = []
+        
+        def flatten(key: str, value: Any):
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    flatten(f"{key}[{sub_key}]", sub_value)
+            elif isinstance(value, (list, tuple)):
+                for index, sub_value in enumerate(value):
+                    flatten(f"{key}[{index}]", sub_value)
+            elif isinstance(value, bool):
+                pairs.append((key, 'Y' if value else 'N'))
+            elif value is None:
+                pairs.append((key, ''))
+            else:
+                pairs.append((key, str(value)))
+        
+        for key, value in params.items():
+            flatten(key, value)
+        
+        return urlencode(pairs)
+    
+    async def _send(self, url: str, params: Dict) -> Dict:
+        """Один HTTP-запрос к API; ошибки API и HTTP превращаются в Bitrix24Error"""
+        try:
+            session = await self._get_session()
+            async with session.post(url, json=params) as response:
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    data = None
+                
+                if isinstance(data, dict) and 'error' in data:
+                    raise Bitrix24Error(data['error'], data.get('error_description', ''), response.status)
+                if response.status != 200 or not isinstance(data, dict):
+                    text = await response.text()
+                    raise Bitrix24Error(f"HTTP_{response.status}", text[:200], response.status)
+                return data
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Bitrix24Error('NETWORK_ERROR', str(e))
+    
+    async def _call(self, method: str, params: Dict = None) -> Dict:
+        """
+        Выполняет запрос к API Bitrix24 и возвращает ответ целиком (result, total, next)
+        
+        Запросы проходят через ограничитель частоты. При превышении лимита,
+        ошибках 5xx и сетевых ошибках запрос повторяется с экспоненциальной
+        задержкой; если попытки исчерпаны, выбрасывается Bitrix24Error.
+        """
         if params is None:
             params = {}
         
         url = f"{self.base_url}/{method}"
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if 'result' in data:
-                            return data['result']
-                        elif 'error' in data:
-                            logger.error(f"Bitrix24 API error: {data['error']}")
-                            return {}
-                        else:
-                            return data
-                    else:
-                        logger.error(f"HTTP error {response.status}: {await response.text()}")
-                        return {}
-        except Exception as e:
-            logger.error(f"Request error: {e}")
-            return {}
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            try:
+                data = await self._send(url, params)
+            except Bitrix24Error as e:
+                if e.code == 'QUERY_LIMIT_EXCEEDED':
+                    self.limiter.penalize()
+                if not e.retryable or attempt == MAX_RETRIES:
+                    logger.error(f"Bitrix24 API error ({method}): {e}")
+                    raise
+                
+                delay = backoff_delay(attempt + 1)
+                logger.warning(f"Bitrix24 {method}: {e}. Повтор через {delay:.1f} с (попытка {attempt + 2})")
+                await asyncio.sleep(delay)
+                continue
+            
+            self.limiter.reward()
+            return data
     
-    async def get_users(self) -> List[Dict]:
-        """Получает список всех пользователей из Bitrix24"""
-        users = []
-        start = 0
+    async def _make_request(self, method: str, params: Dict = None) -> Any:
+        """Выполняет запрос к API Bitrix24"""
+        data = await self._call(method, params)
+        if 'result' in data:
+            return data['result']
+        return data
+    
+    async def _batch(self, commands: Dict[str, Tuple[str, Dict]]) -> Dict[str, Any]:
+        """
+        Выполняет до BATCH_SIZE команд одним вызовом метода batch
+        
+        Команды, завершившиеся повторяемой ошибкой, отправляются повторно.
+        Если ответ на какую-либо команду так и не получен, выбрасывается
+        Bitrix24Error — неполные данные вызывающему коду не возвращаются.
+        
+        Args:
+            commands: {ключ: (метод, параметры)}
         
-        while True:
-            params = {
-                'start': start,
-                'ACTIVE': True
+        Returns:
+            Dict {ключ: result команды}
+        """
+        results: Dict[str, Any] = {}
+        pending = dict(commands)
+        
+        for attempt in range(MAX_RETRIES + 1):
+            cmd = {
+                key: f"{method}?{self._build_query(params)}"
+                for key, (method, params) in pending.items()
             }
             
-            result = await self._make_request('user.get', params)
+            data = await self._call('batch', {'halt': 0, 'cmd': cmd})
+            result = data.get('result') or {}
             
-            if not result:
-                break
+            # PHP отдает пустой ассоциативный массив как список
+            batch_results = result.get('result') or {}
+            if not isinstance(batch_results, dict):
+                batch_results = {}
+            errors = result.get('result_error') or {}
+            if not isinstance(errors, dict):
+                errors = {}
             
-            users.extend(result)
+            for key in list(pending):
+                if key in batch_results and key not in errors:
+                    results[key] = batch_results[key]
+                    del pending[key]
             
-            # Если получили меньше 50 записей, значит это последняя страница
-            if len(result) < 50:
-                break
+            if not pending:
+                return results
+            
+            for key in pending:
+                error = errors.get(key) or {}
+                code = error.get('error', 'NO_RESULT') if isinstance(error, dict) else str(error)
+                if code not in RETRYABLE_ERRORS and code != 'NO_RESULT':
+                    raise Bitrix24Error(code, f"команда {key} в batch завершилась ошибкой")
+                if code == 'QUERY_LIMIT_EXCEEDED':
+                    self.limiter.penalize()
             
-            start += 50
+            if attempt < MAX_RETRIES:
+                delay = backoff_delay(attempt + 1)
+                logger.warning(f"Bitrix24 batch: нет ответа на {len(pending)} команд. Повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+        
+        raise Bitrix24Error('BATCH_INCOMPLETE', f"не получены страницы: {', '.join(sorted(pending))}")
+    
+    async def iter_pages(self, method: str, params: Dict = None) -> AsyncIterator[List[Dict]]:
+        """
+        Асинхронно выдает страницы списочного метода по порядку, по мере загрузки
+        
+        Первая страница запрашивается обычным вызовом, чтобы узнать total.
+        Остальные страницы собираются в batch-запросы по BATCH_SIZE команд;
+        одновременно выполняется не более max_concurrency batch-запросов,
+        следующий запускается, когда страницы предыдущего отданы потребителю.
+        Поэтому в памяти находится не больше max_concurrency × BATCH_SIZE страниц.
+        Если хотя бы одну страницу получить не удалось, выбрасывается Bitrix24Error.
+        """
+        params = dict(params or {})
         
+        first = await self._call(method, {**params, 'start': 0})
+        
+        items = list(first.get('result') or [])
+        total = int(first.get('total', len(items)) or 0)
+        if items:
+            yield items
+        
+        starts = list(range(PAGE_SIZE, total, PAGE_SIZE))
+        if not starts:
+            return
+        
+        chunks = iter([starts[i:i + BATCH_SIZE] for i in range(0, len(starts), BATCH_SIZE)])
+        pending: Deque[Tuple[List[int], asyncio.Task]] = deque()
+        
+        def schedule_next():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                task = asyncio.ensure_future(self._batch({
+                    f"page_{start}": (method, {**params, 'start': start})
+                    for start in chunk
+                }))
+                pending.append((chunk, task))
+        
+        logger.info(f"{method}: всего {total} записей, {len(starts)} страниц")
+        for _ in range(self.max_concurrency):
+            schedule_next()
+        
+        try:
+            while pending:
+                chunk, task = pending.popleft()
+                chunk_result = await task
+                schedule_next()
+                # Страницы отдаются в исходном порядке независимо от порядка завершения запросов
+                for start in chunk:
+                    page = chunk_result.get(f"page_{start}") or []
+                    if page:
+                        yield page
+        finally:
+            for _, task in pending:
+                task.cancel()
+    
+    async def _get_all(self, method: str, params: Dict = None) -> List[Dict]:
+        """Получает все страницы списочного метода одним списком"""
+        items = []
+        async for page in self.iter_pages(method, params):
+            items.extend(page)
+        return items
+    
+    def iter_users(self) -> AsyncIterator[List[Dict]]:
+        """Асинхронно выдает страницы активных пользователей по мере загрузки"""
+        return self.iter_pages('user.get', {'ACTIVE': True})
+    
+    async def get_users(self) -> List[Dict]:
+        """Получает список всех пользователей из Bitrix24"""
+        users = []
+        async for page in self.iter_users():
+            users.extend(page)
         return users
     
+    async def get_users_total(self) -> int:
+        """Возвращает количество активных пользователей одним запросом (поле total)"""
+        data = await self._call('user.get', {'ACTIVE': True, 'start': 0})
+        return int(data.get('total', len(data.get('result') or [])) or 0)
+    
+    async def get_changed_users(self, since: datetime) -> Optional[List[Dict]]:
+        """
+        Получает пользователей (включая деактивированных), измененных или
+        зарегистрированных после since
+        
+        Returns:
+            Список пользователей или None, если портал не поддерживает фильтры
+            >TIMESTAMP_X/>DATE_REGISTER
+        """
+        stamp = since.isoformat(timespec='seconds')
+        users_by_id: Dict[str, Dict] = {}
+        
+        for field in ('TIMESTAMP_X', 'DATE_REGISTER'):
+            try:
+                users = await self._get_all('user.get', {'FILTER': {f'>{field}': stamp}})
+            except Bitrix24Error as e:
+                if e.retryable:
+                    raise
+                logger.info(f"Фильтр >{field} отклонен порталом: {e}")
+                return None
+            
+            for user in users:
+                value = _parse_bitrix_datetime(user.get(field))
+                if value is None or value <= since:
+                    # Портал проигнорировал фильтр и вернул неотфильтрованный список
+                    logger.info(f"Фильтр >{field} не поддерживается порталом")
+                    return None
+                users_by_id[str(user.get('ID'))] = user
+        
+        return list(users_by_id.values())
+    
+    async def get_users_by_ids(self, user_ids: List[Any]) -> List[Dict]:
+        """Получает пользователей по ID, включая деактивированных"""
+        if not user_ids:
+            return []
+        return await self._get_all('user.get', {'FILTER': {'ID': [str(user_id) for user_id in user_ids]}})
+    
     async def get_departments(self) -> List[Dict]:
-        """Получает список всех отделов из Bitrix24"""
-        result = await self._make_request('department.get')
-        return result if result else []
+        """Получает список всех отделов из Bitrix24 (все страницы)"""
+        return await self._get_all('department.get')
+
 
-async def sync_bitrix24_to_excel(webhook_url: str, excel_file: str = None) -> Dict[str, Any]:
+class DepartmentTree:
+    """
+    Структура отделов Bitrix24: названия, родительские отделы и полные пути
+    
+    Пути вычисляются лениво и запоминаются, поэтому путь каждого отдела
+    строится один раз, а пути дочерних отделов переиспользуют путь родителя.
+    """
+    
+    PATH_SEPARATOR = ' / '
+    
+    def __init__(self, departments: List[Dict]):
+        self.names: Dict[str, str] = {str(dept['ID']): dept.get('NAME') or '' for dept in departments}
+        self.parents: Dict[str, str] = {
+            str(dept['ID']): str(dept['PARENT']) for dept in departments if dept.get('PARENT')
+        }
+        self._paths: Dict[str, str] = {}
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def name(self, dept_id: Any) -> str:
+        """Название отдела (пустая строка для неизвестного ID)"""
+        return self.names.get(str(dept_id), '')
+    
+    def path(self, dept_id: Any) -> str:
+        """Полный путь отдела от корня структуры, например «Компания / ИТ / Разработка»"""
+        dept_id = str(dept_id)
+        if dept_id in self._paths:
+            return self._paths[dept_id]
+        
+        # Поднимаемся к корню или к отделу с уже известным путем
+        chain = []
+        prefix = ''
+        current = dept_id
+        while current in self.names and current not in chain:
+            if current in self._paths:
+                prefix = self._paths[current]
+                break
+            chain.append(current)
+            current = self.parents.get(current)
+        
+        for node in reversed(chain):
+            prefix = f"{prefix}{self.PATH_SEPARATOR}{self.names[node]}" if prefix else self.names[node]
+            self._paths[node] = prefix
+        
+        return self._paths.get(dept_id, '')
+
+
+async def get_department_tree(client: Bitrix24Client, force: bool = False,
+                              ttl: int = DEPARTMENT_CACHE_TTL) -> DepartmentTree:
+    """
+    Возвращает структуру отделов из кэша SQLite, обновляя его по истечении ttl секунд
+    
+    Args:
+        client: Клиент Bitrix24 для обновления кэша
+        force: Обновить кэш независимо от срока
+        ttl: Срок жизни кэша в секундах
+    """
+    from database import (init_bitrix24_tables, init_sync_state_table, get_sync_state, set_sync_state,
+                          get_bitrix24_departments, save_bitrix24_departments)
+    
+    await init_bitrix24_tables()
+    await init_sync_state_table()
+    
+    if not force:
+        fetched_at = _parse_bitrix_datetime(await get_sync_state(DEPARTMENTS_FETCHED_KEY))
+        if fetched_at and datetime.now().astimezone() - fetched_at < timedelta(seconds=ttl):
+            departments = await get_bitrix24_departments()
+            if departments:
+                logger.info(f"Отделы взяты из кэша: {len(departments)}")
+                return DepartmentTree(departments)
+    
+    logger.info("Получаем отделы из Bitrix24...")
+    departments = await client.get_departments()
+    await save_bitrix24_departments(departments)
+    await set_sync_state(DEPARTMENTS_FETCHED_KEY, datetime.now().astimezone().isoformat(timespec='seconds'))
+    
+    return DepartmentTree(departments)
+
+
+def _user_to_record(user: Dict, departments: DepartmentTree, synced_at: str,
+                    photos: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Преобразует пользователя Bitrix24 в строку файла контактов
+    
+    photos — локальные пути к фото по ID пользователя; если фото не
+    загружалось, 'Фото' остается пустым и заполняется из прежних данных.
+    """
+    # Получаем отделы пользователя и их полные пути
+    dept_ids = user.get('UF_DEPARTMENT') or []
+    if not isinstance(dept_ids, list):
+        dept_ids = [dept_ids]
+    department_name = ", ".join(filter(None, (departments.name(dept_id) for dept_id in dept_ids)))
+    department_path = "; ".join(filter(None, (departments.path(dept_id) for dept_id in dept_ids)))
+    
+    # Формируем ФИО
+    fio_parts = []
+    if user.get('LAST_NAME'):
+        fio_parts.append(user['LAST_NAME'])
+    if user.get('NAME'):
+        fio_parts.append(user['NAME'])
+    if user.get('SECOND_NAME'):
+        fio_parts.append(user['SECOND_NAME'])
+    
+    full_name = " ".join(fio_parts) if fio_parts else user.get('LOGIN', 'Неизвестно')
+    
+    return {
+        'ФИО': full_name,
+        'Должность': user.get('WORK_POSITION', ''),
+        'Отдел': department_name,
+        'Путь_отдела': department_path,
+        'Фото': (photos or {}).get(str(user.get('ID'))),
+        'Email': user.get('EMAIL', ''),
+        'Телефон': user.get('WORK_PHONE', ''),
+        'ID_Bitrix24': user.get('ID', ''),
+        'Дата_синхронизации': synced_at
+    }
+
+
+def _keep_existing_photos(df_new: pd.DataFrame, df_old: pd.DataFrame) -> pd.DataFrame:
+    """Переносит фото из прежних данных тем сотрудникам, для которых новое фото не получено"""
+    if df_old.empty or 'Фото' not in df_old.columns or 'ID_Bitrix24' not in df_old.columns:
+        return df_new
+    
+    old_photos = pd.Series(df_old['Фото'].values, index=_normalize_ids(df_old['ID_Bitrix24']))
+    old_photos = old_photos[old_photos.notna() & (old_photos.astype(str).str.strip() != '')]
+    old_photos = old_photos[~old_photos.index.duplicated(keep='last')]
+    if old_photos.empty:
+        return df_new
+    
+    df_new = df_new.copy()
+    df_new['Фото'] = df_new['Фото'].astype(object)
+    missing = df_new['Фото'].isna()
+    df_new.loc[missing, 'Фото'] = _normalize_ids(df_new.loc[missing, 'ID_Bitrix24']).map(old_photos)
+    return df_new
+
+
+def _user_hash(user: Dict) -> str:
+    """Хэш содержимого пользователя Bitrix24 для поиска изменений без фильтров API"""
+    payload = json.dumps(user, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _is_active(user: Dict) -> bool:
+    """Проверяет флаг активности пользователя (API отдает bool или 'Y'/'N')"""
+    active = user.get('ACTIVE', True)
+    if isinstance(active, str):
+        return active.upper() in ('Y', 'TRUE', '1')
+    return bool(active)
+
+
+def _normalize_ids(series: pd.Series) -> pd.Series:
+    """Приводит ID к строкам без дробной части (Excel читает числа как float)"""
+    ids = series.fillna('').astype(str).str.strip()
+    numeric = pd.to_numeric(series, errors='coerce')
+    mask = numeric.notna()
+    ids[mask] = numeric[mask].astype('int64').astype(str)
+    return ids
+
+
+def _prepare_for_diff(df: pd.DataFrame, key: str, fields: List[str]) -> pd.DataFrame:
+    """Оставляет ключ и сравниваемые поля, приводя значения к нормализованным строкам"""
+    if key == 'ID_Bitrix24':
+        keys = _normalize_ids(df[key])
+    else:
+        keys = df[key].fillna('').astype(str).str.strip()
+    
+    prepared = pd.DataFrame({key: keys})
+    for field in fields:
+        if field in df.columns:
+            prepared[field] = df[field].fillna('').astype(str).str.strip()
+        else:
+            prepared[field] = ''
+    prepared = prepared[prepared[key] != '']
+    return prepared.drop_duplicates(subset=key, keep='last')
+
+
+def diff_contacts(df_old: pd.DataFrame, df_new: pd.DataFrame,
+                  key: str = 'ID_Bitrix24', fields: List[str] = None) -> Dict[str, Any]:
+    """
+    Сравнивает два набора контактов за один проход через merge по ключу
+    
+    Args:
+        df_old: Текущее содержимое файла контактов
+        df_new: Новые данные
+        key: Колонка-идентификатор (если ее нет в df_old, используется ФИО)
+        fields: Сравниваемые поля
+    
+    Returns:
+        Dict с ключами added, removed, changed (с изменениями по полям),
+        unchanged_count и key
+    """
+    fields = list(fields or DIFF_FIELDS)
+    
+    if key not in df_old.columns or key not in df_new.columns:
+        logger.info(f"Колонка {key} отсутствует, сравниваем записи по ФИО")
+        key = 'ФИО'
+    fields = [field for field in fields if field != key]
+    
+    old = _prepare_for_diff(df_old, key, fields)
+    new = _prepare_for_diff(df_new, key, fields)
+    
+    merged = old.merge(new, on=key, how='outer', suffixes=('_old', '_new'), indicator=True)
+    
+    added = merged[merged['_merge'] == 'right_only']
+    removed = merged[merged['_merge'] == 'left_only']
+    both = merged[merged['_merge'] == 'both']
+    
+    field_changes = pd.DataFrame(
+        {field: both[f'{field}_old'] != both[f'{field}_new'] for field in fields},
+        index=both.index
+    )
+    changed_mask = field_changes.any(axis=1)
+    changed = both[changed_mask]
+    
+    # Пары (строка, поле) только для реально изменившихся значений
+    changed_cells = field_changes[changed_mask].stack()
+    changed_cells = changed_cells[changed_cells]
+    
+    deltas: Dict[Any, Dict[str, Dict[str, str]]] = {}
+    for row_index, field in changed_cells.index:
+        deltas.setdefault(row_index, {})[field] = {
+            'old': changed.at[row_index, f'{field}_old'],
+            'new': changed.at[row_index, f'{field}_new']
+        }
+    
+    fio_new = 'ФИО' if key == 'ФИО' else 'ФИО_new'
+    fio_old = 'ФИО' if key == 'ФИО' else 'ФИО_old'
+    
+    return {
+        'key': key,
+        'added': added[[key, fio_new]].set_axis(['id', 'ФИО'], axis=1).to_dict('records'),
+        'removed': removed[[key, fio_old]].set_axis(['id', 'ФИО'], axis=1).to_dict('records'),
+        'changed': [
+            {'id': changed.at[row_index, key], 'ФИО': changed.at[row_index, fio_new], 'changes': changes}
+            for row_index, changes in deltas.items()
+        ],
+        'unchanged_count': int(len(both) - len(changed))
+    }
+
+
+async def _save_sync_cursor(cursor: Optional[str], hashes: Dict[str, str], removed_ids=(), replace: bool = False):
+    """Сохраняет курсор инкрементальной синхронизации (если он передан) и хэши пользователей"""
+    from database import init_sync_state_table, set_sync_state, save_bitrix24_user_hashes
+    
+    await init_sync_state_table()
+    await save_bitrix24_user_hashes(hashes, removed_ids=removed_ids, replace=replace)
+    if cursor:
+        await set_sync_state(SYNC_CURSOR_KEY, cursor)
+
+
+def _delta_from_users(users: List[Dict], missing_ids=()) -> Dict[str, Any]:
+    """
+    Формирует изменения из списка пользователей (включая деактивированных)
+    
+    missing_ids — ID, которые запрашивались, но не вернулись (удалены на портале).
+    """
+    changed_active = [user for user in users if _is_active(user)]
+    removed_ids = {str(user.get('ID')) for user in users if not _is_active(user)} | set(missing_ids)
+    return {
+        'changed': changed_active,
+        'removed_ids': removed_ids,
+        'hashes': {str(user.get('ID')): _user_hash(user) for user in changed_active},
+        'replace_hashes': False,
+        'bitrix_users': None
+    }
+
+
+async def _fetch_user_delta(client: Bitrix24Client, cursor: str) -> Optional[Dict[str, Any]]:
+    """
+    Получает изменения пользователей с момента cursor
+    
+    Сначала пробует фильтры >TIMESTAMP_X и >DATE_REGISTER. Если портал их не
+    поддерживает (ошибка или фильтр проигнорирован), сравнивает хэши всех
+    активных пользователей с сохраненными.
+    
+    Фильтры не возвращают пользователей, удаленных на портале (а не
+    деактивированных), поэтому выборка по фильтру сверяется с числом
+    активных пользователей (total одного запроса). Если после применения
+    изменений число известных пользователей расходится с порталом, списки
+    сверяются по хэшам, как без фильтров, и удаленные попадают в removed_ids.
+    
+    Returns:
+        Dict с ключами changed (активные новые/измененные), removed_ids и hashes,
+        либо None, если получить данные не удалось
+    """
+    from database import get_bitrix24_user_hashes
+    
+    since = datetime.fromisoformat(cursor)
+    
+    changed = await client.get_changed_users(since)
+    if changed is not None:
+        delta = _delta_from_users(changed)
+        known = set(await get_bitrix24_user_hashes())
+        expected = len((known | {str(user.get('ID')) for user in delta['changed']}) - delta['removed_ids'])
+        total = await client.get_users_total()
+        if total == expected:
+            logger.info(f"Инкрементальная выборка по фильтру: изменено {len(delta['changed'])}, "
+                        f"деактивировано {len(delta['removed_ids'])}")
+            delta['bitrix_users'] = total
+            return delta
+        logger.info(f"Активных пользователей в Bitrix24 {total}, после изменений ожидалось {expected}: "
+                    f"сверяем списки пользователей (удаление на портале)")
+    else:
+        logger.info("Фильтр по дате изменения недоступен, сравниваем хэши пользователей")
+    
+    users = await client.get_users()
+    if not users:
+        return None
+    
+    stored = await get_bitrix24_user_hashes()
+    hashes = {str(user.get('ID')): _user_hash(user) for user in users}
+    changed_active = [user for user in users if stored.get(str(user.get('ID'))) != hashes[str(user.get('ID'))]]
+    removed_ids = set(stored) - set(hashes)
+    
+    return {
+        'changed': changed_active,
+        'removed_ids': removed_ids,
+        'hashes': hashes,
+        'replace_hashes': True,
+        'bitrix_users': len(users)
+    }
+
+
+async def _sync_incremental(client: Bitrix24Client, excel_file: str, cursor: Optional[str],
+                            started_at: datetime, delta: Dict[str, Any] = None,
+                            mode: str = 'incremental') -> Optional[Dict[str, Any]]:
+    """
+    Применяет к файлу контактов только изменения с момента последней синхронизации
+    
+    Если delta передана (изменения из событий Bitrix24), она применяется
+    без запроса изменений по курсору, а курсор не сдвигается.
+    
+    Returns:
+        Dict с результатами или None, если нужна полная синхронизация
+    """
+    try:
+        df_old = pd.read_excel(excel_file)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать существующий файл, выполняем полную синхронизацию: {e}")
+        return None
+    
+    if 'ID_Bitrix24' not in df_old.columns:
+        logger.info("В файле нет колонки ID_Bitrix24, выполняем полную синхронизацию")
+        return None
+    
+    if delta is None:
+        delta = await _fetch_user_delta(client, cursor)
+        if delta is None:
+            return None
+    
+    changed = delta['changed']
+    removed_ids = delta['removed_ids']
+    
+    old_ids = _normalize_ids(df_old['ID_Bitrix24'])
+    changed_ids = {str(user.get('ID')) for user in changed}
+    removed_count = int(old_ids.isin(removed_ids).sum())
+    
+    if changed:
+        departments = await get_department_tree(client)
+        photo_sync = create_photo_sync(client)
+        photos = await photo_sync.fetch(changed) if photo_sync else {}
+        synced_at = started_at.strftime('%Y-%m-%d %H:%M:%S')
+        df_changed = pd.DataFrame([_user_to_record(user, departments, synced_at, photos) for user in changed])
+        df_changed = _keep_existing_photos(df_changed, df_old)
+    else:
+        df_changed = pd.DataFrame(columns=df_old.columns)
+    
+    file_changed = False
+    if changed or removed_count:
+        df_kept = df_old[~old_ids.isin(changed_ids | removed_ids)]
+        df_new = pd.concat([df_kept, df_changed], ignore_index=True)
+        file_changed = write_contacts_file(df_new, excel_file, current=df_old)
+        if file_changed:
+            _remember_row_count(excel_file, len(df_new))
+    else:
+        df_new = df_old
+        logger.info("Изменений в Bitrix24 нет, файл контактов не перезаписывается")
+    
+    await _save_sync_cursor(
+        _cursor_from(started_at) if cursor else None, delta['hashes'],
+        removed_ids=removed_ids, replace=delta['replace_hashes']
+    )
+    
+    diff = diff_contacts(df_old, df_new)
+    
+    logger.info(f"Инкрементальная синхронизация завершена. Записей: {len(df_new)}")
+    
+    bitrix_users = delta['bitrix_users'] if delta['bitrix_users'] is not None else len(df_new)
+    
+    return _sync_result(mode, started_at, len(df_old), len(df_new), bitrix_users, diff,
+                        file_changed=file_changed)
+
+
+def _sync_result(mode: str, started_at: datetime, initial_count: int, final_count: int,
+                 bitrix_users: int, diff: Dict[str, Any], **details) -> Dict[str, Any]:
+    """Формирует результат синхронизации в формате, который ожидают обработчики"""
+    return {
+        'success': True,
+        'before': {
+            'excel_records': initial_count,
+            'bitrix_users': bitrix_users,
+            'last_check': started_at.strftime('%Y-%m-%d %H:%M:%S')
+        },
+        'details': {
+            'mode': mode,
+            'initial_count': initial_count,
+            'final_count': final_count,
+            'updated_count': len(diff['changed']),
+            'added_count': len(diff['added']),
+            'removed_count': len(diff['removed']),
+            'skipped_count': diff['unchanged_count'],
+            'bitrix_users': bitrix_users,
+            **details
+        },
+        'diff': diff
+    }
+
+
+def _cursor_from(started_at: datetime) -> str:
+    """Курсор с запасом на расхождение часов: повторное применение изменений безопасно"""
+    return (started_at - timedelta(seconds=CURSOR_OVERLAP_SECONDS)).isoformat(timespec='seconds')
+
+
+def get_contacts_row_count(excel_file: str) -> int:
+    """
+    Количество записей в файле контактов
+    
+    Значение кэшируется по времени изменения и размеру файла, поэтому
+    файл перечитывается только после того, как он изменился.
+    """
+    try:
+        stat = os.stat(excel_file)
+    except OSError:
+        return 0
+    
+    signature = (stat.st_mtime, stat.st_size)
+    cached = _row_count_cache.get(excel_file)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    try:
+        count = len(pd.read_excel(excel_file, usecols=[0]))
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать Excel файл: {e}")
+        return 0
+    
+    _row_count_cache[excel_file] = (signature, count)
+    return count
+
+
+def _remember_row_count(excel_file: str, count: int):
+    """Обновляет кэш количества записей после записи файла"""
+    try:
+        stat = os.stat(excel_file)
+    except OSError:
+        return
+    _row_count_cache[excel_file] = ((stat.st_mtime, stat.st_size), count)
+
+
+async def fetch_snapshot(client: Bitrix24Client, refresh_departments: bool = False) -> Dict[str, Any]:
+    """
+    Загружает снимок данных Bitrix24 (пользователи и отделы) за один проход
+    
+    Из снимка затем строятся статус, изменения и файл контактов,
+    поэтому повторно обращаться к API не нужно.
+    """
+    started_at = datetime.now().astimezone()
+    
+    logger.info("Получаем пользователей из Bitrix24...")
+    users = await client.get_users()
+    
+    departments = await get_department_tree(client, force=refresh_departments)
+    
+    photo_sync = create_photo_sync(client)
+    photos = await photo_sync.fetch(users) if photo_sync else {}
+    
+    return {
+        'users': users,
+        'departments': departments,
+        'photos': photos,
+        'started_at': started_at
+    }
+
+
+async def apply_snapshot(snapshot: Dict[str, Any], excel_file: str = None) -> Dict[str, Any]:
+    """
+    Строит файл контактов из снимка Bitrix24
+    
+    Существующий файл читается один раз: из него берутся статус до
+    синхронизации и данные для сравнения.
+    
+    Returns:
+        Dict с результатами синхронизации (success, before, details, diff)
+    """
+    if excel_file is None:
+        from config import EXCEL_FILE
+        excel_file = EXCEL_FILE
+    
+    users = snapshot['users']
+    started_at = snapshot['started_at']
+    departments = snapshot['departments']
+    
+    # Подготавливаем данные для Excel
+    synced_at = started_at.strftime('%Y-%m-%d %H:%M:%S')
+    photos = snapshot.get('photos')
+    excel_data = [_user_to_record(user, departments, synced_at, photos) for user in users]
+    
+    # Создаем DataFrame
+    df_new = pd.DataFrame(excel_data)
+    
+    # Читаем существующий файл для сравнения
+    df_old = pd.DataFrame(columns=df_new.columns)
+    if os.path.exists(excel_file):
+        try:
+            df_old = pd.read_excel(excel_file)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать существующий файл: {e}")
+    
+    df_new = _keep_existing_photos(df_new, df_old)
+    diff = diff_contacts(df_old, df_new)
+    
+    # Сохраняем новый файл (только если контакты изменились)
+    file_changed = write_contacts_file(df_new, excel_file, current=df_old if os.path.exists(excel_file) else None)
+    final_count = len(df_new)
+    if file_changed:
+        _remember_row_count(excel_file, final_count)
+    
+    await _save_sync_cursor(
+        _cursor_from(started_at),
+        {str(user.get('ID')): _user_hash(user) for user in users},
+        replace=True
+    )
+    
+    logger.info(f"Синхронизация завершена. Записей: {final_count}")
+    
+    return _sync_result('full', started_at, len(df_old), final_count, len(users), diff,
+                        file_changed=file_changed)
+
+
+async def sync_bitrix24_to_excel(webhook_url: str, excel_file: str = None,
+                                 incremental: bool = False,
+                                 refresh_departments: bool = False) -> Dict[str, Any]:
     """
     Синхронизирует сотрудников из Bitrix24 в Excel файл
     
     Args:
         webhook_url: URL webhook'а Bitrix24
         excel_file: Путь к Excel файлу (если None, берется из config)
+        incremental: Загружать только изменения с последней синхронизации.
+            Если курсора еще нет, выполняется полная синхронизация.
+        refresh_departments: Загрузить отделы из Bitrix24, не дожидаясь истечения кэша
     
     Returns:
         Dict с результатами синхронизации
@@ -93,111 +927,285 @@ async def sync_bitrix24_to_excel(webhook_url: str, excel_file: str = None) -> Di
     
     logger.info(f"Начинаем синхронизацию Bitrix24 -> Excel: {excel_file}")
     
+    # Время начала в часовом поясе сервера: изменения, сделанные во время
+    # синхронизации, попадут в следующий запуск
+    started_at = datetime.now().astimezone()
+    
     try:
-        # Создаем клиент Bitrix24
-        client = Bitrix24Client(webhook_url)
-        
-        # Получаем данные из Bitrix24
-        logger.info("Получаем пользователей из Bitrix24...")
-        users = await client.get_users()
-        
-        logger.info("Получаем отделы из Bitrix24...")
-        departments = await client.get_departments()
-        
-        # Создаем словарь отделов для быстрого поиска
-        dept_dict = {dept['ID']: dept['NAME'] for dept in departments}
-        
-        # Подготавливаем данные для Excel
-        excel_data = []
-        
-        for user in users:
-            # Получаем отдел пользователя
-            department_name = ""
-            if 'UF_DEPARTMENT' in user and user['UF_DEPARTMENT']:
-                dept_ids = user['UF_DEPARTMENT']
-                if isinstance(dept_ids, list):
-                    dept_names = [dept_dict.get(str(dept_id), "") for dept_id in dept_ids]
-                    department_name = ", ".join(filter(None, dept_names))
+        async with Bitrix24Client(webhook_url) as client:
+            if incremental and os.path.exists(excel_file):
+                from database import init_sync_state_table, get_sync_state
+                
+                await init_sync_state_table()
+                cursor = await get_sync_state(SYNC_CURSOR_KEY)
+                
+                if cursor:
+                    result = await _sync_incremental(client, excel_file, cursor, started_at)
+                    if result is not None:
+                        return result
                 else:
-                    department_name = dept_dict.get(str(dept_ids), "")
-            
-            # Формируем ФИО
-            fio_parts = []
-            if user.get('LAST_NAME'):
-                fio_parts.append(user['LAST_NAME'])
-            if user.get('NAME'):
-                fio_parts.append(user['NAME'])
-            if user.get('SECOND_NAME'):
-                fio_parts.append(user['SECOND_NAME'])
+                    logger.info("Курсор синхронизации не найден, выполняем полную синхронизацию")
             
-            full_name = " ".join(fio_parts) if fio_parts else user.get('LOGIN', 'Неизвестно')
-            
-            # Добавляем запись
-            excel_data.append({
-                'ФИО': full_name,
-                'Должность': user.get('WORK_POSITION', ''),
-                'Отдел': department_name,
-                'Фото': None,  # Фото не синхронизируем из Bitrix24
-                'Email': user.get('EMAIL', ''),
-                'Телефон': user.get('WORK_PHONE', ''),
-                'ID_Bitrix24': user.get('ID', ''),
-                'Дата_синхронизации': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            })
-        
-        # Создаем DataFrame
-        df_new = pd.DataFrame(excel_data)
-        
-        # Читаем существующий файл для сравнения
-        initial_count = 0
-        updated_count = 0
-        added_count = 0
-        skipped_count = 0
-        
-        if os.path.exists(excel_file):
-            try:
-                df_old = pd.read_excel(excel_file)
-                initial_count = len(df_old)
-                
-                # Сравниваем записи по ФИО
-                for _, new_row in df_new.iterrows():
-                    fio = new_row['ФИО']
-                    old_row = df_old[df_old['ФИО'] == fio]
-                    
-                    if len(old_row) > 0:
-                        # Запись существует - проверяем изменения
-                        old_data = old_row.iloc[0]
-                        if (old_data['Должность'] != new_row['Должность'] or 
-                            old_data['Отдел'] != new_row['Отдел']):
-                            updated_count += 1
-                        else:
-                            skipped_count += 1
-                    else:
-                        # Новая запись
-                        added_count += 1
-                        
-            except Exception as e:
-                logger.warning(f"Не удалось прочитать существующий файл: {e}")
-                added_count = len(df_new)
-        else:
-            added_count = len(df_new)
-        
-        # Сохраняем новый файл
-        df_new.to_excel(excel_file, index=False)
-        final_count = len(df_new)
+            snapshot = await fetch_snapshot(client, refresh_departments=refresh_departments)
         
-        logger.info(f"Синхронизация завершена. Записей: {final_count}")
+        return await apply_snapshot(snapshot, excel_file)
         
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации: {e}")
         return {
-            'success': True,
-            'details': {
-                'initial_count': initial_count,
-                'final_count': final_count,
-                'updated_count': updated_count,
-                'added_count': added_count,
-                'skipped_count': skipped_count,
-                'bitrix_users': len(users)
-            }
+            'success': False,
+            'error': str(e)
         }
+
+# Колонки справочника сотрудников в SQLite и соответствующие колонки файла контактов
+DIRECTORY_COLUMNS = {
+    'fio': 'ФИО',
+    'position': 'Должность',
+    'department': 'Отдел',
+    'department_path': 'Путь_отдела',
+    'photo': 'Фото',
+    'email': 'Email',
+    'phone': 'Телефон',
+    'bitrix_id': 'ID_Bitrix24',
+    'synced_at': 'Дата_синхронизации'
+}
+
+
+def _record_to_directory_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Преобразует строку файла контактов в запись справочника SQLite"""
+    row = {column: record.get(title) for column, title in DIRECTORY_COLUMNS.items()}
+    row['bitrix_id'] = str(row['bitrix_id'])
+    return row
+
+
+def _directory_to_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Строит DataFrame файла контактов из записей справочника SQLite"""
+    df = pd.DataFrame(rows, columns=list(DIRECTORY_COLUMNS))
+    return df.rename(columns=DIRECTORY_COLUMNS)
+
+
+async def export_contacts_to_excel(excel_file: str = None) -> bool:
+    """
+    Выгружает справочник сотрудников из SQLite в файл контактов
+    
+    Файл перезаписывается только при изменении данных.
+    
+    Returns:
+        True, если файл был записан
+    """
+    from database import init_bitrix24_tables, get_bitrix24_users
+    
+    if excel_file is None:
+        from config import EXCEL_FILE
+        excel_file = EXCEL_FILE
+    
+    await init_bitrix24_tables()
+    df = _directory_to_frame(await get_bitrix24_users())
+    
+    current = None
+    if os.path.exists(excel_file):
+        try:
+            current = pd.read_excel(excel_file)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать существующий файл: {e}")
+    
+    written = write_contacts_file(df, excel_file, current=current)
+    if written:
+        _remember_row_count(excel_file, len(df))
+        logger.info(f"Файл контактов выгружен из справочника: {len(df)} записей")
+    return written
+
+
+async def _as_pages(users: List[Dict]) -> AsyncIterator[List[Dict]]:
+    """Выдает уже загруженный список пользователей страницами"""
+    for i in range(0, len(users), PAGE_SIZE):
+        yield users[i:i + PAGE_SIZE]
+
+
+async def _write_directory(pages: AsyncIterable[List[Dict]], departments: DepartmentTree,
+                           started_at: datetime, replace: bool, removed_ids=(),
+                           photo_sync: Optional[PhotoSync] = None,
+                           photos: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Записывает страницы пользователей в справочник SQLite по мере их поступления
+    
+    Страницы (вместе с фото из photo_sync) копятся во временной таблице,
+    пока следующие страницы загружаются из API; в справочник они переносятся
+    одной короткой транзакцией в конце, поэтому загрузка из Bitrix24 не
+    держит блокировку записи bot.db. Изменения считаются постранично по
+    прежним записям тех же сотрудников, поэтому весь справочник в память не
+    загружается. Для сотрудников без нового фото остается прежний путь.
+    
+    Returns:
+        Dict с ключами diff, hashes, initial_count, final_count и users_count
+    """
+    from database import init_bitrix24_tables, bitrix24_directory_writer
+    
+    await init_bitrix24_tables()
+    
+    synced_at = started_at.strftime('%Y-%m-%d %H:%M:%S')
+    diff = {'key': 'ID_Bitrix24', 'added': [], 'removed': [], 'changed': [], 'unchanged_count': 0}
+    hashes: Dict[str, str] = {}
+    
+    async with bitrix24_directory_writer(replace=replace) as writer:
+        async for users in pages:
+            page_photos = dict(photos or {})
+            if photo_sync:
+                page_photos.update(await photo_sync.fetch(users, save=False))
+            records = [_user_to_record(user, departments, synced_at, page_photos) for user in users]
+            previous = await writer.write([_record_to_directory_row(record) for record in records])
+            
+            page_diff = diff_contacts(
+                _directory_to_frame(previous),
+                pd.DataFrame(records, columns=list(DIRECTORY_COLUMNS.values()))
+            )
+            diff['added'].extend(page_diff['added'])
+            diff['changed'].extend(page_diff['changed'])
+            diff['unchanged_count'] += page_diff['unchanged_count']
+            hashes.update((str(user.get('ID')), _user_hash(user)) for user in users)
+        
+        removed = await writer.apply(removed_ids)
+        diff['removed'] = [{'id': row['bitrix_id'], 'ФИО': row['fio']} for row in removed]
+    
+    if photo_sync:
+        await photo_sync.save()
+    
+    return {
+        'diff': diff,
+        'hashes': hashes,
+        'initial_count': writer.initial_count,
+        'final_count': writer.initial_count + len(diff['added']) - len(removed),
+        'users_count': writer.written_count
+    }
+
+
+async def apply_snapshot_to_sqlite(snapshot: Dict[str, Any], excel_file: str = None) -> Dict[str, Any]:
+    """
+    Записывает снимок Bitrix24 в справочник SQLite одной транзакцией
+    
+    Args:
+        snapshot: Результат fetch_snapshot
+        excel_file: Если указан, после записи из справочника выгружается файл контактов
+    
+    Returns:
+        Dict с результатами синхронизации (success, before, details, diff)
+    """
+    started_at = snapshot['started_at']
+    written = await _write_directory(
+        _as_pages(snapshot['users']), snapshot['departments'], started_at, replace=True,
+        photos=snapshot.get('photos')
+    )
+    return await _finish_sqlite_sync('full', written, started_at, excel_file)
+
+
+async def _finish_sqlite_sync(mode: str, written: Dict[str, Any], started_at: datetime,
+                              excel_file: Optional[str], removed_ids=(), replace_hashes: bool = True,
+                              hashes: Dict[str, str] = None, bitrix_users: int = None,
+                              advance_cursor: bool = True) -> Dict[str, Any]:
+    """Сохраняет курсор, выгружает файл контактов и формирует результат синхронизации в SQLite"""
+    await _save_sync_cursor(
+        _cursor_from(started_at) if advance_cursor else None,
+        written['hashes'] if hashes is None else hashes,
+        removed_ids=removed_ids, replace=replace_hashes
+    )
+    
+    file_changed = await export_contacts_to_excel(excel_file) if excel_file else False
+    
+    final_count = written['final_count']
+    if bitrix_users is None:
+        bitrix_users = written['users_count'] if mode == 'full' else final_count
+    
+    logger.info(f"Синхронизация в SQLite завершена. Записей: {final_count}")
+    
+    return _sync_result(mode, started_at, written['initial_count'], final_count, bitrix_users,
+                        written['diff'], target='sqlite', file_changed=file_changed)
+
+
+async def _sync_incremental_sqlite(client: Bitrix24Client, cursor: Optional[str], started_at: datetime,
+                                   excel_file: Optional[str], delta: Dict[str, Any] = None,
+                                   mode: str = 'incremental') -> Optional[Dict[str, Any]]:
+    """
+    Применяет к справочнику SQLite только изменения с момента последней синхронизации
+    
+    Как и в _sync_incremental, переданная delta применяется без сдвига курсора.
+    """
+    from database import count_bitrix24_users
+    
+    if not await count_bitrix24_users():
+        logger.info("Справочник сотрудников пуст, выполняем полную синхронизацию")
+        return None
+    
+    if delta is None:
+        delta = await _fetch_user_delta(client, cursor)
+        if delta is None:
+            return None
+    
+    changed = delta['changed']
+    departments = await get_department_tree(client) if changed else DepartmentTree([])
+    
+    written = await _write_directory(
+        _as_pages(changed), departments, started_at, replace=False, removed_ids=delta['removed_ids'],
+        photo_sync=create_photo_sync(client)
+    )
+    return await _finish_sqlite_sync(
+        mode, written, started_at, excel_file,
+        removed_ids=delta['removed_ids'], replace_hashes=delta['replace_hashes'],
+        hashes=delta['hashes'], bitrix_users=delta['bitrix_users'], advance_cursor=bool(cursor)
+    )
+
+
+async def sync_bitrix24_to_sqlite(webhook_url: str, excel_file: str = None,
+                                  incremental: bool = False, export: bool = True,
+                                  refresh_departments: bool = False) -> Dict[str, Any]:
+    """
+    Синхронизирует сотрудников и отделы из Bitrix24 в справочник SQLite
+    
+    При полной синхронизации страницы пользователей записываются
+    в справочник по мере загрузки (Bitrix24Client.iter_users).
+    
+    Args:
+        webhook_url: URL webhook'а Bitrix24
+        excel_file: Путь к файлу контактов для выгрузки (если None, берется из config)
+        incremental: Загружать только изменения с последней синхронизации
+        export: Выгрузить файл контактов из справочника после синхронизации
+        refresh_departments: Загрузить отделы из Bitrix24, не дожидаясь истечения кэша
+    
+    Returns:
+        Dict с результатами синхронизации
+    """
+    from database import init_bitrix24_tables, init_sync_state_table, get_sync_state
+    
+    if excel_file is None:
+        from config import EXCEL_FILE
+        excel_file = EXCEL_FILE
+    export_file = excel_file if export else None
+    
+    logger.info("Начинаем синхронизацию Bitrix24 -> SQLite")
+    started_at = datetime.now().astimezone()
+    
+    try:
+        await init_bitrix24_tables()
+        
+        async with Bitrix24Client(webhook_url) as client:
+            if incremental:
+                await init_sync_state_table()
+                cursor = await get_sync_state(SYNC_CURSOR_KEY)
+                
+                if cursor:
+                    result = await _sync_incremental_sqlite(client, cursor, started_at, export_file)
+                    if result is not None:
+                        return result
+                else:
+                    logger.info("Курсор синхронизации не найден, выполняем полную синхронизацию")
+            
+            # Отделы нужны для преобразования каждой страницы, поэтому загружаются первыми
+            departments = await get_department_tree(client, force=refresh_departments)
+            written = await _write_directory(
+                client.iter_users(), departments, started_at, replace=True,
+                photo_sync=create_photo_sync(client)
+            )
+        
+        return await _finish_sqlite_sync('full', written, started_at, export_file)
         
     except Exception as e:
         logger.error(f"Ошибка синхронизации: {e}")
@@ -206,10 +1214,69 @@ async def sync_bitrix24_to_excel(webhook_url: str, excel_file: str = None) -> Di
             'error': str(e)
         }
 
+
+async def sync_bitrix24(webhook_url: str, excel_file: str = None, incremental: bool = False,
+                       refresh_departments: bool = False, target: str = None) -> Dict[str, Any]:
+    """
+    Синхронизирует сотрудников Bitrix24 в хранилище, выбранное в BITRIX24_SYNC_TARGET
+    
+    Args:
+        target: 'excel' или 'sqlite' (если None, берется из config)
+    """
+    if target is None:
+        from config import BITRIX24_SYNC_TARGET
+        target = BITRIX24_SYNC_TARGET
+    
+    if target == 'sqlite':
+        return await sync_bitrix24_to_sqlite(webhook_url, excel_file, incremental=incremental,
+                                             refresh_departments=refresh_departments)
+    return await sync_bitrix24_to_excel(webhook_url, excel_file, incremental=incremental,
+                                        refresh_departments=refresh_departments)
+
+
+async def apply_user_events(client: Bitrix24Client, user_ids: List[Any], excel_file: str = None,
+                            target: str = None) -> Optional[Dict[str, Any]]:
+    """
+    Применяет к хранилищу контактов изменения отдельных пользователей (из событий Bitrix24)
+    
+    Пользователи запрашиваются по ID; деактивированные и не найденные на
+    портале удаляются. Курсор инкрементальной синхронизации не сдвигается.
+    
+    Returns:
+        Dict с результатами или None, если хранилище еще не заполнено
+        и нужна полная синхронизация
+    """
+    if excel_file is None:
+        from config import EXCEL_FILE
+        excel_file = EXCEL_FILE
+    if target is None:
+        from config import BITRIX24_SYNC_TARGET
+        target = BITRIX24_SYNC_TARGET
+    
+    started_at = datetime.now().astimezone()
+    requested = {str(user_id) for user_id in user_ids}
+    
+    users = await client.get_users_by_ids(sorted(requested))
+    found = {str(user.get('ID')) for user in users}
+    delta = _delta_from_users(users, missing_ids=requested - found)
+    
+    logger.info(f"События Bitrix24: обновлено {len(delta['changed'])}, удалено {len(delta['removed_ids'])}")
+    
+    if target == 'sqlite':
+        return await _sync_incremental_sqlite(client, None, started_at, excel_file, delta=delta, mode='events')
+    
+    if not os.path.exists(excel_file):
+        return None
+    return await _sync_incremental(client, excel_file, None, started_at, delta=delta, mode='events')
+
+
 async def get_sync_status(webhook_url: str, excel_file: str = None) -> Dict[str, Any]:
     """
     Получает статус синхронизации
     
+    Облегченная проверка: один запрос к API (total первой страницы)
+    и количество строк файла из кэша, без загрузки всех сотрудников.
+    
     Args:
         webhook_url: URL webhook'а Bitrix24
         excel_file: Путь к Excel файлу
@@ -222,22 +1289,16 @@ async def get_sync_status(webhook_url: str, excel_file: str = None) -> Dict[str,
         excel_file = EXCEL_FILE
     
     try:
-        # Получаем количество пользователей в Bitrix24
-        client = Bitrix24Client(webhook_url)
-        users = await client.get_users()
+        # Количество пользователей в Bitrix24 берется из total первой страницы
+        async with Bitrix24Client(webhook_url) as client:
+            bitrix_users = await client.get_users_total()
         
-        # Получаем количество записей в Excel
-        excel_records = 0
-        if os.path.exists(excel_file):
-            try:
-                df = pd.read_excel(excel_file)
-                excel_records = len(df)
-            except Exception as e:
-                logger.warning(f"Не удалось прочитать Excel файл: {e}")
+        # Количество записей в Excel кэшируется до изменения файла
+        excel_records = get_contacts_row_count(excel_file)
         
         return {
             'excel_records': excel_records,
-            'bitrix_users': len(users),
+            'bitrix_users': bitrix_users,
             'last_check': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
@@ -5,20 +5,29 @@ Telegram бот для офиса - модульная версия
 
 import asyncio
 import logging
+import re
+import signal
 import sys
-from datetime import datetime, timedelta, time
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Импорты конфигурации
-from config import BOT_TOKEN, ADMIN_ID, DB_PATH
+from config import (
+    BOT_TOKEN, ADMIN_ID, DB_PATH, INSTANCE_ID, JOB_LEASE_TTL, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+    WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_DELETE_ON_SHUTDOWN, TELEGRAM_API_SERVER,
+    FSM_STORAGE, FSM_STATE_TTL
+)
 
 # Импорты модулей
 from handlers import register_all_handlers
 from database import init_db
-from services import NotificationService
+from services import (
+    NotificationService, JobScheduler, LeaseManager, SQLiteLeaseBackend, set_lease_manager,
+    broadcast_job_worker, setup_outbound_dispatcher, bulk_sends, create_bot, set_bot, SQLiteStorage
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -28,55 +37,39 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-storage = MemoryStorage()
+# Единственный экземпляр бота и HTTP-сессии: обработчики и сервисы получают его через get_bot()
+bot = set_bot(create_bot(BOT_TOKEN, TELEGRAM_API_SERVER))
+# Все отправки бота проходят через диспетчер с лимитами Telegram и приоритетами
+outbound_dispatcher = setup_outbound_dispatcher(bot)
+# Состояния диалогов в базе переживают перезапуск; MemoryStorage — для отладки
+storage = SQLiteStorage(DB_PATH, ttl=FSM_STATE_TTL) if FSM_STORAGE == 'sqlite' else MemoryStorage()
 dp = Dispatcher(storage=storage)
 
 # Сервисы
 notification_service = NotificationService(bot)
 
 
-async def periodic_tasks():
-    """Периодические задачи"""
-    while True:
-        try:
-            current_time = datetime.now()
-            
-            # Уведомления о кофе в 10:00
-            if current_time.time() >= time(10, 0) and current_time.time() < time(10, 30):
-                await send_coffee_notifications()
-            
-            # Периодическая синхронизация канала в 17:00
-            if current_time.time() >= time(17, 0) and current_time.time() < time(17, 30):
-                await periodic_channel_sync()
-            
-            # Ожидание 30 минут до следующей проверки
-            await asyncio.sleep(1800)  # 30 минут
-            
-        except Exception as e:
-            logger.error(f"Ошибка в периодических задачах: {e}")
-            await asyncio.sleep(300)  # 5 минут при ошибке
-
-
 async def send_coffee_notifications():
     """Отправка уведомлений о кофе"""
     try:
-        from database import get_coffee_notifications
+        from database import get_coffee_notifications, mark_coffee_notifications_sent
         
         notifications = await get_coffee_notifications()
+        if not notifications:
+            return
+        
+        # Напоминания отправляются параллельно и уступают очередь интерактивным ответам бота
+        with bulk_sends():
+            results = await asyncio.gather(*(
+                notification_service.send_coffee_reminder(user_id, fio, date)
+                for _, fio, date, user_id in notifications
+            ))
         
-        for notification in notifications:
-            user_id, fio, date = notification[3], notification[1], notification[2]
-            
-            success = await notification_service.send_coffee_reminder(user_id, fio, date)
-            
-            if success:
-                # Отмечаем уведомление как отправленное
-                from database import mark_coffee_notification_sent
-                await mark_coffee_notification_sent(notification[0])
+        # Отмечаем отправленные уведомления одним запросом
+        sent_ids = [notification[0] for notification, success in zip(notifications, results) if success]
+        await mark_coffee_notifications_sent(sent_ids)
         
-        if notifications:
-            logger.info(f"📢 Отправлено {len(notifications)} уведомлений о кофе")
+        logger.info(f"📢 Отправлено {len(sent_ids)} из {len(notifications)} уведомлений о кофе")
         
     except Exception as e:
         logger.error(f"Ошибка отправки уведомлений о кофе: {e}")
@@ -98,6 +91,23 @@ async def periodic_channel_sync():
         logger.error(f"Ошибка периодической синхронизации канала: {e}")
 
 
+def create_scheduler() -> JobScheduler:
+    """Периодические задачи бота"""
+    # Аренда задач: при нескольких экземплярах бота каждую задачу и каждую рассылку выполняет один из них
+    leases = set_lease_manager(LeaseManager(SQLiteLeaseBackend(), INSTANCE_ID, JOB_LEASE_TTL))
+    scheduler = JobScheduler(leases)
+    # Запуск, пропущенный из-за перезапуска, выполняется, если с его времени прошло не больше catch_up_window секунд.
+    # Напоминание о кофе после полудня уже бесполезно и приходит посреди рабочего дня — догоняем до 12:00
+    scheduler.add_job('coffee_notifications', '0 10 * * *', send_coffee_notifications, catch_up_window=2 * 3600)
+    # Синхронизация канала идемпотентна и ничего не отправляет пользователям, а следующий запуск только
+    # через сутки: пропущенную синхронизацию выполняем при перезапуске до 23:00 того же дня
+    scheduler.add_job('channel_sync', '0 17 * * *', periodic_channel_sync, catch_up_window=6 * 3600)
+    return scheduler
+
+
+scheduler = create_scheduler()
+
+
 async def on_startup():
     """Действия при запуске бота"""
     logger.info("🚀 Запуск бота...")
@@ -149,32 +159,136 @@ async def on_shutdown():
     logger.info("✅ Бот остановлен")
 
 
+async def wait_for_stop_signal():
+    """Ждет SIGINT/SIGTERM (в polling их обрабатывает aiogram)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка через KeyboardInterrupt
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+
+def check_webhook_secret(secret: str):
+    """
+    Проверяет WEBHOOK_SECRET
+
+    Raises:
+        ValueError: Секрет не задан или не подходит Telegram (1-256 символов A-Z, a-z, 0-9, _ и -)
+    """
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET обязателен в режиме webhook")
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', secret):
+        raise ValueError("WEBHOOK_SECRET может содержать только A-Z, a-z, 0-9, _ и - (до 256 символов)")
+
+
+async def run_webhook(dispatcher: Dispatcher = dp, webhook_bot: Bot = bot, url: str = WEBHOOK_URL,
+                      path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET, host: str = WEBHOOK_HOST,
+                      port: int = WEBHOOK_PORT, delete_on_shutdown: bool = WEBHOOK_DELETE_ON_SHUTDOWN,
+                      stop: asyncio.Event = None):
+    """
+    Получение обновлений через webhook
+
+    Обновления принимает встроенный aiohttp-сервер; запросы без верного
+    X-Telegram-Bot-Api-Secret-Token отклоняются. Webhook регистрируется в
+    Telegram после запуска сервера. При остановке он удаляется только с
+    WEBHOOK_DELETE_ON_SHUTDOWN: при перезапуске или замене экземпляра
+    обновления копятся в Telegram и доставляются новому процессу, а не
+    теряются между deleteWebhook и setWebhook.
+
+    Args:
+        stop: Событие остановки (по умолчанию — SIGINT/SIGTERM)
+
+    Raises:
+        ValueError: WEBHOOK_SECRET не задан или некорректен
+    """
+    check_webhook_secret(secret)
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dispatcher, bot=webhook_bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dispatcher, bot=webhook_bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        webhook_url = url.rstrip('/') + path
+        await webhook_bot.set_webhook(webhook_url, secret_token=secret,
+                                      allowed_updates=dispatcher.resolve_used_update_types())
+        logger.info(f"✅ Webhook {webhook_url}, сервер {host}:{port}")
+        if stop is None:
+            await wait_for_stop_signal()
+        else:
+            await stop.wait()
+    finally:
+        if delete_on_shutdown:
+            try:
+                await webhook_bot.delete_webhook()
+            except Exception as e:
+                logger.warning(f"Не удалось удалить webhook: {e}")
+        await runner.cleanup()
+
+
+async def run_polling():
+    """Получение обновлений через long polling"""
+    # Webhook, оставшийся после аварийной остановки, мешает getUpdates
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
+
+
 async def main():
     """Главная функция"""
     try:
+        if BOT_MODE == 'webhook' and WEBHOOK_URL:
+            try:
+                check_webhook_secret(WEBHOOK_SECRET)
+            except ValueError as e:
+                logger.error(f"❌ {e}")
+                return
+        
         # Запуск
         if not await on_startup():
             logger.error("❌ Ошибка запуска бота")
             return
         
         # Запуск периодических задач в фоне
-        periodic_task = asyncio.create_task(periodic_tasks())
+        scheduler_task = asyncio.create_task(scheduler.run())
+        # Продолжение прерванных рассылок и задания из веб-интерфейса
+        broadcast_task = asyncio.create_task(broadcast_job_worker(bot))
         
-        # Запуск поллинга
+        # Получение обновлений
         try:
-            await dp.start_polling(bot)
+            if BOT_MODE == 'webhook' and WEBHOOK_URL:
+                await run_webhook()
+            else:
+                if BOT_MODE == 'webhook':
+                    logger.warning("WEBHOOK_URL не задан, используется polling")
+                await run_polling()
         finally:
-            periodic_task.cancel()
-            try:
-                await periodic_task
-            except asyncio.CancelledError:
-                pass
+            for task in (scheduler_task, broadcast_task):
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
     
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
     
     finally:
+        # Уведомление об остановке идет через диспетчер исходящих сообщений,
+        # поэтому он закрывается после on_shutdown, затем хранилище и сессия
         await on_shutdown()
+        await outbound_dispatcher.close()
+        await storage.close()
         await bot.session.close()
 
 
@@ -10,12 +10,38 @@ MARKETER_ID = int(os.getenv("MARKETER_ID", "0"))
 CHAT_ID = int(os.getenv("CHAT_ID"))
 GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID", "0"))
 CHANNEL_CHAT_ID = int(os.getenv("CHANNEL_CHAT_ID", "0"))  # ID канала
+# Чат, в который один раз загружаются файлы рассылок (по умолчанию чат администратора)
+BROADCAST_STORAGE_CHAT_ID = int(os.getenv("BROADCAST_STORAGE_CHAT_ID", "0")) or ADMIN_ID
 EXCEL_FILE = os.getenv("EXCEL_FILE")
 ADMIN_WEB_PASSWORD = os.getenv("ADMIN_WEB_PASSWORD")
 MODERATOR_WEB_PASSWORD = os.getenv("MODERATOR_WEB_PASSWORD")
 BITRIX24_WEBHOOK = os.getenv("BITRIX24_WEBHOOK")
+BITRIX24_SYNC_TARGET = os.getenv("BITRIX24_SYNC_TARGET", "excel").lower()  # excel или sqlite
+BITRIX24_SYNC_PHOTOS = os.getenv("BITRIX24_SYNC_PHOTOS", "false").lower() in ("1", "true", "yes")
+BITRIX24_PHOTO_DIR = os.getenv("BITRIX24_PHOTO_DIR", "photos")  # Хранилище фото сотрудников
+BITRIX24_EVENT_TOKEN = os.getenv("BITRIX24_EVENT_TOKEN")  # application_token исходящего вебхука
+BITRIX24_EVENTS_HOST = os.getenv("BITRIX24_EVENTS_HOST", "0.0.0.0")
+BITRIX24_EVENTS_PORT = int(os.getenv("BITRIX24_EVENTS_PORT", "8081"))
+BITRIX24_EVENTS_PATH = os.getenv("BITRIX24_EVENTS_PATH", "/bitrix24/events")
+BITRIX24_RECONCILE_INTERVAL = int(os.getenv("BITRIX24_RECONCILE_INTERVAL", "21600"))  # секунд, 0 - отключить
 CHANNEL_USERS_EXCEL = os.getenv("CHANNEL_USERS_EXCEL")  # Excel файл с пользователями канала
 DB_PATH = 'bot.db'
+# Получение обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес бота, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Обязателен при BOT_MODE=webhook
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Удалять webhook при остановке (по умолчанию нет: при перезапуске обновления ждут в Telegram)
+WEBHOOK_DELETE_ON_SHUTDOWN = os.getenv("WEBHOOK_DELETE_ON_SHUTDOWN", "false").lower() in ("1", "true", "yes")
+# Хранилище состояний диалогов: sqlite (переживает перезапуск) или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))  # секунд без изменений до удаления состояния
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")  # Свой Bot API сервер, например fake_telegram_server.py
+# Идентификатор экземпляра бота для аренды периодических задач (по умолчанию хост:PID)
+INSTANCE_ID = os.getenv("INSTANCE_ID")
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "60"))  # секунд
 TELEGRAM_API_ID = int(os.getenv("TELEGRAM_API_ID"))
 TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
 PYROGRAM_SESSION = os.getenv("PYROGRAM_SESSION")  # Например, "pyrogram_session"
@@ -1,10 +1,23 @@
 import aiosqlite
+import asyncio
 import logging
+import sqlite3
 import datetime
+from contextlib import asynccontextmanager
 from config import ADMIN_ID, DB_PATH
+from utils.helpers import normalize_fio
 
 logger = logging.getLogger(__name__)
 
+async def _fill_fio_keys(conn, table: str):
+    """Заполняет fio_key записей, у которых он еще не вычислен"""
+    async with conn.execute(f'SELECT rowid, fio FROM {table} WHERE fio_key IS NULL') as cursor:
+        rows = await cursor.fetchall()
+    if rows:
+        await conn.executemany(
+            f'UPDATE {table} SET fio_key = ? WHERE rowid = ?', [(normalize_fio(fio), rowid) for rowid, fio in rows]
+        )
+
 async def init_db():
     try:
         async with aiosqlite.connect(DB_PATH) as conn:
@@ -23,6 +36,15 @@ async def init_db():
             if 'role' not in column_names:
                 await conn.execute('ALTER TABLE authorized_users ADD COLUMN role TEXT DEFAULT "user"')
                 logger.info("Добавлен столбец role в authorized_users.")
+            if 'unreachable_at' not in column_names:
+                # Пользователь заблокировал бота или удалил аккаунт: рассылки его пропускают
+                await conn.execute('ALTER TABLE authorized_users ADD COLUMN unreachable_at DATETIME')
+                await conn.execute('ALTER TABLE authorized_users ADD COLUMN unreachable_reason TEXT')
+                logger.info("Добавлены столбцы unreachable_at, unreachable_reason в authorized_users.")
+            if 'fio_key' not in column_names:
+                # Нормализованное ФИО (normalize_fio): по нему график кофе соединяется с пользователями
+                await conn.execute('ALTER TABLE authorized_users ADD COLUMN fio_key TEXT')
+                logger.info("Добавлен столбец fio_key в authorized_users.")
             
             # Новая таблица для предложений новостей
             await conn.execute('''
@@ -80,6 +102,14 @@ async def init_db():
                 await conn.execute('ALTER TABLE coffee_schedule ADD COLUMN notified_at DATETIME')
             if 'reminder_sent_at' not in column_names:
                 await conn.execute('ALTER TABLE coffee_schedule ADD COLUMN reminder_sent_at DATETIME')
+            if 'fio_key' not in column_names:
+                await conn.execute('ALTER TABLE coffee_schedule ADD COLUMN fio_key TEXT')
+            
+            # Записи, добавленные до появления fio_key или в обход функций этого модуля
+            await _fill_fio_keys(conn, 'authorized_users')
+            await _fill_fio_keys(conn, 'coffee_schedule')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_authorized_users_fio_key ON authorized_users(fio_key)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_coffee_schedule_date ON coffee_schedule(date)')
             
             logger.info("Таблица coffee_schedule обновлена.")
             await conn.execute('''
@@ -91,6 +121,65 @@ async def init_db():
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            
+            # Задания массовой рассылки и статус доставки каждому получателю
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,  -- JSON: текст, parse_mode
+                    audience TEXT,  -- описание получателей для отчетов
+                    status TEXT DEFAULT 'queued',  -- queued, running, done
+                    created_by INTEGER,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    started_at DATETIME,
+                    finished_at DATETIME
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    job_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status TEXT DEFAULT 'pending',  -- pending, sending, sent, failed, unknown
+                    error TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (job_id, user_id)
+                )
+            ''')
+            await conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_status ON broadcast_deliveries (job_id, status)'
+            )
+            
+            # Последние запуски периодических задач (планировщик)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                    name TEXT PRIMARY KEY,
+                    last_run_at DATETIME NOT NULL,  -- время запуска по расписанию
+                    status TEXT,  -- ok, error
+                    error TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Аренда задач: при нескольких экземплярах бота задачу выполняет один
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    token INTEGER NOT NULL,  -- fencing token, растет при каждом захвате
+                    expires_at REAL NOT NULL  -- unix time
+                )
+            ''')
+            
+            # Состояния диалогов FSM (services/fsm_storage.py)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',  -- JSON
+                    updated_at REAL NOT NULL  -- unix time
+                )
+            ''')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)')
             await conn.commit()
     except Exception as e:
         logger.error(f"Ошибка при инициализации БД: {e}")
@@ -194,6 +283,666 @@ async def get_notified_bot_users():
         logger.error(f"Ошибка получения уведомлённых пользователей: {e}")
         return set()
 
+# Состояние синхронизации с внешними системами (курсоры, хэши записей)
+async def init_sync_state_table():
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bitrix24_user_hashes (
+                    bitrix_id TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL
+                )
+            ''')
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации таблиц состояния синхронизации: {e}")
+
+async def get_sync_state(key: str, default: str = None):
+    """Получает сохраненное значение состояния синхронизации"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute('SELECT value FROM sync_state WHERE key = ?', (key,)) as cursor:
+                row = await cursor.fetchone()
+            return row[0] if row else default
+    except Exception as e:
+        logger.error(f"Ошибка получения состояния синхронизации {key}: {e}")
+        return default
+
+async def set_sync_state(key: str, value: str):
+    """Сохраняет значение состояния синхронизации"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            await conn.execute(
+                'INSERT OR REPLACE INTO sync_state (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+                (key, value)
+            )
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения состояния синхронизации {key}: {e}")
+
+async def get_bitrix24_user_hashes():
+    """Получает хэши пользователей Bitrix24 из последней синхронизации"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute('SELECT bitrix_id, hash FROM bitrix24_user_hashes') as cursor:
+                rows = await cursor.fetchall()
+            return {row[0]: row[1] for row in rows}
+    except Exception as e:
+        logger.error(f"Ошибка получения хэшей пользователей Bitrix24: {e}")
+        return {}
+
+async def save_bitrix24_user_hashes(hashes: dict, removed_ids=(), replace: bool = False):
+    """Сохраняет хэши пользователей Bitrix24 (replace=True заменяет весь набор)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            if replace:
+                await conn.execute('DELETE FROM bitrix24_user_hashes')
+            await conn.executemany(
+                'INSERT OR REPLACE INTO bitrix24_user_hashes (bitrix_id, hash) VALUES (?, ?)',
+                list(hashes.items())
+            )
+            await conn.executemany(
+                'DELETE FROM bitrix24_user_hashes WHERE bitrix_id = ?',
+                [(bitrix_id,) for bitrix_id in removed_ids]
+            )
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения хэшей пользователей Bitrix24: {e}")
+
+# Справочник сотрудников Bitrix24: основной источник данных, файл контактов строится из него
+async def init_bitrix24_tables():
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bitrix24_users (
+                    bitrix_id TEXT PRIMARY KEY,
+                    fio TEXT NOT NULL,
+                    fio_key TEXT NOT NULL,  -- нормализованное ФИО для сортировки
+                    position TEXT,
+                    department TEXT,
+                    department_path TEXT,  -- полный путь отдела от корня структуры
+                    email TEXT,
+                    phone TEXT,
+                    photo TEXT,
+                    synced_at DATETIME
+                )
+            ''')
+            async with conn.execute("PRAGMA table_info(bitrix24_users)") as cursor:
+                columns = await cursor.fetchall()
+            column_names = [column[1] for column in columns]
+            if 'department_path' not in column_names:
+                await conn.execute('ALTER TABLE bitrix24_users ADD COLUMN department_path TEXT')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_bitrix24_users_fio_key ON bitrix24_users (fio_key)')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bitrix24_photos (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    path TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bitrix24_departments (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    parent_id TEXT
+                )
+            ''')
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации таблиц Bitrix24: {e}")
+
+BITRIX24_USER_COLUMNS = ('bitrix_id', 'fio', 'position', 'department', 'department_path', 'email', 'phone', 'photo', 'synced_at')
+
+def _bitrix24_user_row(user: dict) -> tuple:
+    return (
+        str(user['bitrix_id']), user.get('fio') or '', normalize_fio(user.get('fio')),
+        user.get('position'), user.get('department'), user.get('department_path'), user.get('email'),
+        user.get('phone'), user.get('photo'), user.get('synced_at')
+    )
+
+class Bitrix24DirectoryWriter:
+    """
+    Запись справочника Bitrix24: страницы копятся во временной таблице, в
+    bitrix24_users они переносятся одной короткой транзакцией
+
+    Используется через bitrix24_directory_writer. Пока страницы загружаются
+    из API (с повторами и загрузкой фото), основная база не блокируется:
+    временная таблица соединения хранится отдельно от bot.db, и другие
+    соединения (состояния FSM, рассылки, аренда задач) пишут без ожидания.
+    Блокировка записи берется только в apply() на время переноса.
+    """
+
+    def __init__(self, conn, replace: bool):
+        self.conn = conn
+        self.replace = replace
+        self.initial_count = 0
+        self.written_count = 0
+
+    async def _start(self):
+        await self.conn.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS bitrix24_staging ('
+            'bitrix_id TEXT PRIMARY KEY, fio TEXT, fio_key TEXT, position TEXT, department TEXT, '
+            'department_path TEXT, email TEXT, phone TEXT, photo TEXT, synced_at TEXT)'
+        )
+        await self.conn.execute('DELETE FROM temp.bitrix24_staging')
+        await self.conn.commit()
+
+    async def _select_by_ids(self, ids: list) -> list:
+        rows = []
+        # Ограничение SQLite на число параметров запроса
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            async with self.conn.execute(
+                f'SELECT {", ".join(BITRIX24_USER_COLUMNS)} FROM main.bitrix24_users WHERE bitrix_id IN ({placeholders})',
+                chunk
+            ) as cursor:
+                rows.extend(dict(row) for row in await cursor.fetchall())
+        return rows
+
+    async def write(self, users: list) -> list:
+        """
+        Добавляет порцию сотрудников во временную таблицу
+
+        Returns:
+            Текущие записи этих сотрудников в справочнике (для подсчета изменений)
+        """
+        rows = [_bitrix24_user_row(user) for user in users]
+        previous = await self._select_by_ids([row[0] for row in rows])
+        await self.conn.executemany(
+            'INSERT OR REPLACE INTO temp.bitrix24_staging (bitrix_id, fio, fio_key, position, department, '
+            'department_path, email, phone, photo, synced_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+        await self.conn.commit()
+        self.written_count += len(rows)
+        return previous
+
+    async def apply(self, removed_ids=()) -> list:
+        """
+        Переносит записанных сотрудников в справочник одной транзакцией
+
+        Удаляет сотрудников removed_ids, а при replace=True — всех, кого нет
+        среди записанных. При ошибке справочник не изменяется.
+
+        Returns:
+            Удаленные записи
+        """
+        removed_ids = [str(bitrix_id) for bitrix_id in removed_ids]
+        await self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            async with self.conn.execute('SELECT COUNT(*) FROM main.bitrix24_users') as cursor:
+                self.initial_count = (await cursor.fetchone())[0]
+            await self.conn.execute('''
+                INSERT INTO main.bitrix24_users (bitrix_id, fio, fio_key, position, department, department_path,
+                                                 email, phone, photo, synced_at)
+                SELECT bitrix_id, fio, fio_key, position, department, department_path, email, phone, photo, synced_at
+                FROM temp.bitrix24_staging WHERE true
+                ON CONFLICT(bitrix_id) DO UPDATE SET
+                    fio = excluded.fio, fio_key = excluded.fio_key, position = excluded.position,
+                    department = excluded.department, department_path = excluded.department_path,
+                    email = excluded.email, phone = excluded.phone,
+                    photo = COALESCE(excluded.photo, bitrix24_users.photo), synced_at = excluded.synced_at
+            ''')
+            removed = await self._select_by_ids(removed_ids)
+            if self.replace:
+                async with self.conn.execute(
+                    f'SELECT {", ".join(BITRIX24_USER_COLUMNS)} FROM main.bitrix24_users '
+                    'WHERE bitrix_id NOT IN (SELECT bitrix_id FROM temp.bitrix24_staging)'
+                ) as cursor:
+                    known = {row['bitrix_id'] for row in removed}
+                    removed.extend(dict(row) for row in await cursor.fetchall() if row['bitrix_id'] not in known)
+            await self.conn.executemany(
+                'DELETE FROM main.bitrix24_users WHERE bitrix_id = ?', [(row['bitrix_id'],) for row in removed]
+            )
+            await self.conn.commit()
+        except BaseException:
+            await self.conn.rollback()
+            raise
+        return removed
+
+@asynccontextmanager
+async def bitrix24_directory_writer(replace: bool = False):
+    """
+    Открывает запись справочника Bitrix24
+
+    Args:
+        replace: Полная синхронизация: apply() удаляет сотрудников,
+            которых не было среди записанных
+
+    Справочник изменяется только в writer.apply(); если блок завершился
+    исключением раньше, записанные страницы отбрасываются.
+    """
+    async with aiosqlite.connect(DB_PATH) as conn:
+        conn.row_factory = aiosqlite.Row
+        writer = Bitrix24DirectoryWriter(conn, replace)
+        await writer._start()
+        yield writer
+
+async def get_bitrix24_departments():
+    """Получает отделы Bitrix24 из кэша в формате API (ID, NAME, PARENT)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute('SELECT id, name, parent_id FROM bitrix24_departments') as cursor:
+                rows = await cursor.fetchall()
+            return [{'ID': row[0], 'NAME': row[1], 'PARENT': row[2]} for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка получения отделов Bitrix24: {e}")
+        return []
+
+async def save_bitrix24_departments(departments: list):
+    """Заменяет кэш отделов Bitrix24 одной транзакцией"""
+    async with aiosqlite.connect(DB_PATH) as conn:
+        try:
+            await conn.execute('DELETE FROM bitrix24_departments')
+            await conn.executemany(
+                'INSERT OR REPLACE INTO bitrix24_departments (id, name, parent_id) VALUES (?, ?, ?)',
+                [(str(dept['ID']), dept.get('NAME') or '', str(dept['PARENT']) if dept.get('PARENT') else None)
+                 for dept in departments]
+            )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+async def get_bitrix24_photos(urls: list):
+    """Получает сведения о загруженных фото по ссылкам: {url: запись}"""
+    photos = {}
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            conn.row_factory = aiosqlite.Row
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                async with conn.execute(
+                    f'SELECT url, etag, last_modified, content_hash, path FROM bitrix24_photos WHERE url IN ({placeholders})',
+                    chunk
+                ) as cursor:
+                    for row in await cursor.fetchall():
+                        photos[row['url']] = dict(row)
+    except Exception as e:
+        logger.error(f"Ошибка получения сведений о фото Bitrix24: {e}")
+    return photos
+
+async def save_bitrix24_photos(photos: list):
+    """Сохраняет сведения о загруженных фото (url, etag, last_modified, content_hash, path)"""
+    if not photos:
+        return
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            await conn.executemany(
+                '''INSERT OR REPLACE INTO bitrix24_photos (url, etag, last_modified, content_hash, path, updated_at)
+                   VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''',
+                [(photo['url'], photo.get('etag'), photo.get('last_modified'), photo.get('content_hash'), photo['path'])
+                 for photo in photos]
+            )
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения сведений о фото Bitrix24: {e}")
+
+async def get_bitrix24_users():
+    """Получает всех сотрудников Bitrix24 из справочника (упорядочены по ФИО)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            conn.row_factory = aiosqlite.Row
+            async with conn.execute(
+                f'SELECT {", ".join(BITRIX24_USER_COLUMNS)} FROM bitrix24_users ORDER BY fio_key'
+            ) as cursor:
+                rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка получения сотрудников Bitrix24: {e}")
+        return []
+
+async def count_bitrix24_users() -> int:
+    """Количество сотрудников в справочнике Bitrix24"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute('SELECT COUNT(*) FROM bitrix24_users') as cursor:
+                row = await cursor.fetchone()
+            return row[0] if row else 0
+    except Exception as e:
+        logger.error(f"Ошибка подсчета сотрудников Bitrix24: {e}")
+        return 0
+
+# Периодические задачи
+async def get_scheduled_job_runs() -> dict:
+    """Получает время последнего запуска по расписанию для каждой задачи: {name: datetime}"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute('SELECT name, last_run_at FROM scheduled_jobs') as cursor:
+                rows = await cursor.fetchall()
+            return {name: datetime.datetime.fromisoformat(last_run_at) for name, last_run_at in rows}
+    except Exception as e:
+        logger.error(f"Ошибка получения запусков периодических задач: {e}")
+        return {}
+
+async def save_scheduled_job_run(name: str, run_at: datetime.datetime, status: str, error: str = None,
+                                 lease: tuple = None) -> bool:
+    """
+    Сохраняет запуск периодической задачи
+
+    Args:
+        lease: (имя аренды, fencing token) — запуск сохраняется, только если
+            аренда все еще принадлежит этому токену
+
+    Returns:
+        False, если запуск не сохранен
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            values = (name, run_at.isoformat(sep=' '), status, error)
+            if lease is None:
+                cursor = await conn.execute(
+                    '''INSERT INTO scheduled_jobs (name, last_run_at, status, error) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, status = excluded.status,
+                           error = excluded.error, updated_at = CURRENT_TIMESTAMP''',
+                    values
+                )
+            else:
+                # Запуск сохраняется, только если аренда не перешла к другому экземпляру
+                cursor = await conn.execute(
+                    '''INSERT INTO scheduled_jobs (name, last_run_at, status, error) SELECT ?, ?, ?, ?
+                       WHERE EXISTS (SELECT 1 FROM job_leases WHERE name = ? AND token = ?)
+                       ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, status = excluded.status,
+                           error = excluded.error, updated_at = CURRENT_TIMESTAMP''',
+                    values + tuple(lease)
+                )
+            await conn.commit()
+            return cursor.rowcount == 1
+    except Exception as e:
+        logger.error(f"Ошибка сохранения запуска задачи {name}: {e}")
+        return False
+
+async def acquire_job_lease(name: str, holder: str, ttl: float, now: float):
+    """
+    Захватывает аренду, если она свободна, истекла или уже принадлежит holder
+
+    Returns:
+        Новый fencing token или None, если аренда занята другим экземпляром
+    """
+    async with aiosqlite.connect(DB_PATH) as conn:
+        await conn.execute(
+            '''INSERT INTO job_leases (name, holder, token, expires_at) VALUES (?, ?, 1, ?)
+               ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, token = job_leases.token + 1,
+                   expires_at = excluded.expires_at
+               WHERE job_leases.expires_at <= ? OR job_leases.holder = excluded.holder''',
+            (name, holder, now + ttl, now)
+        )
+        async with conn.execute('SELECT holder, token FROM job_leases WHERE name = ?', (name,)) as cursor:
+            row = await cursor.fetchone()
+        await conn.commit()
+    return row[1] if row and row[0] == holder else None
+
+async def renew_job_lease(name: str, holder: str, token: int, ttl: float, now: float) -> bool:
+    """Продлевает аренду; False, если она уже перешла другому экземпляру"""
+    async with aiosqlite.connect(DB_PATH) as conn:
+        cursor = await conn.execute(
+            'UPDATE job_leases SET expires_at = ? WHERE name = ? AND holder = ? AND token = ? AND expires_at > ?',
+            (now + ttl, name, holder, token, now)
+        )
+        await conn.commit()
+        return cursor.rowcount == 1
+
+async def release_job_lease(name: str, holder: str, token: int):
+    """Освобождает аренду (если она все еще принадлежит этому токену)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            await conn.execute(
+                'UPDATE job_leases SET expires_at = 0 WHERE name = ? AND holder = ? AND token = ?',
+                (name, holder, token)
+            )
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка освобождения аренды {name}: {e}")
+
+# Задания массовой рассылки
+def create_broadcast_job_sync(payload: str, recipients: list, audience: str = None, created_by: int = None,
+                              status: str = 'queued') -> int:
+    """
+    Создает задание рассылки вместе со списком получателей (одной транзакцией)
+
+    Задания в статусе queued выполняет фоновый обработчик бота; задание,
+    которое сразу выполняется в этом процессе, создается в статусе running.
+    Синхронная версия для веб-интерфейса; бот вызывает create_broadcast_job.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO broadcast_jobs (payload, audience, created_by, status) VALUES (?, ?, ?, ?)',
+                (payload, audience, created_by, status)
+            )
+            job_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT OR IGNORE INTO broadcast_deliveries (job_id, user_id) VALUES (?, ?)',
+                [(job_id, user_id) for user_id in recipients]
+            )
+        return job_id
+    finally:
+        conn.close()
+
+async def create_broadcast_job(payload: str, recipients: list, audience: str = None, created_by: int = None,
+                               status: str = 'queued') -> int:
+    """Создает задание рассылки (см. create_broadcast_job_sync)"""
+    return await asyncio.to_thread(create_broadcast_job_sync, payload, list(recipients), audience, created_by, status)
+
+def _broadcast_job_row(row) -> dict:
+    job = dict(row)
+    for status in ('pending', 'sending', 'sent', 'failed', 'unknown'):
+        job[status] = job.get(status) or 0
+    job['total'] = sum(job[status] for status in ('pending', 'sending', 'sent', 'failed', 'unknown'))
+    return job
+
+BROADCAST_JOB_QUERY = '''
+    SELECT j.id, j.payload, j.audience, j.status, j.created_by, j.created_at, j.started_at, j.finished_at,
+           SUM(d.status = 'pending') AS pending, SUM(d.status = 'sending') AS sending,
+           SUM(d.status = 'sent') AS sent, SUM(d.status = 'failed') AS failed,
+           SUM(d.status = 'unknown') AS unknown
+    FROM broadcast_jobs j
+    LEFT JOIN broadcast_deliveries d ON d.job_id = j.id
+'''
+
+def get_broadcast_job_sync(job_id: int):
+    """Получает задание рассылки с количеством получателей по статусам (синхронно, для веб-интерфейса)"""
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(BROADCAST_JOB_QUERY + ' WHERE j.id = ? GROUP BY j.id', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return _broadcast_job_row(row) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка получения задания рассылки {job_id}: {e}")
+        return None
+
+async def get_broadcast_job(job_id: int):
+    """Получает задание рассылки с количеством получателей по статусам"""
+    return await asyncio.to_thread(get_broadcast_job_sync, job_id)
+
+async def get_broadcast_jobs(limit: int = 10, statuses: tuple = None):
+    """Получает последние задания рассылки (при statuses — только в этих статусах)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            conn.row_factory = aiosqlite.Row
+            query = BROADCAST_JOB_QUERY
+            params = []
+            if statuses:
+                query += f' WHERE j.status IN ({", ".join("?" * len(statuses))})'
+                params.extend(statuses)
+            query += ' GROUP BY j.id ORDER BY j.id DESC LIMIT ?'
+            params.append(limit)
+            async with conn.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+            return [_broadcast_job_row(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка получения заданий рассылки: {e}")
+        return []
+
+async def claim_broadcast_job(job_id: int) -> bool:
+    """
+    Забирает задание из очереди (queued → running)
+
+    Returns:
+        False, если задание уже забрал другой экземпляр бота или оно не в очереди
+    """
+    async with aiosqlite.connect(DB_PATH) as conn:
+        cursor = await conn.execute(
+            "UPDATE broadcast_jobs SET status = 'running', started_at = COALESCE(started_at, CURRENT_TIMESTAMP) "
+            "WHERE id = ? AND status = 'queued'",
+            (job_id,)
+        )
+        await conn.commit()
+        return cursor.rowcount == 1
+
+async def set_broadcast_job_status(job_id: int, status: str):
+    """Меняет статус задания рассылки и отмечает время начала/завершения"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            if status == 'running':
+                await conn.execute(
+                    'UPDATE broadcast_jobs SET status = ?, started_at = COALESCE(started_at, CURRENT_TIMESTAMP) WHERE id = ?',
+                    (status, job_id)
+                )
+            elif status in ('done', 'cancelled'):
+                await conn.execute(
+                    'UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?',
+                    (status, job_id)
+                )
+            else:
+                await conn.execute('UPDATE broadcast_jobs SET status = ? WHERE id = ?', (status, job_id))
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка изменения статуса задания рассылки {job_id}: {e}")
+
+async def get_pending_broadcast_recipients(job_id: int):
+    """Получатели задания, которым сообщение еще не отправлялось"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute(
+                "SELECT user_id FROM broadcast_deliveries WHERE job_id = ? AND status = 'pending' ORDER BY user_id",
+                (job_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+    except Exception as e:
+        logger.error(f"Ошибка получения получателей рассылки {job_id}: {e}")
+        return []
+
+class BroadcastDeliveryLog:
+    """
+    Статусы доставки одного задания рассылки через одно соединение
+
+    Используется через broadcast_delivery_log на время выполнения задания.
+    Начало отправки (sending) записывается до отправки, иначе после
+    перезапуска сообщение ушло бы повторно; вместе с ним сохраняются
+    накопленные результаты. Результаты (sent, failed) копятся в памяти и
+    пишутся executemany порциями по batch_size, так что на получателя
+    приходится одна фиксация транзакции. Результаты, не записанные при
+    аварийной остановке, остаются в статусе sending и становятся unknown —
+    повторной отправки не будет.
+    """
+
+    def __init__(self, conn, job_id: int, batch_size: int = 100):
+        self.conn = conn
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self._results = []
+        self._lock = asyncio.Lock()
+
+    async def _write_results(self, results: list):
+        if results:
+            await self.conn.executemany(
+                'UPDATE broadcast_deliveries SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP '
+                'WHERE job_id = ? AND user_id = ?',
+                results
+            )
+
+    async def start(self, user_id: int) -> bool:
+        """
+        Отмечает начало отправки получателю (pending → sending)
+
+        Returns:
+            False, если отправка этому получателю уже начиналась (повторно
+            отправлять нельзя) или отметку не удалось сохранить
+        """
+        async with self._lock:
+            results, self._results = self._results, []
+            try:
+                await self._write_results(results)
+                cursor = await self.conn.execute(
+                    "UPDATE broadcast_deliveries SET status = 'sending', updated_at = CURRENT_TIMESTAMP "
+                    "WHERE job_id = ? AND user_id = ? AND status = 'pending'",
+                    (self.job_id, user_id)
+                )
+                await self.conn.commit()
+                return cursor.rowcount == 1
+            except Exception as e:
+                logger.error(f"Ошибка отметки отправки рассылки {self.job_id} для {user_id}: {e}")
+                await self.conn.rollback()
+                self._results[:0] = results
+                return False
+
+    async def finish(self, user_id: int, status: str, error: str = None):
+        """Сохраняет результат отправки получателю (sent или failed)"""
+        self._results.append((status, error, self.job_id, user_id))
+        if len(self._results) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные результаты"""
+        async with self._lock:
+            results, self._results = self._results, []
+            try:
+                await self._write_results(results)
+                await self.conn.commit()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения результатов рассылки {self.job_id}: {e}")
+                await self.conn.rollback()
+                self._results[:0] = results
+
+@asynccontextmanager
+async def broadcast_delivery_log(job_id: int, batch_size: int = 100):
+    """Открывает запись статусов доставки задания; оставшиеся результаты записываются при выходе"""
+    async with aiosqlite.connect(DB_PATH) as conn:
+        log = BroadcastDeliveryLog(conn, job_id, batch_size)
+        try:
+            yield log
+        finally:
+            await log.flush()
+
+async def mark_interrupted_broadcast_deliveries(job_id: int) -> int:
+    """
+    Переводит прерванные отправки задания (sending) в статус unknown
+
+    Сообщение могло уйти до перезапуска, поэтому такие получатели повторно не
+    обрабатываются. Вызывается только владельцем аренды задания: отправки,
+    которые сейчас выполняет другой экземпляр, не затрагиваются.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            cursor = await conn.execute(
+                "UPDATE broadcast_deliveries SET status = 'unknown', updated_at = CURRENT_TIMESTAMP "
+                "WHERE job_id = ? AND status = 'sending'",
+                (job_id,)
+            )
+            await conn.commit()
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка обработки прерванных рассылок: {e}")
+        return 0
+
 async def assign_roles():
     """Назначает роль администратора главному админу из конфигурации"""
     try:
@@ -246,8 +995,8 @@ async def approve_user(user_id: int):
                 username, fio, position = user_data
                 logger.debug(f"DB: approve_user found request for {user_id}: {fio}, {position}")
                 await conn.execute(
-                    'INSERT INTO authorized_users (user_id, username, fio, position) VALUES (?, ?, ?, ?)',
-                    (user_id, username, fio, position)
+                    'INSERT INTO authorized_users (user_id, username, fio, position, fio_key) VALUES (?, ?, ?, ?, ?)',
+                    (user_id, username, fio, position, normalize_fio(fio))
                 )
                 await conn.execute('DELETE FROM auth_requests WHERE user_id = ?', (user_id,))
                 await conn.commit()
@@ -277,16 +1026,81 @@ async def is_authorized(user_id: int) -> bool:
         logger.error(f"Ошибка проверки авторизации: {e}")
         return False
 
-async def get_authorized_users():
+async def get_authorized_users(reachable_only: bool = False):
+    """Получает авторизованных пользователей (reachable_only — без недоступных для отправки)"""
     try:
         async with aiosqlite.connect(DB_PATH) as conn:
-            async with conn.execute('SELECT user_id, username, fio, position, role FROM authorized_users ORDER BY fio') as cursor:
+            query = 'SELECT user_id, username, fio, position, role FROM authorized_users'
+            if reachable_only:
+                query += ' WHERE unreachable_at IS NULL'
+            async with conn.execute(query + ' ORDER BY fio') as cursor:
                 users = await cursor.fetchall()
             return users
     except Exception as e:
         logger.error(f"Ошибка получения авторизованных пользователей: {e}")
         return []
 
+async def get_users_by_roles(roles: list, reachable_only: bool = False):
+    """Получает авторизованных пользователей с указанными ролями"""
+    if not roles:
+        return []
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            placeholders = ', '.join('?' * len(roles))
+            query = f'SELECT user_id, username, fio, position, role FROM authorized_users WHERE role IN ({placeholders})'
+            if reachable_only:
+                query += ' AND unreachable_at IS NULL'
+            async with conn.execute(query + ' ORDER BY fio', list(roles)) as cursor:
+                users = await cursor.fetchall()
+            return users
+    except Exception as e:
+        logger.error(f"Ошибка получения пользователей по ролям: {e}")
+        return []
+
+async def mark_users_unreachable(reasons: dict):
+    """Отмечает пользователей недоступными для отправки: {user_id: причина}"""
+    if not reasons:
+        return
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            await conn.executemany(
+                'UPDATE authorized_users SET unreachable_at = CURRENT_TIMESTAMP, unreachable_reason = ? '
+                'WHERE user_id = ? AND unreachable_at IS NULL',
+                [(reason, user_id) for user_id, reason in reasons.items()]
+            )
+            await conn.commit()
+        logger.info(f"Отмечено недоступных пользователей: {len(reasons)}")
+    except Exception as e:
+        logger.error(f"Ошибка отметки недоступных пользователей: {e}")
+
+async def clear_user_unreachable(user_id: int):
+    """Снимает отметку о недоступности (пользователь снова написал боту)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            cursor = await conn.execute(
+                'UPDATE authorized_users SET unreachable_at = NULL, unreachable_reason = NULL '
+                'WHERE user_id = ? AND unreachable_at IS NOT NULL',
+                (user_id,)
+            )
+            await conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Пользователь {user_id} снова доступен для отправки")
+    except Exception as e:
+        logger.error(f"Ошибка снятия отметки недоступности пользователя {user_id}: {e}")
+
+async def get_unreachable_users():
+    """Получает недоступных пользователей: (user_id, username, fio, unreachable_at, unreachable_reason)"""
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute(
+                'SELECT user_id, username, fio, unreachable_at, unreachable_reason FROM authorized_users '
+                'WHERE unreachable_at IS NOT NULL ORDER BY unreachable_at DESC'
+            ) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка получения недоступных пользователей: {e}")
+        return []
+
 async def get_user_role(user_id: int) -> str:
     try:
         async with aiosqlite.connect(DB_PATH) as conn:
@@ -471,8 +1285,8 @@ async def add_coffee_schedule_entry(fio: str, date: str, created_by: int, user_i
     try:
         async with aiosqlite.connect(DB_PATH) as conn:
             await conn.execute(
-                'INSERT INTO coffee_schedule (fio, date, user_id, created_by) VALUES (?, ?, ?, ?)',
-                (fio, date, user_id, created_by)
+                'INSERT INTO coffee_schedule (fio, date, user_id, created_by, fio_key) VALUES (?, ?, ?, ?, ?)',
+                (fio, date, user_id, created_by, normalize_fio(fio))
             )
             await conn.commit()
             logger.info(f"Добавлена запись в график кофе: {fio} на {date}")
@@ -620,6 +1434,54 @@ async def get_today_coffee_schedule_for_notification():
         logger.error(f"Ошибка получения графика кофе на сегодня для уведомлений: {e}")
         return []
 
+async def get_coffee_notifications():
+    """
+    Получает сегодняшние записи графика кофе, по которым не отправлено уведомление
+
+    Получатель определяется одним запросом: записи графика соединяются с
+    авторизованными пользователями по столбцу fio_key (normalize_fio
+    вычисляется при записи, соединение идет по индексу).
+
+    Returns:
+        Список (id, fio, date, user_id); записи без найденного пользователя пропускаются
+    """
+    try:
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        today_dd_mm_yyyy = datetime.datetime.now().strftime('%d.%m.%Y')
+        
+        async with aiosqlite.connect(DB_PATH) as conn:
+            async with conn.execute('''
+                SELECT c.id, c.fio, c.date, COALESCE(c.user_id, MIN(u.user_id)) AS user_id
+                FROM coffee_schedule c
+                LEFT JOIN authorized_users u ON u.fio_key = c.fio_key
+                WHERE (c.date = ? OR c.date = ?) AND c.notified_at IS NULL
+                GROUP BY c.id
+                HAVING COALESCE(c.user_id, MIN(u.user_id)) IS NOT NULL
+                ORDER BY c.id
+            ''', (today, today_dd_mm_yyyy)) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка получения уведомлений о кофе: {e}")
+        return []
+
+async def mark_coffee_notifications_sent(entry_ids: list):
+    """Отмечает отправленными уведомления о графике по списку записей (одной транзакцией)"""
+    entry_ids = list(entry_ids)
+    if not entry_ids:
+        return
+    try:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            for start in range(0, len(entry_ids), 500):
+                chunk = entry_ids[start:start + 500]
+                await conn.execute(
+                    f'UPDATE coffee_schedule SET notified_at = CURRENT_TIMESTAMP WHERE id IN ({", ".join("?" * len(chunk))})',
+                    chunk
+                )
+            await conn.commit()
+            logger.info(f"Отмечено отправление уведомлений для {len(entry_ids)} записей")
+    except Exception as e:
+        logger.error(f"Ошибка отметки отправления уведомлений: {e}")
+
 async def mark_coffee_notification_sent_by_fio(fio: str, date: str):
     """Отмечает, что уведомление о графике отправлено по ФИО и дате"""
     try:
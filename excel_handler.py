@@ -1,9 +1,125 @@
 import hashlib
+import io
 import logging
+import os
+import stat
+import tempfile
+import weakref
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Колонки, которые меняются при каждой синхронизации и не считаются изменением контактов
+VOLATILE_COLUMNS = ('Дата_синхронизации',)
+
+# Подписчики на изменения файла контактов (слабые ссылки для методов объектов)
+_contacts_listeners = []
+
+
+def add_contacts_listener(callback):
+    """Подписывает callback(file_path) на реальные изменения файла контактов"""
+    if hasattr(callback, '__self__'):
+        _contacts_listeners.append(weakref.WeakMethod(callback))
+    else:
+        _contacts_listeners.append(lambda: callback)
+
+
+def notify_contacts_changed(file_path):
+    """Уведомляет подписчиков о том, что файл контактов изменился"""
+    for ref in list(_contacts_listeners):
+        callback = ref()
+        if callback is None:
+            _contacts_listeners.remove(ref)
+            continue
+        try:
+            callback(file_path)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика изменения файла контактов: {e}")
+
+
+def contacts_content_hash(df):
+    """
+    Хэш нормализованного набора записей: без служебных колонок,
+    без учета порядка строк и различий между пустыми значениями
+    """
+    data = df.drop(columns=[col for col in VOLATILE_COLUMNS if col in df.columns])
+    data = data.reindex(sorted(data.columns), axis=1)
+    data = data.fillna('').astype(str).apply(lambda col: col.str.strip())
+    data = data.replace({'nan': '', 'None': '', 'NaN': ''})
+
+    row_hashes = pd.util.hash_pandas_object(data, index=False).sort_values()
+
+    hasher = hashlib.sha256()
+    hasher.update('\x1f'.join(data.columns).encode('utf-8'))
+    hasher.update(row_hashes.to_numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def write_contacts_file(df, file_path, current=None):
+    """
+    Записывает файл контактов, только если набор записей изменился
+
+    Файл сначала пишется во временный файл в той же папке, сбрасывается
+    на диск (fsync) и атомарно заменяет исходный — читатели никогда не видят
+    недописанный файл. Подписчики уведомляются только о реальных изменениях.
+
+    Args:
+        df: Новые данные
+        file_path: Путь к файлу контактов
+        current: Уже прочитанное текущее содержимое (чтобы не читать файл повторно)
+
+    Returns:
+        True, если файл был перезаписан
+    """
+    if current is None and os.path.exists(file_path):
+        try:
+            current = pd.read_excel(file_path)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать текущий файл контактов: {e}")
+
+    if current is not None and os.path.exists(file_path):
+        if contacts_content_hash(current) == contacts_content_hash(df):
+            logger.info("Содержимое контактов не изменилось, файл не перезаписывается")
+            return False
+
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.contacts_', suffix='.xlsx', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Сохраняем права исходного файла (mkstemp создает файл с правами 0600)
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        else:
+            os.chmod(tmp_path, 0o644)
+
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    # Фиксируем переименование в каталоге (на Windows и сетевых папках недоступно)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+    logger.info(f"Файл контактов обновлен: {file_path}")
+    notify_contacts_changed(file_path)
+    return True
+
+
 def load_excel(file_path):
     """
     Загружает Excel-файл и гарантирует наличие колонки 'Фото'.
@@ -51,6 +167,22 @@ class DataManager:
         self.file_path = file_path
         self.df = load_excel(file_path)
         self.previous_hash = self.get_file_hash()
+        self.file_signature = self.get_file_signature()
+        self.change_pending = False
+        add_contacts_listener(self.on_contacts_changed)
+
+    def on_contacts_changed(self, file_path):
+        """Получает уведомление об изменении файла контактов"""
+        if os.path.abspath(file_path) == os.path.abspath(self.file_path):
+            self.change_pending = True
+
+    def get_file_signature(self):
+        """Время изменения и размер файла — дешевая проверка перед вычислением хэша"""
+        try:
+            file_stat = os.stat(self.file_path)
+            return file_stat.st_mtime, file_stat.st_size
+        except OSError:
+            return None
 
     def get_file_hash(self):
         hasher = hashlib.md5()
@@ -65,8 +197,17 @@ class DataManager:
     def reload_excel(self):
         self.df = load_excel(self.file_path)
         self.previous_hash = self.get_file_hash()
+        self.file_signature = self.get_file_signature()
+        self.change_pending = False
 
     def check_updates(self):
+        # Файл не трогали и уведомлений не было — хэш не пересчитываем
+        signature = self.get_file_signature()
+        if not self.change_pending and signature == self.file_signature:
+            return []
+        self.change_pending = False
+        self.file_signature = signature
+
         current_hash = self.get_file_hash()
         messages = []
         if current_hash != self.previous_hash:
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Локальный сервер, имитирующий Telegram Bot API, для проверки бота без Telegram
+
+Бот подключается к нему через TELEGRAM_API_SERVER=http://127.0.0.1:8081.
+Сервер отвечает на методы Bot API правдоподобными результатами, запоминает
+отправленные ботом сообщения и зарегистрированный webhook, а также умеет
+доставлять боту обновления:
+
+    POST /_fake/update   {"text": "/start", "user_id": 1}  — отправить обновление
+    GET  /_fake/sent                                         — сообщения бота
+    GET  /_fake/webhook                                      — текущий webhook
+
+Обновление отправляется на webhook с заголовком X-Telegram-Bot-Api-Secret-Token
+или, если webhook не задан, отдается боту через getUpdates.
+
+Запуск: python fake_telegram_server.py [порт]
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 100000, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_bot'}
+
+
+class FakeTelegram:
+    """Состояние поддельного Bot API"""
+
+    def __init__(self):
+        self.webhook: Dict[str, Any] = {}
+        self.sent: List[Dict[str, Any]] = []
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if int(chat_id) > 0 else 'supergroup'},
+            'from': BOT_USER,
+            **fields
+        }
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """Результат метода Bot API"""
+        method = method.lower()
+        if method == 'getme':
+            return BOT_USER
+        if method == 'setwebhook':
+            self.webhook = {'url': params.get('url'), 'secret_token': params.get('secret_token')}
+            return True
+        if method == 'deletewebhook':
+            self.webhook = {}
+            return True
+        if method == 'getwebhookinfo':
+            return {'url': self.webhook.get('url', ''), 'has_custom_certificate': False,
+                    'pending_update_count': self.updates.qsize()}
+        if method == 'getupdates':
+            timeout = float(params.get('timeout') or 0)
+            try:
+                update = await asyncio.wait_for(self.updates.get(), timeout=timeout or 0.01)
+            except asyncio.TimeoutError:
+                return []
+            return [update]
+        if method.startswith('send'):
+            message = self._message(params.get('chat_id'), text=params.get('text') or params.get('caption'))
+            self.sent.append({'method': method, **params})
+            return message
+        if method.startswith('edit'):
+            self.sent.append({'method': method, **params})
+            return self._message(params.get('chat_id'), text=params.get('text'))
+        return True
+
+    def make_update(self, text: str, user_id: int) -> Dict[str, Any]:
+        user = {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'username': f'user{user_id}'}
+        message = self._message(user_id, text=text)
+        message['from'] = user
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+
+FAKE_KEY = web.AppKey('fake', FakeTelegram)
+
+
+async def read_params(request: web.Request) -> Dict[str, Any]:
+    """Параметры запроса: JSON, форма или multipart, как их отправляет aiogram"""
+    if request.content_type == 'application/json':
+        return await request.json()
+    params = {}
+    if request.can_read_body:
+        form = await request.post()
+        for key, value in form.items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            else:
+                value = value.filename  # Файл: достаточно имени
+            params[key] = value
+    params.update(request.query)
+    return params
+
+
+async def handle_method(request: web.Request) -> web.Response:
+    fake = request.app[FAKE_KEY]
+    params = await read_params(request)
+    result = await fake.call(request.match_info['method'], params)
+    return web.json_response({'ok': True, 'result': result})
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    """Доставляет боту обновление с текстовым сообщением"""
+    fake = request.app[FAKE_KEY]
+    data = await request.json()
+    update = fake.make_update(data.get('text', '/start'), int(data.get('user_id', 1)))
+    if not fake.webhook.get('url'):
+        await fake.updates.put(update)
+        return web.json_response({'delivered': 'getUpdates', 'update': update})
+
+    headers = {}
+    if fake.webhook.get('secret_token'):
+        headers['X-Telegram-Bot-Api-Secret-Token'] = fake.webhook['secret_token']
+    async with aiohttp.ClientSession() as session:
+        async with session.post(fake.webhook['url'], json=update, headers=headers) as response:
+            return web.json_response({'delivered': 'webhook', 'status': response.status, 'update': update})
+
+
+async def handle_sent(request: web.Request) -> web.Response:
+    return web.json_response(request.app[FAKE_KEY].sent)
+
+
+async def handle_webhook(request: web.Request) -> web.Response:
+    return web.json_response(request.app[FAKE_KEY].webhook)
+
+
+def create_app(fake: FakeTelegram = None) -> web.Application:
+    """Приложение aiohttp поддельного Bot API"""
+    app = web.Application()
+    app[FAKE_KEY] = fake or FakeTelegram()
+    app.router.add_post('/_fake/update', handle_update)
+    app.router.add_get('/_fake/sent', handle_sent)
+    app.router.add_get('/_fake/webhook', handle_webhook)
+    app.router.add_route('*', '/bot{token}/{method}', handle_method)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    web.run_app(create_app(), host='127.0.0.1', port=port)
@@ -3,17 +3,19 @@
 """
 
 import logging
-from datetime import datetime
 from aiogram import types, Dispatcher
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
 
 from config import ADMIN_ID, CHANNEL_CHAT_ID
 from database import *
+# После database: `from database import *` приносит модуль datetime
+from datetime import datetime
 from keyboards import *
 from states import DeleteRequest, AddUser, AssignRole, RemoveUser, Notify
 from utils import escape_html, admin_required
-from services import SyncService, NotificationService
+from services import SyncService, NotificationService, cancel_broadcast_job, get_outbound_dispatcher, get_bot
+from .callback_router import get_callback_router
 
 logger = logging.getLogger(__name__)
 
@@ -265,21 +267,13 @@ async def show_users_page(message: types.Message, users: list, page: int, users_
 
 # ============= ОДОБРЕНИЕ/ОТКЛОНЕНИЕ ЗАЯВОК =============
 
-async def approve_user_callback(callback_query: types.CallbackQuery):
-    """Обработчик одобрения пользователя"""
+async def approve_user_callback(callback_query: types.CallbackQuery, user_id: int):
+    """Обработчик одобрения пользователя (approve_<user_id>)"""
     if callback_query.from_user.id != ADMIN_ID:
         await callback_query.answer("❌ У вас нет прав для одобрения пользователей.", show_alert=True)
         return
     
-    # Проверяем, что это не approve_news_
-    if callback_query.data.startswith("approve_news_"):
-        logger.debug("CALLBACK: approve_news detected, skipping user approval handler")
-        return
-    
     try:
-        # Парсим user_id из callback_data
-        user_id = int(callback_query.data.split("_")[1])
-        
         # Одобряем пользователя
         success = await approve_user(user_id)
         
@@ -288,9 +282,7 @@ async def approve_user_callback(callback_query: types.CallbackQuery):
             
             # Уведомляем пользователя
             try:
-                from aiogram import Bot
-                from config import BOT_TOKEN
-                bot = Bot(token=BOT_TOKEN)
+                bot = get_bot()
                 
                 await bot.send_message(
                     user_id,
@@ -313,16 +305,13 @@ async def approve_user_callback(callback_query: types.CallbackQuery):
         await callback_query.answer("❌ Ошибка при одобрении", show_alert=True)
 
 
-async def decline_user_callback(callback_query: types.CallbackQuery):
-    """Обработчик отклонения пользователя"""
+async def decline_user_callback(callback_query: types.CallbackQuery, user_id: int):
+    """Обработчик отклонения пользователя (decline_<user_id>)"""
     if callback_query.from_user.id != ADMIN_ID:
         await callback_query.answer("❌ У вас нет прав для отклонения пользователей.", show_alert=True)
         return
     
     try:
-        # Парсим user_id из callback_data
-        user_id = int(callback_query.data.split("_")[1])
-        
         # Отклоняем пользователя
         success = await decline_user(user_id)
         
@@ -331,9 +320,7 @@ async def decline_user_callback(callback_query: types.CallbackQuery):
             
             # Уведомляем пользователя
             try:
-                from aiogram import Bot
-                from config import BOT_TOKEN
-                bot = Bot(token=BOT_TOKEN)
+                bot = get_bot()
                 
                 await bot.send_message(
                     user_id,
@@ -375,9 +362,18 @@ async def sync_data_callback(callback_query: types.CallbackQuery):
             report += f"✅ Пользователи: {stats.get('users_count', 0)} записей\n"
             report += f"✅ Заявки: {stats.get('requests_count', 0)} записей\n"
             report += f"✅ Новости: {stats.get('news_count', 0)} записей\n\n"
-            report += f"📅 <b>Время:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         else:
-            report = f"❌ <b>Ошибка синхронизации:</b>\n{result.get('error', 'Неизвестная ошибка')}"
+            report = f"❌ <b>Ошибка синхронизации:</b>\n{result.get('error', 'Неизвестная ошибка')}\n\n"
+        
+        if sync_service.webhook_url:
+            # Облегченная проверка: один запрос total к API и кэшированное число строк файла
+            bitrix_status = await sync_service.get_bitrix24_status()
+            if bitrix_status.get('error'):
+                report += f"⚠️ Bitrix24 недоступен: {escape_html(bitrix_status['error'])}\n\n"
+            else:
+                report += f"👥 Сотрудников в Bitrix24: {bitrix_status.get('bitrix_users', 0)}\n"
+                report += f"📄 Записей в файле контактов: {bitrix_status.get('excel_records', 0)}\n\n"
+        report += f"📅 <b>Время:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         
         await callback_query.message.answer(report, parse_mode=ParseMode.HTML)
         await callback_query.answer("Синхронизация завершена!")
@@ -388,6 +384,32 @@ async def sync_data_callback(callback_query: types.CallbackQuery):
         await callback_query.answer("Ошибка синхронизации", show_alert=True)
 
 
+def format_sync_diff(diff: dict, limit: int = 10) -> str:
+    """Форматирует изменения синхронизации Bitrix24 (не более limit строк)"""
+    lines = []
+    
+    for entry in diff.get('added', []):
+        lines.append(f"➕ {escape_html(entry.get('ФИО'))}")
+    
+    for entry in diff.get('removed', []):
+        lines.append(f"➖ {escape_html(entry.get('ФИО'))}")
+    
+    for entry in diff.get('changed', []):
+        changes = "; ".join(
+            f"{escape_html(field)}: {escape_html(delta.get('old')) or '—'} → {escape_html(delta.get('new')) or '—'}"
+            for field, delta in entry.get('changes', {}).items()
+        )
+        lines.append(f"✏️ {escape_html(entry.get('ФИО'))}: {changes}")
+    
+    if not lines:
+        return ""
+    
+    text = "🔎 <b>Изменения:</b>\n" + "\n".join(lines[:limit]) + "\n"
+    if len(lines) > limit:
+        text += f"... и ещё {len(lines) - limit} изменений\n"
+    return text + "\n"
+
+
 async def sync_bitrix24_callback(callback_query: types.CallbackQuery):
     """Обработчик синхронизации с Bitrix24"""
     if callback_query.from_user.id != ADMIN_ID:
@@ -402,6 +424,20 @@ async def sync_bitrix24_callback(callback_query: types.CallbackQuery):
         
         if result['success']:
             success_msg = "✅ <b>Синхронизация завершена успешно!</b>\n\n"
+            
+            sync_result = result.get('sync_result', {})
+            details = sync_result.get('details', {})
+            if details:
+                success_msg += f"📊 <b>Записей:</b> {details.get('initial_count', 0)} → {details.get('final_count', 0)}\n"
+                success_msg += f"➕ Добавлено: {details.get('added_count', 0)}\n"
+                success_msg += f"✏️ Изменено: {details.get('updated_count', 0)}\n"
+                success_msg += f"➖ Удалено: {details.get('removed_count', 0)}\n"
+                success_msg += f"⏸ Без изменений: {details.get('skipped_count', 0)}\n\n"
+            
+            diff = sync_result.get('diff')
+            if diff:
+                success_msg += format_sync_diff(diff)
+            
             success_msg += f"📅 <b>Время:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"
             await callback_query.message.answer(success_msg, parse_mode=ParseMode.HTML)
         else:
@@ -423,7 +459,7 @@ async def send_notification_callback(callback_query: types.CallbackQuery, state:
         await callback_query.answer("❌ У вас нет прав для отправки уведомлений.", show_alert=True)
         return
     
-    await callback_query.message.answer("📢 <b>Отправка уведомления</b>\n\nВведите текст уведомления для всех пользователей:", parse_mode=ParseMode.HTML)
+    await callback_query.message.answer("📢 <b>Отправка уведомления</b>\n\nВведите текст уведомления для всех пользователей или отправьте фото/документ с подписью:", parse_mode=ParseMode.HTML)
     await state.set_state(Notify.waiting_for_notification)
     await callback_query.answer()
 
@@ -431,20 +467,33 @@ async def send_notification_callback(callback_query: types.CallbackQuery, state:
 async def process_notification_text(message: types.Message, state: FSMContext):
     """Обработка текста уведомления"""
     try:
-        from aiogram import Bot
-        from config import BOT_TOKEN
-        bot = Bot(token=BOT_TOKEN)
-        
-        notification_service = NotificationService(bot)
-        result = await notification_service.send_to_all_users(message.text)
+        # Бот диспетчера: его запросы проходят через общие лимиты отправки
+        notification_service = NotificationService(message.bot)
+        # Фото и документы уже загружены в Telegram: рассылаются по file_id без повторной загрузки
+        if message.photo:
+            result = await notification_service.send_media_to_all_users(
+                message.photo[-1].file_id, 'photo', caption=message.caption, admin_id=message.from_user.id
+            )
+        elif message.document:
+            result = await notification_service.send_media_to_all_users(
+                message.document.file_id, 'document', caption=message.caption, admin_id=message.from_user.id
+            )
+        elif message.text:
+            result = await notification_service.send_to_all_users(message.text, admin_id=message.from_user.id)
+        else:
+            await message.answer("❌ Поддерживаются текст, фото и документы. Отправьте уведомление еще раз.")
+            return
         
         if result['success']:
+            title = "⛔ <b>Рассылка остановлена</b>" if result.get('cancelled') else "✅ <b>Уведомление отправлено!</b>"
             await message.answer(
-                f"✅ <b>Уведомление отправлено!</b>\n\n"
+                f"{title}\n\n"
                 f"📊 <b>Статистика:</b>\n"
                 f"   • Отправлено: {result['sent_count']}\n"
                 f"   • Ошибок: {result['failed_count']}\n"
-                f"   • Всего пользователей: {result['total_count']}",
+                f"   • Всего пользователей: {result['total_count']}\n"
+                f"   • Стали недоступны: {result.get('unreachable_count', 0)}\n\n"
+                f"📨 Рассылка #{result['job_id']}",
                 parse_mode=ParseMode.HTML
             )
         else:
@@ -459,60 +508,132 @@ async def process_notification_text(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+BROADCAST_STATUS_NAMES = {
+    'queued': '⏳ в очереди',
+    'running': '🔄 выполняется',
+    'done': '✅ завершена',
+    'cancelled': '⛔ отменена'
+}
+
+
+def format_broadcast_job(job: dict) -> str:
+    """Форматирует строку отчета о задании рассылки"""
+    text = (
+        f"<b>#{job['id']}</b> {BROADCAST_STATUS_NAMES.get(job['status'], job['status'])} · {job['created_at']}\n"
+        f"   ✅ {job['sent']} · ❌ {job['failed']} · ⏳ {job['pending'] + job['sending']} из {job['total']}"
+    )
+    if job['unknown']:
+        text += f" · ❓ {job['unknown']}"
+    return text
+
+
+async def broadcast_jobs_callback(callback_query: types.CallbackQuery):
+    """Показывает состояние последних рассылок"""
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("❌ У вас нет прав для просмотра рассылок.", show_alert=True)
+        return
+    
+    jobs = await get_broadcast_jobs(limit=10)
+    if not jobs:
+        await callback_query.message.answer("📨 Рассылок пока не было.")
+        await callback_query.answer()
+        return
+    
+    text = "📨 <b>Последние рассылки</b>\n\n"
+    text += "\n\n".join(format_broadcast_job(job) for job in jobs)
+    text += "\n\n✅ отправлено · ❌ ошибки · ⏳ осталось · ❓ результат неизвестен (прервано перезапуском)"
+    
+    lanes = get_outbound_dispatcher().metrics()['lanes']
+    text += (
+        f"\n\n📤 <b>Очередь отправки:</b> ответы {lanes['interactive']['queued']}, "
+        f"рассылки {lanes['bulk']['queued']}"
+    )
+    await callback_query.message.answer(text, parse_mode=ParseMode.HTML)
+    await callback_query.answer()
+
+
+async def broadcast_cancel_callback(callback_query: types.CallbackQuery, job_id: int):
+    """Останавливает рассылку по кнопке под сообщением о ее ходе (broadcast_cancel_<job_id>)"""
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("❌ У вас нет прав для остановки рассылки.", show_alert=True)
+        return
+    
+    if await cancel_broadcast_job(job_id):
+        await log_admin_action(callback_query.from_user.id, f"cancelled_broadcast_{job_id}")
+        await callback_query.answer("⛔ Рассылка останавливается...")
+    else:
+        await callback_query.answer("Рассылка уже завершена", show_alert=True)
+
+
+UNREACHABLE_REASON_NAMES = {
+    'blocked': 'заблокировал бота',
+    'deactivated': 'аккаунт удален',
+    'chat_not_found': 'чат не найден',
+    'not_started': 'не запускал бота',
+    'forbidden': 'отправка запрещена'
+}
+
+
+async def unreachable_users_callback(callback_query: types.CallbackQuery):
+    """Показывает пользователей, которым невозможно отправить сообщение"""
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("❌ У вас нет прав для просмотра пользователей.", show_alert=True)
+        return
+    
+    users = await get_unreachable_users()
+    if not users:
+        await callback_query.message.answer("✅ Все пользователи доступны для рассылок.")
+        await callback_query.answer()
+        return
+    
+    lines = []
+    for user_id, username, fio, unreachable_at, reason in users[:50]:
+        name = escape_html(fio) if fio else f"ID {user_id}"
+        if username:
+            name += f" (@{escape_html(username)})"
+        lines.append(f"• {name} — {UNREACHABLE_REASON_NAMES.get(reason, reason)}, {unreachable_at}")
+    
+    text = f"🚫 <b>Недоступные пользователи: {len(users)}</b>\n\n" + "\n".join(lines)
+    if len(users) > 50:
+        text += f"\n... и ещё {len(users) - 50}"
+    text += "\n\nРассылки их пропускают; отметка снимается, когда пользователь снова отправит /start."
+    await callback_query.message.answer(text, parse_mode=ParseMode.HTML)
+    await callback_query.answer()
+
+
 def register_admin_handlers(dp: Dispatcher):
     """Регистрирует обработчики для администраторов"""
+    callbacks = get_callback_router(dp)
     
     # Админ панель
-    dp.callback_query.register(
-        admin_panel_callback,
-        lambda c: c.data == "admin_panel"
-    )
+    callbacks.exact("admin_panel", admin_panel_callback)
     
     # Управление пользователями
-    dp.callback_query.register(
-        view_users_callback,
-        lambda c: c.data == "view_users"
-    )
+    callbacks.exact("view_users", view_users_callback)
     
-    dp.callback_query.register(
-        view_requests_callback,
-        lambda c: c.data == "view_requests"
-    )
+    callbacks.exact("view_requests", view_requests_callback)
     
-    dp.callback_query.register(
-        assign_role_callback,
-        lambda c: c.data == "assign_role"
-    )
+    callbacks.exact("assign_role", assign_role_callback)
     
     # Одобрение/отклонение
-    dp.callback_query.register(
-        approve_user_callback,
-        lambda c: c.data and c.data.startswith("approve_") and not c.data.startswith("approve_news_")
-    )
-    
-    dp.callback_query.register(
-        decline_user_callback,
-        lambda c: c.data and c.data.startswith("decline_")
-    )
+    callbacks.prefix("approve_", approve_user_callback, user_id=int)
+    callbacks.prefix("decline_", decline_user_callback, user_id=int)
     
     # Синхронизация
-    dp.callback_query.register(
-        sync_data_callback,
-        lambda c: c.data == "sync_data"
-    )
+    callbacks.exact("sync_data", sync_data_callback)
     
-    dp.callback_query.register(
-        sync_bitrix24_callback,
-        lambda c: c.data == "sync_bitrix24"
-    )
+    callbacks.exact("sync_bitrix24", sync_bitrix24_callback)
     
     # Уведомления
-    dp.callback_query.register(
-        send_notification_callback,
-        lambda c: c.data == "send_notification"
-    )
+    callbacks.exact("send_notification", send_notification_callback)
     
     dp.message.register(
         process_notification_text,
         Notify.waiting_for_notification
-    ) 
\ No newline at end of file
+    )
+    
+    callbacks.exact("broadcast_jobs", broadcast_jobs_callback)
+    
+    callbacks.prefix("broadcast_cancel_", broadcast_cancel_callback, job_id=int)
+    
+    callbacks.exact("unreachable_users", unreachable_users_callback) 
\ No newline at end of file
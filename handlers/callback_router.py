@@ -0,0 +1,96 @@
+"""
+Маршрутизатор callback-запросов по callback_data
+
+Вместо десятков фильтров `lambda c: c.data == ...`, которые aiogram
+проверяет по очереди для каждого нажатия кнопки, в диспетчере
+регистрируется один обработчик. Он находит нужную функцию по точному
+совпадению callback_data в словаре или по самому длинному
+зарегистрированному префиксу (approve_news_ раньше approve_). Параметры
+кнопки (approve_123 -> user_id=123) разбираются один раз и передаются
+обработчику именованными аргументами.
+"""
+
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.event.handler import CallableObject
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackRouter:
+    """Обработчики callback-запросов по точному значению и по префиксу callback_data"""
+
+    def __init__(self):
+        self._exact: Dict[str, CallableObject] = {}
+        # префикс -> (обработчик, {имя аргумента: преобразование})
+        self._prefixes: Dict[str, Tuple[CallableObject, Dict[str, Callable[[str], Any]]]] = {}
+        # Длины префиксов по убыванию: поиск проверяет не больше одного ключа на длину
+        self._prefix_lengths: Tuple[int, ...] = ()
+
+    def exact(self, data: str, handler: Callable):
+        """Обработчик кнопки с callback_data == data"""
+        if data in self._exact:
+            raise ValueError(f"callback_data {data!r} уже зарегистрирован")
+        self._exact[data] = CallableObject(handler)
+
+    def prefix(self, prefix: str, handler: Callable, **payload: Callable[[str], Any]):
+        """
+        Обработчик кнопок с callback_data, начинающимся с prefix
+
+        Остаток callback_data делится по "_" на столько частей, сколько
+        передано аргументов payload, и каждая часть преобразуется своей
+        функцией: prefix("approve_", handler, user_id=int).
+        """
+        if prefix in self._prefixes:
+            raise ValueError(f"Префикс callback_data {prefix!r} уже зарегистрирован")
+        self._prefixes[prefix] = (CallableObject(handler), payload)
+        self._prefix_lengths = tuple(sorted({len(key) for key in self._prefixes}, reverse=True))
+
+    def resolve(self, data: str) -> Optional[Tuple[CallableObject, Dict[str, Any]]]:
+        """
+        Обработчик и разобранные параметры для callback_data
+
+        Raises:
+            ValueError: параметры кнопки не соответствуют формату
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, {}
+        for length in self._prefix_lengths:
+            entry = self._prefixes.get(data[:length])
+            if entry is None:
+                continue
+            handler, payload = entry
+            if not payload:
+                return handler, {}
+            parts = data[length:].split('_', len(payload) - 1)
+            if len(parts) != len(payload):
+                raise ValueError(f"неверный формат callback_data {data!r}")
+            return handler, {name: convert(part) for (name, convert), part in zip(payload.items(), parts)}
+        return None
+
+    async def dispatch(self, callback_query: types.CallbackQuery, **kwargs: Any):
+        """Обработчик aiogram: вызывает найденную функцию или передает запрос дальше"""
+        try:
+            route = self.resolve(callback_query.data or '')
+        except ValueError as e:
+            logger.warning(f"Callback от {callback_query.from_user.id}: {e}")
+            await callback_query.answer("❌ Неверные данные кнопки", show_alert=True)
+            return
+        if route is None:
+            raise SkipHandler()
+        handler, payload = route
+        return await handler.call(callback_query, **{**kwargs, **payload})
+
+
+def get_callback_router(dp: Dispatcher) -> CallbackRouter:
+    """Маршрутизатор диспетчера; при первом вызове регистрируется в dp.callback_query"""
+    router = dp.workflow_data.get('callback_router')
+    if router is None:
+        router = CallbackRouter()
+        dp['callback_router'] = router
+        dp.callback_query.register(router.dispatch)
+    return router
@@ -13,6 +13,7 @@ from database import *
 from keyboards import *
 from states import AuthorizeUser
 from utils import escape_html
+from .callback_router import get_callback_router
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +27,8 @@ async def start_command(message: types.Message, state: FSMContext):
     
     # Проверяем авторизацию
     if await is_authorized(user_id):
+        # Пользователь снова пишет боту: возвращаем его в рассылки
+        await clear_user_unreachable(user_id)
         await send_main_menu(message, user_id)
     else:
         # Проверяем, есть ли уже заявка
@@ -119,11 +122,9 @@ async def cancel_command(message: types.Message, state: FSMContext):
 
 def register_common_handlers(dp: Dispatcher):
     """Регистрирует общие обработчики"""
+    callbacks = get_callback_router(dp)
     dp.message.register(start_command, Command("start"))
     dp.message.register(help_command, Command("help"))
     dp.message.register(cancel_command, Command("cancel"))
     
-    dp.callback_query.register(
-        back_to_main_callback,
-        lambda c: c.data == "back_to_main"
-    ) 
\ No newline at end of file
+    callbacks.exact("back_to_main", back_to_main_callback) 
\ No newline at end of file
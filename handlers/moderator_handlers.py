@@ -3,16 +3,19 @@
 """
 
 import logging
-from datetime import datetime
 from aiogram import types, Dispatcher
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
 
 from config import ADMIN_ID, MODERATOR_ID, MARKETER_ID, CHANNEL_CHAT_ID
 from database import *
+# После database: `from database import *` приносит модуль datetime
+from datetime import datetime
 from keyboards import *
 from states import Moderator, ScheduleMonth
 from utils import escape_html
+from services import get_bot
+from .callback_router import get_callback_router
 
 logger = logging.getLogger(__name__)
 
@@ -76,9 +79,7 @@ async def process_moderator_news(message: types.Message, state: FSMContext):
     """Обработка публикации новости модератором"""
     try:
         # Публикуем новость в канал
-        from aiogram import Bot
-        from config import BOT_TOKEN
-        bot = Bot(token=BOT_TOKEN)
+        bot = get_bot()
         
         await bot.send_message(
             CHANNEL_CHAT_ID, 
@@ -149,8 +150,8 @@ async def news_proposals_callback(callback_query: types.CallbackQuery):
         await callback_query.answer("Произошла ошибка при загрузке предложений.", show_alert=True)
 
 
-async def approve_news_callback(callback_query: types.CallbackQuery):
-    """Обработчик одобрения предложения новости"""
+async def approve_news_callback(callback_query: types.CallbackQuery, proposal_id: int):
+    """Обработчик одобрения предложения новости (approve_news_<proposal_id>)"""
     user_id = callback_query.from_user.id
     
     if user_id not in [ADMIN_ID, MODERATOR_ID, MARKETER_ID]:
@@ -158,14 +159,6 @@ async def approve_news_callback(callback_query: types.CallbackQuery):
         return
     
     try:
-        # Парсим proposal_id из callback_data
-        parts = callback_query.data.split("_")
-        if len(parts) < 3:
-            await callback_query.answer("Ошибка: неверный формат callback_data", show_alert=True)
-            return
-        
-        proposal_id = int(parts[2])
-        
         # Получаем предложение
         proposal = await get_news_proposal_by_id(proposal_id)
         
@@ -184,9 +177,7 @@ async def approve_news_callback(callback_query: types.CallbackQuery):
         
         # Публикуем в канал
         try:
-            from aiogram import Bot
-            from config import BOT_TOKEN
-            bot = Bot(token=BOT_TOKEN)
+            bot = get_bot()
             
             await bot.send_message(
                 CHANNEL_CHAT_ID,
@@ -221,8 +212,8 @@ async def approve_news_callback(callback_query: types.CallbackQuery):
         await callback_query.answer("❌ Ошибка при одобрении новости", show_alert=True)
 
 
-async def reject_news_callback(callback_query: types.CallbackQuery):
-    """Обработчик отклонения предложения новости"""
+async def reject_news_callback(callback_query: types.CallbackQuery, proposal_id: int):
+    """Обработчик отклонения предложения новости (reject_news_<proposal_id>)"""
     user_id = callback_query.from_user.id
     
     if user_id not in [ADMIN_ID, MODERATOR_ID, MARKETER_ID]:
@@ -230,14 +221,6 @@ async def reject_news_callback(callback_query: types.CallbackQuery):
         return
     
     try:
-        # Парсим proposal_id из callback_data
-        parts = callback_query.data.split("_")
-        if len(parts) < 3:
-            await callback_query.answer("Ошибка: неверный формат callback_data", show_alert=True)
-            return
-        
-        proposal_id = int(parts[2])
-        
         # Получаем предложение
         proposal = await get_news_proposal_by_id(proposal_id)
         
@@ -256,9 +239,7 @@ async def reject_news_callback(callback_query: types.CallbackQuery):
         
         # Уведомляем автора
         try:
-            from aiogram import Bot
-            from config import BOT_TOKEN
-            bot = Bot(token=BOT_TOKEN)
+            bot = get_bot()
             
             await bot.send_message(
                 author_id,
@@ -392,54 +373,30 @@ async def process_schedule_month(message: types.Message, state: FSMContext):
 
 def register_moderator_handlers(dp: Dispatcher):
     """Регистрирует обработчики для модераторов"""
+    callbacks = get_callback_router(dp)
     
     # Панели
-    dp.callback_query.register(
-        moderator_panel_callback,
-        lambda c: c.data == "moderator_panel"
-    )
+    callbacks.exact("moderator_panel", moderator_panel_callback)
     
-    dp.callback_query.register(
-        marketer_panel_callback,
-        lambda c: c.data == "marketer_panel"
-    )
+    callbacks.exact("marketer_panel", marketer_panel_callback)
     
     # Управление новостями
-    dp.callback_query.register(
-        publish_news_callback,
-        lambda c: c.data == "publish_news"
-    )
+    callbacks.exact("publish_news", publish_news_callback)
     
     dp.message.register(
         process_moderator_news,
         Moderator.waiting_for_news
     )
     
-    dp.callback_query.register(
-        news_proposals_callback,
-        lambda c: c.data == "news_proposals"
-    )
-    
-    dp.callback_query.register(
-        approve_news_callback,
-        lambda c: c.data and c.data.startswith("approve_news_")
-    )
+    callbacks.exact("news_proposals", news_proposals_callback)
     
-    dp.callback_query.register(
-        reject_news_callback,
-        lambda c: c.data and c.data.startswith("reject_news_")
-    )
+    callbacks.prefix("approve_news_", approve_news_callback, proposal_id=int)
+    callbacks.prefix("reject_news_", reject_news_callback, proposal_id=int)
     
     # График кофе
-    dp.callback_query.register(
-        coffee_schedule_callback,
-        lambda c: c.data == "coffee_schedule"
-    )
+    callbacks.exact("coffee_schedule", coffee_schedule_callback)
     
-    dp.callback_query.register(
-        schedule_month_callback,
-        lambda c: c.data == "schedule_month"
-    )
+    callbacks.exact("schedule_month", schedule_month_callback)
     
     dp.message.register(
         process_schedule_month,
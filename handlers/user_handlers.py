@@ -14,7 +14,8 @@ from database import *
 from keyboards import *
 from states import AuthorizeUser, ProposeNews, MessageUser, Search
 from utils import escape_html, validate_fio
-from services import ExcelService
+from services import ExcelService, get_bot
+from .callback_router import get_callback_router
 
 logger = logging.getLogger(__name__)
 
@@ -145,9 +146,7 @@ async def process_position(message: types.Message, state: FSMContext):
         
         # Отправляем уведомление администратору
         try:
-            from aiogram import Bot
-            from config import BOT_TOKEN
-            bot = Bot(token=BOT_TOKEN)
+            bot = get_bot()
             
             admin_message = (
                 f"📋 <b>Новая заявка на авторизацию</b>\n\n"
@@ -289,9 +288,8 @@ async def process_news_proposal(message: types.Message, state: FSMContext):
         
         # Уведомляем модераторов/администраторов
         try:
-            from aiogram import Bot
-            from config import BOT_TOKEN, MODERATOR_ID, MARKETER_ID
-            bot = Bot(token=BOT_TOKEN)
+            from config import MODERATOR_ID, MARKETER_ID
+            bot = get_bot()
             
             notification_text = (
                 f"📝 <b>Новое предложение новости</b>\n\n"
@@ -643,17 +641,12 @@ async def process_search_department(message: types.Message, state: FSMContext):
 
 def register_user_handlers(dp: Dispatcher):
     """Регистрирует обработчики для пользователей"""
+    callbacks = get_callback_router(dp)
     
     # Обработчики авторизации
-    dp.callback_query.register(
-        request_auth_callback,
-        lambda c: c.data == "request_auth"
-    )
+    callbacks.exact("request_auth", request_auth_callback)
     
-    dp.callback_query.register(
-        bot_info_callback,
-        lambda c: c.data == "bot_info"
-    )
+    callbacks.exact("bot_info", bot_info_callback)
     
     dp.message.register(
         process_fio,
@@ -666,20 +659,11 @@ def register_user_handlers(dp: Dispatcher):
     )
     
     # Пользовательские функции
-    dp.callback_query.register(
-        search_employees_callback,
-        lambda c: c.data == "search_employees"
-    )
+    callbacks.exact("search_employees", search_employees_callback)
     
-    dp.callback_query.register(
-        download_contacts_callback,
-        lambda c: c.data == "download_contacts"
-    )
+    callbacks.exact("download_contacts", download_contacts_callback)
     
-    dp.callback_query.register(
-        propose_news_callback,
-        lambda c: c.data == "propose_news"
-    )
+    callbacks.exact("propose_news", propose_news_callback)
     
     dp.message.register(
         process_news_proposal,
@@ -687,20 +671,11 @@ def register_user_handlers(dp: Dispatcher):
     )
     
     # Обработчики поиска
-    dp.callback_query.register(
-        search_by_fio_callback,
-        lambda c: c.data == "search_by_fio"
-    )
+    callbacks.exact("search_by_fio", search_by_fio_callback)
     
-    dp.callback_query.register(
-        search_by_position_callback,
-        lambda c: c.data == "search_by_position"
-    )
+    callbacks.exact("search_by_position", search_by_position_callback)
     
-    dp.callback_query.register(
-        search_by_department_callback,
-        lambda c: c.data == "search_by_department"
-    )
+    callbacks.exact("search_by_department", search_by_department_callback)
     
     dp.message.register(
         process_search_fio,
@@ -170,6 +170,8 @@ class BeautifulInlineKeyboards:
         builder.add(InlineKeyboardButton(text="👑 Назначить роль", callback_data="assign_role"))
         builder.add(InlineKeyboardButton(text="❌ Удалить пользователя", callback_data="remove_user"))
         builder.add(InlineKeyboardButton(text="🔔 Отправить уведомление", callback_data="send_notification"))
+        builder.add(InlineKeyboardButton(text="📨 Рассылки", callback_data="broadcast_jobs"))
+        builder.add(InlineKeyboardButton(text="🚫 Недоступные", callback_data="unreachable_users"))
         
 
         
@@ -426,4 +428,11 @@ class BeautifulInlineKeyboards:
     def create_news_photos_keyboard() -> InlineKeyboardMarkup:
         builder = InlineKeyboardBuilder()
         builder.add(InlineKeyboardButton(text="✅ Готово", callback_data="news_photos_done"))
-        return builder.as_markup() 
\ No newline at end of file
+        return builder.as_markup() 
+    
+    @staticmethod
+    def create_broadcast_cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+        """Кнопка остановки рассылки под сообщением о ее ходе"""
+        builder = InlineKeyboardBuilder()
+        builder.add(InlineKeyboardButton(text="⛔ Остановить рассылку", callback_data=f"broadcast_cancel_{job_id}"))
+        return builder.as_markup()
@@ -1,14 +1,23 @@
 from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, send_file, flash
 import requests
+from requests.adapters import HTTPAdapter
 import sqlite3
 import pandas as pd
 import io
 import os
-from config import BOT_TOKEN, CHAT_ID, GROUP_CHAT_ID, CHANNEL_CHAT_ID, EXCEL_FILE, ADMIN_WEB_PASSWORD, MODERATOR_WEB_PASSWORD, DB_PATH
+from config import BOT_TOKEN, CHAT_ID, GROUP_CHAT_ID, CHANNEL_CHAT_ID, EXCEL_FILE, ADMIN_WEB_PASSWORD, MODERATOR_WEB_PASSWORD, DB_PATH, BROADCAST_STORAGE_CHAT_ID
+from database import create_broadcast_job_sync, get_broadcast_job_sync
+from services.broadcast_jobs import build_payload
+from utils.helpers import normalize_fio
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Замените на надёжное значение
 
+# Общая HTTP-сессия для запросов к Telegram: соединения переиспользуются между запросами
+telegram = requests.Session()
+telegram.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10))
+TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
+
 # Декоратор для проверки авторизации с возможной проверкой роли
 def login_required(role=None):
     def decorator(func):
@@ -64,20 +73,20 @@ def publish():
             flash("Новость не может быть пустой.", 'danger')
             return redirect(url_for('dashboard'))
         if image_file and image_file.filename != "":
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
+            url = f"{TELEGRAM_API}/sendPhoto"
             data = {
                 'chat_id': CHAT_ID,
                 'caption': f"📢 Новость:\n\n{news_text}" if news_text else ""
             }
             files = {'photo': image_file.stream}
-            r = requests.post(url, data=data, files=files)
+            r = telegram.post(url, data=data, files=files)
         else:
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+            url = f"{TELEGRAM_API}/sendMessage"
             data = {
                 'chat_id': CHAT_ID,
                 'text': f"📢 Новость:\n\n{news_text}"
             }
-            r = requests.post(url, data=data)
+            r = telegram.post(url, data=data)
         if r.ok:
             flash("Новость успешно опубликована!", 'success')
         else:
@@ -95,20 +104,20 @@ def publish_group():
             flash("Новость не может быть пустой.", 'danger')
             return redirect(url_for('dashboard'))
         if image_file and image_file.filename != "":
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
+            url = f"{TELEGRAM_API}/sendPhoto"
             data = {
                 'chat_id': GROUP_CHAT_ID,
                 'caption': f"📢 Новость:\n\n{news_text}" if news_text else ""
             }
             files = {'photo': image_file.stream}
-            r = requests.post(url, data=data, files=files)
+            r = telegram.post(url, data=data, files=files)
         else:
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+            url = f"{TELEGRAM_API}/sendMessage"
             data = {
                 'chat_id': GROUP_CHAT_ID,
                 'text': f"📢 Новость:\n\n{news_text}"
             }
-            r = requests.post(url, data=data)
+            r = telegram.post(url, data=data)
         if r.ok:
             flash("Новость успешно опубликована в группе!", 'success')
         else:
@@ -126,20 +135,20 @@ def publish_channel():
             flash("Новость не может быть пустой.", 'danger')
             return redirect(url_for('dashboard'))
         if image_file and image_file.filename != "":
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
+            url = f"{TELEGRAM_API}/sendPhoto"
             data = {
                 'chat_id': CHANNEL_CHAT_ID,
                 'caption': f"📢 Новость:\n\n{news_text}" if news_text else ""
             }
             files = {'photo': image_file.stream}
-            r = requests.post(url, data=data, files=files)
+            r = telegram.post(url, data=data, files=files)
         else:
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+            url = f"{TELEGRAM_API}/sendMessage"
             data = {
                 'chat_id': CHANNEL_CHAT_ID,
                 'text': f"📢 Новость:\n\n{news_text}"
             }
-            r = requests.post(url, data=data)
+            r = telegram.post(url, data=data)
         if r.ok:
             flash("Новость успешно опубликована в канале!", 'success')
         else:
@@ -147,29 +156,70 @@ def publish_channel():
         return redirect(url_for('dashboard'))
     return render_template("publish_channel.html")
 
+def upload_notify_file(upload):
+    """
+    Загружает файл уведомления в Telegram один раз
+
+    Файл отправляется в BROADCAST_STORAGE_CHAT_ID, получателям затем уходит
+    только file_id. Returns: (тип вложения, file_id) или None при ошибке.
+    """
+    media_type = 'photo' if (upload.mimetype or '').startswith('image/') else 'document'
+    method = 'sendPhoto' if media_type == 'photo' else 'sendDocument'
+    r = telegram.post(
+        f"{TELEGRAM_API}/{method}",
+        data={'chat_id': BROADCAST_STORAGE_CHAT_ID, 'disable_notification': True},
+        files={media_type: (upload.filename, upload.stream, upload.mimetype)}
+    )
+    if not r.ok:
+        return None
+    result = r.json()['result']
+    file_id = result['photo'][-1]['file_id'] if media_type == 'photo' else result['document']['file_id']
+    return media_type, file_id
+
 @app.route('/notify', methods=['GET', 'POST'])
 @login_required()
 def notify():
     if request.method == 'POST':
         notify_text = request.form.get('notify_text')
-        if notify_text:
+        upload = request.files.get('notify_file')
+        has_file = upload and upload.filename != ""
+        if notify_text or has_file:
+            # Текст без HTML-разметки, как и раньше
+            text = f"🔔 Уведомление:\n\n{notify_text}" if notify_text else None
+            media_type = file_id = None
+            if has_file:
+                media = upload_notify_file(upload)
+                if not media:
+                    flash("Ошибка загрузки файла уведомления.", 'danger')
+                    return redirect(url_for('dashboard'))
+                media_type, file_id = media
+            try:
+                payload = build_payload(text, None, media_type, file_id)
+            except ValueError as e:
+                flash(f"Ошибка уведомления: {e}", 'danger')
+                return redirect(url_for('dashboard'))
+            
+            # Рассылку выполняет бот (broadcast_job_worker): с общими лимитами отправки и учетом доставки
             conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_id FROM authorized_users")
-            rows = cursor.fetchall()
-            conn.close()
-            for row in rows:
-                user_id = row[0]
-                url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                data = {
-                    'chat_id': user_id,
-                    'text': f"🔔 Уведомление:\n\n{notify_text}"
-                }
-                requests.post(url, data=data)
-            flash("Уведомление отправлено всем пользователям!", 'success')
+            try:
+                rows = conn.execute("SELECT user_id FROM authorized_users WHERE unreachable_at IS NULL").fetchall()
+            finally:
+                conn.close()
+            job_id = create_broadcast_job_sync(payload, [row[0] for row in rows], audience='web')
+            flash(f"Уведомление поставлено в очередь: {len(rows)} получателей.", 'success')
+            return redirect(url_for('notify_job', job_id=job_id))
         return redirect(url_for('dashboard'))
     return render_template("notify.html")
 
+@app.route('/notify/<int:job_id>')
+@login_required()
+def notify_job(job_id):
+    job = get_broadcast_job_sync(job_id)
+    if not job:
+        flash(f"Рассылка #{job_id} не найдена.", 'danger')
+        return redirect(url_for('dashboard'))
+    return render_template("notify_job.html", job=job)
+
 @app.route('/schedule', methods=['GET', 'POST'])
 @login_required()
 def schedule():
@@ -205,7 +255,7 @@ def schedule():
             cursor = conn.cursor()
             cursor.execute("DELETE FROM coffee_schedule WHERE date LIKE ?", (f"%-{target_month_year}",))
             for fio, date_str in entries:
-                cursor.execute("INSERT INTO coffee_schedule (fio, date) VALUES (?, ?)", (fio, date_str))
+                cursor.execute("INSERT INTO coffee_schedule (fio, date, fio_key) VALUES (?, ?, ?)", (fio, date_str, normalize_fio(fio)))
             conn.commit()
             conn.close()
             flash("График на месяц успешно обновлен.", 'success')
@@ -300,7 +350,8 @@ def edit_user(user_id):
         position = request.form.get('position')
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        cursor.execute("UPDATE authorized_users SET fio = ?, position = ? WHERE user_id = ?", (fio, position, user_id))
+        cursor.execute("UPDATE authorized_users SET fio = ?, position = ?, fio_key = ? WHERE user_id = ?",
+                       (fio, position, normalize_fio(fio), user_id))
         conn.commit()
         conn.close()
         flash("Пользователь обновлён.", "success")
@@ -2,6 +2,7 @@
 Скрипт для запуска синхронизации сотрудников Bitrix24 с Excel файлом
 """
 
+import argparse
 import asyncio
 import os
 import sys
@@ -11,16 +12,17 @@ from dotenv import load_dotenv
 # Добавляем текущую директорию в путь для импорта
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from bitrix24_sync import sync_bitrix24_to_excel, get_sync_status
-from config import EXCEL_FILE, BITRIX24_WEBHOOK
+from bitrix24_sync import sync_bitrix24, get_sync_status
+from config import EXCEL_FILE, BITRIX24_WEBHOOK, BITRIX24_SYNC_TARGET
 
 # Загружаем переменные окружения
 load_dotenv()
 
-async def main():
+async def main(full: bool = False):
     """Основная функция синхронизации"""
     print("=== Синхронизация сотрудников Bitrix24 ===")
     print(f"Время запуска: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Режим: {'полная' if full else 'инкрементальная'} синхронизация")
     print()
     
     # Проверяем наличие webhook URL
@@ -31,6 +33,7 @@ async def main():
     
     print(f"🔗 Webhook URL: {BITRIX24_WEBHOOK}")
     print(f"📁 Excel файл: {EXCEL_FILE}")
+    print(f"🗄 Назначение: {BITRIX24_SYNC_TARGET}")
     print()
     
     # Проверяем статус перед синхронизацией
@@ -47,7 +50,7 @@ async def main():
     # Запускаем синхронизацию
     print("🔄 Запуск синхронизации...")
     try:
-        result = await sync_bitrix24_to_excel(BITRIX24_WEBHOOK)
+        result = await sync_bitrix24(BITRIX24_WEBHOOK, incremental=not full, refresh_departments=full)
         
         if result['success']:
             details = result['details']
@@ -58,6 +61,7 @@ async def main():
             print(f"   - Записей после синхронизации: {details.get('final_count', 0)}")
             print(f"   - Обновлено записей: {details.get('updated_count', 0)}")
             print(f"   - Добавлено новых записей: {details.get('added_count', 0)}")
+            print(f"   - Удалено (деактивировано): {details.get('removed_count', 0)}")
             print(f"   - Пропущено записей: {details.get('skipped_count', 0)}")
             print(f"   - Сотрудников в Bitrix24: {details.get('bitrix_users', 0)}")
         else:
@@ -70,4 +74,11 @@ async def main():
     print(f"Время завершения: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Синхронизация сотрудников Bitrix24 с Excel файлом")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Полная пересинхронизация (включая структуру отделов) вместо загрузки изменений с последнего запуска"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(full=args.full)) 
\ No newline at end of file
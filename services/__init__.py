@@ -5,11 +5,41 @@
 from .excel_service import *
 from .sync_service import *
 from .notification_service import *
+from .broadcast import *
+from .broadcast_jobs import *
+from .outbound import *
+from .scheduler import *
+from .leases import *
+from .bot_registry import *
+from .fsm_storage import *
 
 __all__ = [
     'ExcelService',
     'SyncService', 
     'NotificationService',
+    'BroadcastEngine',
+    'get_broadcast_engine',
+    'create_broadcast',
+    'run_broadcast_job',
+    'resume_broadcast_jobs',
+    'broadcast_job_worker',
+    'cancel_broadcast_job',
+    'BroadcastProgress',
+    'OutboundDispatcher',
+    'get_outbound_dispatcher',
+    'setup_outbound_dispatcher',
+    'bulk_sends',
+    'JobScheduler',
+    'CronSpec',
+    'LeaseManager',
+    'LeaseBackend',
+    'SQLiteLeaseBackend',
+    'get_lease_manager',
+    'set_lease_manager',
+    'create_bot',
+    'set_bot',
+    'get_bot',
+    'SQLiteStorage',
     'search_in_excel',
     'export_contacts',
     'sync_with_channel',
@@ -0,0 +1,43 @@
+"""
+Общий экземпляр бота
+
+Бот и его HTTP-сессия создаются один раз в bot.py и регистрируются здесь;
+обработчики и сервисы получают его через get_bot(), а не создают Bot(...)
+сами: каждый новый Bot открывает собственную aiohttp-сессию, которую никто
+не закрывает, а каждый ответ через нее заново устанавливает TLS-соединение.
+"""
+
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+# Соединений в пуле сессии: рассылки держат до 20 одновременных отправок,
+# остальное — запас для интерактивных ответов и getUpdates
+BOT_CONNECTION_LIMIT = 50
+
+_bot: Optional[Bot] = None
+
+
+def create_bot(token: str, api_server: str = None, connection_limit: int = BOT_CONNECTION_LIMIT) -> Bot:
+    """Создает бота с HTML-разметкой по умолчанию и пулом соединений на connection_limit"""
+    api = TelegramAPIServer.from_base(api_server) if api_server else None
+    session = AiohttpSession(limit=connection_limit, **({'api': api} if api else {}))
+    return Bot(token=token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+
+def set_bot(bot: Bot) -> Bot:
+    """Регистрирует общий экземпляр бота"""
+    global _bot
+    _bot = bot
+    return bot
+
+
+def get_bot() -> Bot:
+    """Общий экземпляр бота, зарегистрированный в bot.py"""
+    if _bot is None:
+        raise RuntimeError("Бот не зарегистрирован: вызовите set_bot() при запуске")
+    return _bot
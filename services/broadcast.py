@@ -0,0 +1,118 @@
+"""
+Массовая рассылка сообщений с соблюдением лимитов Telegram
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+
+from utils.rate_limit import backoff_delay
+
+from .outbound import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+# Сколько отправок выполняется одновременно
+BROADCAST_CONCURRENCY = 20
+# Сколько раз повторяется отправка после RetryAfter и ошибок сервера Telegram
+MAX_SEND_ATTEMPTS = 5
+
+
+class BroadcastEngine:
+    """
+    Рассылка по списку чатов
+
+    Отправки идут через очередь массовых запросов диспетчера исходящих
+    запросов (services/outbound.py), который соблюдает общий лимит бота и
+    лимиты чатов и пропускает интерактивные ответы вперед. Движок ограничивает
+    число одновременных отправок и повторяет отправки после TelegramRetryAfter
+    и ошибок сервера Telegram.
+    """
+
+    def __init__(self, concurrency: int = BROADCAST_CONCURRENCY):
+        self.concurrency = concurrency
+
+    async def send(self, chat_id: int, send_func: Callable[[int], Awaitable[Any]]) -> Any:
+        """
+        Отправляет одно сообщение с повторами
+
+        Повторяются только отправки, которые Telegram точно не выполнил
+        (RetryAfter, ошибки 5xx). Сетевые ошибки не повторяются: сообщение
+        могло быть доставлено. Остальные ошибки пробрасываются вызывающему.
+        """
+        attempt = 0
+        with bulk_sends():
+            while True:
+                attempt += 1
+                try:
+                    return await send_func(chat_id)
+                except TelegramRetryAfter as e:
+                    if attempt >= MAX_SEND_ATTEMPTS:
+                        raise
+                    logger.warning(f"Telegram ограничил частоту отправки, пауза {e.retry_after} с")
+                    await asyncio.sleep(e.retry_after)
+                except TelegramServerError as e:
+                    if attempt >= MAX_SEND_ATTEMPTS:
+                        raise
+                    delay = backoff_delay(attempt)
+                    logger.warning(f"Временная ошибка отправки в чат {chat_id}: {e}. Повтор через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+
+    async def run(self, chat_ids: Iterable[int], send_func: Callable[[int], Awaitable[Any]],
+                  on_result: Optional[Callable[[int, Optional[Exception]], Awaitable[None]]] = None,
+                  stop: Optional[asyncio.Event] = None) -> Dict[str, Any]:
+        """
+        Рассылает сообщение всем чатам
+
+        Args:
+            chat_ids: Получатели
+            send_func: Корутина отправки в один чат
+            on_result: Необязательный обработчик результата каждой отправки
+                (ошибка или None при успехе)
+            stop: Событие остановки: после его установки новые отправки не
+                начинаются, уже начатые завершаются
+
+        Returns:
+            Dict с ключами sent (список чатов) и failed ({чат: ошибка})
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+
+        sent: List[int] = []
+        failed: Dict[int, Exception] = {}
+
+        async def worker():
+            while stop is None or not stop.is_set():
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                error = None
+                try:
+                    await self.send(chat_id, send_func)
+                    sent.append(chat_id)
+                except Exception as e:
+                    error = e
+                    failed[chat_id] = e
+                    logger.error(f"Ошибка отправки пользователю {chat_id}: {e}")
+                if on_result is not None:
+                    await on_result(chat_id, error)
+
+        workers = min(self.concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+        return {'sent': sent, 'failed': failed}
+
+
+_engine: Optional[BroadcastEngine] = None
+
+
+def get_broadcast_engine() -> BroadcastEngine:
+    """Общий для процесса движок рассылки: лимиты Telegram действуют на весь бот"""
+    global _engine
+    if _engine is None:
+        _engine = BroadcastEngine()
+    return _engine
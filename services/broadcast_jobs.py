@@ -0,0 +1,431 @@
+"""
+Задания массовой рассылки с сохранением статуса доставки
+
+Задание и список получателей хранятся в базе данных. Перед отправкой
+получатель переводится в статус sending, после — в sent или failed, поэтому
+после перезапуска бота рассылка продолжается с тех, кому сообщение еще не
+отправлялось, и никто не получает его дважды.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from .broadcast import get_broadcast_engine
+from .outbound import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+# Задания, которые выполняются в этом процессе, и события их остановки
+_running_jobs: Dict[int, asyncio.Event] = {}
+# Не чаще одного изменения сообщения о ходе рассылки за столько секунд
+PROGRESS_INTERVAL = 3.0
+# Как часто фоновый обработчик проверяет новые задания (например, из веб-интерфейса)
+QUEUE_POLL_INTERVAL = 5.0
+
+
+# Ошибки Telegram, после которых отправка пользователю бессмысленна
+UNREACHABLE_REASONS = {
+    'bot was blocked by the user': 'blocked',
+    'user is deactivated': 'deactivated',
+    'chat not found': 'chat_not_found',
+    "bot can't initiate conversation": 'not_started',
+}
+
+
+def classify_send_error(error: Exception) -> Optional[str]:
+    """
+    Определяет, недоступен ли получатель навсегда
+
+    Returns:
+        Причина (blocked, deactivated, chat_not_found, not_started, forbidden)
+        или None для временных и прочих ошибок
+    """
+    if not isinstance(error, (TelegramForbiddenError, TelegramBadRequest)):
+        return None
+    text = str(error).lower()
+    for marker, reason in UNREACHABLE_REASONS.items():
+        if marker in text:
+            return reason
+    return 'forbidden' if isinstance(error, TelegramForbiddenError) else None
+
+
+# Типы вложений рассылки и методы их отправки по file_id
+MEDIA_TYPES = ('photo', 'document')
+
+
+def build_payload(text: Optional[str], parse_mode: Optional[str] = ParseMode.HTML,
+                  media_type: str = None, file_id: str = None) -> str:
+    """
+    Сериализует содержимое рассылки для хранения в задании
+
+    Для вложений хранится только file_id уже загруженного в Telegram файла,
+    text становится подписью.
+    """
+    payload = {'text': text, 'parse_mode': parse_mode}
+    if media_type:
+        if media_type not in MEDIA_TYPES or not file_id:
+            raise ValueError(f"Неподдерживаемое вложение рассылки: {media_type}")
+        payload.update(media_type=media_type, file_id=file_id)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+async def send_payload(bot: Bot, chat_id: int, payload: Dict[str, Any]):
+    """Отправляет содержимое рассылки одному получателю"""
+    media_type = payload.get('media_type')
+    if media_type == 'photo':
+        return await bot.send_photo(chat_id, payload['file_id'], caption=payload.get('text'),
+                                    parse_mode=payload.get('parse_mode'))
+    if media_type == 'document':
+        return await bot.send_document(chat_id, payload['file_id'], caption=payload.get('text'),
+                                       parse_mode=payload.get('parse_mode'))
+    return await bot.send_message(chat_id, payload['text'], parse_mode=payload.get('parse_mode'))
+
+
+class BroadcastProgress:
+    """
+    Сообщение о ходе рассылки, которое обновляется на месте
+
+    Счетчики меняются после каждой отправки, а сообщение редактируется не
+    чаще раза в interval секунд и только при изменениях. Правки идут в
+    очереди массовых отправок (bulk_sends), как и сама рассылка, и не
+    задерживают интерактивные ответы бота.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, job_id: int, interval: float = PROGRESS_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.job_id = job_id
+        self.interval = interval
+        self.message_id: Optional[int] = None
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.processed = 0  # Обработано в этом запуске, для оценки скорости
+        self._started = 0.0
+        self._shown = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def remaining(self) -> int:
+        return max(self.total - self.sent - self.failed, 0)
+
+    def _eta(self) -> Optional[float]:
+        elapsed = time.monotonic() - self._started
+        if not self.processed or elapsed <= 0:
+            return None
+        return self.remaining / (self.processed / elapsed)
+
+    def render(self, status: str = 'running') -> str:
+        """Текст сообщения о ходе рассылки"""
+        if status == 'done':
+            title = f"✅ <b>Рассылка #{self.job_id} завершена</b>"
+        elif status == 'cancelled':
+            title = f"⛔ <b>Рассылка #{self.job_id} остановлена</b>"
+        else:
+            title = f"📨 <b>Рассылка #{self.job_id}</b>"
+
+        text = (
+            f"{title}\n\n"
+            f"✅ Отправлено: {self.sent}\n"
+            f"❌ Ошибок: {self.failed}\n"
+            f"⏳ Осталось: {self.remaining} из {self.total}"
+        )
+        if status == 'running':
+            eta = self._eta()
+            if eta is not None:
+                minutes, seconds = divmod(int(eta), 60)
+                text += f"\n🕒 Завершится примерно через {minutes}:{seconds:02d}"
+        return text
+
+    async def start(self, total: int, sent: int = 0, failed: int = 0):
+        """Отправляет сообщение о ходе рассылки с кнопкой остановки"""
+        from inline_keyboards import BeautifulInlineKeyboards
+
+        self.total, self.sent, self.failed = total, sent, failed
+        self._started = time.monotonic()
+        self._shown = self.render()
+        message = await self.bot.send_message(
+            self.chat_id, self._shown, parse_mode=ParseMode.HTML,
+            reply_markup=BeautifulInlineKeyboards.create_broadcast_cancel_keyboard(self.job_id)
+        )
+        self.message_id = message.message_id
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    def record(self, error: Optional[Exception]):
+        """Учитывает результат одной отправки"""
+        self.processed += 1
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    async def _edit(self, text: str, keep_button: bool = True):
+        from inline_keyboards import BeautifulInlineKeyboards
+
+        try:
+            with bulk_sends():
+                await self.bot.edit_message_text(
+                    text, chat_id=self.chat_id, message_id=self.message_id, parse_mode=ParseMode.HTML,
+                    reply_markup=BeautifulInlineKeyboards.create_broadcast_cancel_keyboard(self.job_id)
+                    if keep_button else None
+                )
+            self._shown = text
+        except Exception as e:
+            logger.warning(f"Не удалось обновить ход рассылки {self.job_id}: {e}")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            text = self.render()
+            if text != self._shown:
+                await self._edit(text)
+
+    async def finish(self, status: str):
+        """Показывает итог рассылки и убирает кнопку остановки"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.message_id is not None:
+            await self._edit(self.render(status), keep_button=False)
+
+
+async def create_broadcast(recipients: Iterable[int], text: Optional[str], parse_mode: Optional[str] = ParseMode.HTML,
+                           audience: str = None, created_by: int = None,
+                           media_type: str = None, file_id: str = None, queued: bool = False) -> int:
+    """
+    Создает задание рассылки и возвращает его ID
+
+    queued=True — задание выполнит фоновый обработчик (broadcast_job_worker),
+    иначе вызывающий сам запускает run_broadcast_job.
+    """
+    from database import create_broadcast_job
+
+    recipients = list(dict.fromkeys(recipients))
+    payload = build_payload(text, parse_mode, media_type, file_id)
+    job_id = await create_broadcast_job(payload, recipients, audience, created_by,
+                                        status='queued' if queued else 'running')
+    logger.info(f"Создано задание рассылки {job_id}: {len(recipients)} получателей")
+    return job_id
+
+
+async def run_broadcast_job(bot: Bot, job_id: int, progress_chat_id: int = None) -> Optional[Dict[str, Any]]:
+    """
+    Выполняет (или продолжает) задание рассылки
+
+    Задание выполняет экземпляр бота, захвативший аренду broadcast:<job_id>
+    (get_lease_manager). Отправки, прерванные у прежнего владельца (sending),
+    переводятся в unknown только после захвата аренды и только для этого
+    задания. Если аренда потеряна, новые отправки не начинаются, а статус
+    задания не меняется — рассылку продолжит новый владелец.
+
+    Args:
+        bot: Бот
+        job_id: ID задания
+        progress_chat_id: Чат, в котором показывается ход рассылки с кнопкой остановки
+
+    Получатели, недоступные навсегда (classify_send_error), отмечаются в
+    authorized_users сразу после ошибки — для рассылок из бота, веб-интерфейса
+    и продолженных после перезапуска одинаково.
+
+    Returns:
+        Dict с ключами sent и failed (как у BroadcastEngine.run) для получателей,
+        обработанных в этом запуске, unreachable ({user_id: причина}) и cancelled;
+        None, если задание не найдено или выполняется (в этом или другом экземпляре)
+    """
+    from .leases import get_lease_manager
+
+    if job_id in _running_jobs:
+        logger.info(f"Задание рассылки {job_id} уже выполняется")
+        return None
+
+    stop = _running_jobs[job_id] = asyncio.Event()
+    try:
+        async with get_lease_manager().hold(f'broadcast:{job_id}') as lease:
+            if lease is None:
+                logger.info(f"Задание рассылки {job_id} выполняет другой экземпляр бота")
+                return None
+            return await _run_leased_job(bot, job_id, progress_chat_id, stop, lease)
+    finally:
+        _running_jobs.pop(job_id, None)
+
+
+async def _stop_when_lost(lease, stop: asyncio.Event):
+    await lease.lost.wait()
+    stop.set()
+
+
+async def _run_leased_job(bot: Bot, job_id: int, progress_chat_id: Optional[int], stop: asyncio.Event,
+                          lease) -> Optional[Dict[str, Any]]:
+    """Выполняет задание рассылки под захваченной арендой"""
+    from database import (get_broadcast_job, get_pending_broadcast_recipients, set_broadcast_job_status,
+                          broadcast_delivery_log, mark_users_unreachable, mark_interrupted_broadcast_deliveries)
+
+    job = await get_broadcast_job(job_id)
+    if not job:
+        logger.error(f"Задание рассылки {job_id} не найдено")
+        return None
+    if job['status'] in ('done', 'cancelled'):
+        return {'sent': [], 'failed': {}, 'unreachable': {}, 'cancelled': job['status'] == 'cancelled'}
+
+    interrupted = await mark_interrupted_broadcast_deliveries(job_id)
+    if interrupted:
+        logger.warning(f"Рассылка {job_id}: прерванных отправок с неизвестным результатом: {interrupted}")
+        job = await get_broadcast_job(job_id)
+
+    progress = None
+    try:
+        payload = json.loads(job['payload'])
+        recipients = await get_pending_broadcast_recipients(job_id)
+        await set_broadcast_job_status(job_id, 'running')
+        logger.info(f"Рассылка {job_id}: осталось {len(recipients)} из {job['total']} получателей")
+
+        if progress_chat_id:
+            progress = BroadcastProgress(bot, progress_chat_id, job_id)
+            try:
+                await progress.start(job['total'], job['sent'], job['failed'] + job['unknown'])
+            except Exception as e:
+                logger.warning(f"Не удалось отправить ход рассылки {job_id}: {e}")
+                progress = None
+
+        # Получатели, отправка которым начата в этом запуске: повторы после
+        # RetryAfter и ошибок сервера Telegram не должны считаться дублями
+        started: Set[int] = set()
+        # Пропущенные получатели: отправка уже начиналась раньше, рассылка остановлена
+        # или аренда задания потеряна
+        skipped: Set[int] = set()
+        unreachable: Dict[int, str] = {}
+
+        async def send(user_id: int):
+            if user_id not in started:
+                if stop.is_set() or lease.lost.is_set() or not await deliveries.start(user_id):
+                    skipped.add(user_id)
+                    return
+                started.add(user_id)
+            await send_payload(bot, user_id, payload)
+
+        async def on_result(user_id: int, error: Optional[Exception]):
+            if user_id in skipped:
+                return
+            if progress:
+                progress.record(error)
+            if error is None:
+                await deliveries.finish(user_id, 'sent')
+            else:
+                await deliveries.finish(user_id, 'failed', str(error))
+                reason = classify_send_error(error)
+                if reason:
+                    unreachable[user_id] = reason
+                    await mark_users_unreachable({user_id: reason})
+
+        # Потеря аренды останавливает выдачу новых отправок так же, как кнопка остановки
+        # Статусы доставки пишутся через одно соединение на весь запуск
+        lost = asyncio.create_task(_stop_when_lost(lease, stop))
+        try:
+            async with broadcast_delivery_log(job_id) as deliveries:
+                result = await get_broadcast_engine().run(recipients, send, on_result, stop=stop)
+        finally:
+            lost.cancel()
+        result['sent'] = [user_id for user_id in result['sent'] if user_id not in skipped]
+        result['unreachable'] = unreachable
+
+        if lease.lost.is_set():
+            logger.warning(f"Рассылка {job_id} прервана: аренда перешла другому экземпляру")
+            result['cancelled'] = False
+            return result
+
+        result['cancelled'] = stop.is_set()
+        status = 'cancelled' if stop.is_set() else 'done'
+        await set_broadcast_job_status(job_id, status)
+        if progress:
+            await progress.finish(status)
+            progress = None
+        logger.info(
+            f"Рассылка {job_id} {'остановлена' if stop.is_set() else 'завершена'}: "
+            f"отправлено {len(result['sent'])}, ошибок {len(result['failed'])}, недоступны {len(unreachable)}"
+        )
+        return result
+    finally:
+        if progress and progress._task:
+            progress._task.cancel()
+
+
+async def cancel_broadcast_job(job_id: int) -> bool:
+    """
+    Останавливает рассылку: новые отправки не начинаются, начатые завершаются
+
+    Returns:
+        False, если задание уже завершено или не найдено
+    """
+    from database import get_broadcast_job, set_broadcast_job_status
+
+    stop = _running_jobs.get(job_id)
+    if stop is not None:
+        stop.set()
+        logger.info(f"Запрошена остановка рассылки {job_id}")
+        return True
+
+    job = await get_broadcast_job(job_id)
+    if not job or job['status'] in ('done', 'cancelled'):
+        return False
+    await set_broadcast_job_status(job_id, 'cancelled')
+    logger.info(f"Рассылка {job_id} отменена до запуска")
+    return True
+
+
+async def resume_broadcast_jobs(bot: Bot):
+    """
+    Продолжает незавершенные задания рассылки после перезапуска бота
+
+    Задания в очереди забираются условным UPDATE (claim_broadcast_job),
+    выполняемые задания — через аренду в run_broadcast_job, поэтому при
+    нескольких экземплярах бота каждое задание продолжает только один из них.
+    """
+    from database import get_broadcast_jobs, claim_broadcast_job
+
+    jobs = await get_broadcast_jobs(limit=100, statuses=('queued', 'running'))
+    for job in reversed(jobs):
+        try:
+            if job['status'] == 'queued' and not await claim_broadcast_job(job['id']):
+                continue
+            await run_broadcast_job(bot, job['id'], progress_chat_id=job['created_by'])
+        except Exception as e:
+            logger.error(f"Ошибка продолжения рассылки {job['id']}: {e}")
+
+
+async def broadcast_job_worker(bot: Bot, poll_interval: float = QUEUE_POLL_INTERVAL):
+    """
+    Фоновый обработчик заданий рассылки
+
+    После запуска продолжает прерванные рассылки, затем выполняет задания,
+    поставленные в очередь другими процессами (веб-интерфейс /notify).
+    Задание из очереди выполняет экземпляр, первым забравший его
+    (claim_broadcast_job). Начатое задание, аренда которого истекла (владелец
+    остановился), продолжает другой экземпляр.
+    """
+    from database import get_broadcast_jobs, claim_broadcast_job
+
+    await resume_broadcast_jobs(bot)
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            jobs = await get_broadcast_jobs(limit=10, statuses=('queued', 'running'))
+            for job in reversed(jobs):
+                if job['status'] == 'queued':
+                    if not await claim_broadcast_job(job['id']):
+                        continue
+                # Задание, созданное для немедленного запуска (started_at еще нет), выполняет его создатель
+                elif job['started_at'] is None or job['id'] in _running_jobs:
+                    continue
+                await run_broadcast_job(bot, job['id'], progress_chat_id=job['created_by'])
+        except Exception as e:
+            logger.error(f"Ошибка обработки очереди рассылок: {e}")
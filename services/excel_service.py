@@ -5,8 +5,9 @@
 import pandas as pd
 import os
 import logging
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from config import EXCEL_FILE
+from excel_handler import add_contacts_listener
 
 logger = logging.getLogger(__name__)
 
@@ -14,17 +15,34 @@ logger = logging.getLogger(__name__)
 class ExcelService:
     """Сервис для работы с Excel файлами"""
     
+    # Загруженные файлы: {абсолютный путь: ((mtime, размер), DataFrame)}
+    _cache: Dict[str, Tuple[Tuple[float, int], pd.DataFrame]] = {}
+    
     def __init__(self, file_path: str = None):
         self.file_path = file_path or EXCEL_FILE
     
+    @classmethod
+    def invalidate_cache(cls, file_path: str):
+        """Сбрасывает загруженные данные файла (вызывается при изменении контактов)"""
+        cls._cache.pop(os.path.abspath(file_path), None)
+    
     def load_data(self) -> Optional[pd.DataFrame]:
-        """Загружает данные из Excel файла"""
+        """Загружает данные из Excel файла (повторно читает только измененный файл)"""
         try:
             if not os.path.exists(self.file_path):
                 logger.warning(f"Excel файл не найден: {self.file_path}")
                 return None
             
+            key = os.path.abspath(self.file_path)
+            file_stat = os.stat(key)
+            signature = (file_stat.st_mtime, file_stat.st_size)
+            
+            cached = self._cache.get(key)
+            if cached and cached[0] == signature:
+                return cached[1]
+            
             df = pd.read_excel(self.file_path)
+            self._cache[key] = (signature, df)
             logger.info(f"Загружено {len(df)} записей из Excel")
             return df
         
@@ -150,6 +168,9 @@ class ExcelService:
         }
 
 
+add_contacts_listener(ExcelService.invalidate_cache)
+
+
 # Функции для совместимости
 def search_in_excel(query: str, search_type: str = "fio") -> List[Dict[str, Any]]:
     """Поиск в Excel файле"""
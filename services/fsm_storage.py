@@ -0,0 +1,185 @@
+"""
+Хранилище состояний FSM в SQLite
+
+Состояния диалогов (авторизация, поиск, предложение новости) сохраняются в
+таблице fsm_states и переживают перезапуск бота. Изменения накапливаются в
+памяти и записываются одной транзакцией раз в flush_interval секунд, поэтому
+несколько шагов диалога подряд дают одну запись в базу. Чтения идут в базу
+(кроме еще не записанных изменений этого экземпляра), так что несколько
+экземпляров бота над одним bot.db видят изменения друг друга не позже чем
+через flush_interval. Запись версионируется по updated_at: более старое
+изменение не затирает более новое. Состояния, не менявшиеся дольше ttl
+секунд, считаются пустыми и удаляются.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+FSM_STATE_TTL = 24 * 3600
+FLUSH_INTERVAL = 0.5
+# Как часто удалять устаревшие состояния из базы
+SWEEP_INTERVAL = 300.0
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: str = '{}'  # JSON
+    updated_at: float = 0.0
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram на SQLite (WAL) с отложенной записью и TTL
+
+    Таблица fsm_states создается в init_db. При аварийной остановке теряются
+    изменения не более чем за flush_interval секунд.
+    """
+
+    def __init__(self, path: str, ttl: float = FSM_STATE_TTL, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # Изменения, еще не записанные в базу, и изменения, которые пишутся сейчас
+        self._pending: Dict[str, _Record] = {}
+        self._flushing: Dict[str, _Record] = {}
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) if part is not None else '' for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    async def _connect(self) -> aiosqlite.Connection:
+        async with self._connect_lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.path)
+                await conn.execute('PRAGMA journal_mode=WAL')
+                await conn.execute('PRAGMA synchronous=NORMAL')
+                self._conn = conn
+                self._flush_task = asyncio.create_task(self._flush_loop())
+        return self._conn
+
+    async def _record(self, name: str) -> _Record:
+        """Незаписанное изменение этого экземпляра или текущая запись из базы"""
+        record = self._pending.get(name) or self._flushing.get(name)
+        if record is not None:
+            return record
+        conn = await self._connect()
+        async with conn.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (name,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            return _Record()
+        return _Record(row[0], row[1], row[2])
+
+    async def _update(self, key: StorageKey, **changes):
+        name = self._key(key)
+        record = self._pending.get(name)
+        if record is None:
+            current = await self._record(name)
+            # Пока шел запрос, изменение могло появиться
+            record = self._pending.setdefault(name, replace(current))
+        for field_name, value in changes.items():
+            setattr(record, field_name, value)
+        record.updated_at = time.time()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._update(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        try:
+            serialized = json.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            raise TypeError(f"Данные состояния FSM должны сериализоваться в JSON: {e}") from e
+        await self._update(key, data=serialized)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return json.loads((await self._record(self._key(key))).data)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._pending or self._conn is None or self._flushing:
+            return
+        self._flushing, self._pending = self._pending, {}
+        upserts, deletes = [], []
+        for name, record in self._flushing.items():
+            if record.state is None and record.data == '{}':
+                deletes.append((name, record.updated_at))
+            else:
+                upserts.append((name, record.state, record.data, record.updated_at))
+        try:
+            if upserts:
+                await self._conn.executemany(
+                    '''INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                           updated_at = excluded.updated_at
+                       WHERE excluded.updated_at >= fsm_states.updated_at''',
+                    upserts
+                )
+            if deletes:
+                await self._conn.executemany('DELETE FROM fsm_states WHERE key = ? AND updated_at <= ?', deletes)
+            await self._conn.commit()
+        except BaseException:
+            # Повторим при следующей записи, если ключ с тех пор не менялся
+            for name, record in self._flushing.items():
+                self._pending.setdefault(name, record)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def sweep(self):
+        """Удаляет из базы состояния, не менявшиеся дольше ttl"""
+        now = time.time()
+        if self._conn is not None:
+            cursor = await self._conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (now - self.ttl,))
+            await self._conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Удалено устаревших состояний FSM: {cursor.rowcount}")
+        self._last_sweep = now
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_sweep >= SWEEP_INTERVAL:
+                    await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка записи состояний FSM: {e}")
+
+    async def close(self) -> None:
+        """Записывает оставшиеся изменения и закрывает соединение"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._conn is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи состояний FSM при остановке: {e}")
+            await self._conn.close()
+            self._conn = None
@@ -0,0 +1,147 @@
+"""
+Аренда (lease) задач для запуска нескольких экземпляров бота
+
+Перед выполнением периодической задачи экземпляр захватывает аренду с
+ограниченным сроком (TTL) и продлевает ее, пока задача работает. Если
+экземпляр упал, аренда истекает и задачу может выполнить другой экземпляр.
+Каждый захват выдает новый fencing token: результат задачи записывается,
+только если токен все еще актуален, поэтому «зависший» бывший владелец не
+перезапишет результат нового.
+
+Хранилище аренды подключаемое: по умолчанию это таблица job_leases в общей
+базе SQLite, для нескольких серверов можно реализовать LeaseBackend поверх
+Redis или другой общей базы.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Срок аренды по умолчанию; продление — каждую треть срока
+LEASE_TTL = 60.0
+
+
+def default_instance_id() -> str:
+    """Уникальный идентификатор экземпляра: хост, PID и случайный суффикс"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseBackend(ABC):
+    """Хранилище аренды; время — unix time, общее для всех экземпляров"""
+
+    @abstractmethod
+    async def acquire(self, name: str, holder: str, ttl: float) -> Optional[int]:
+        """Захватывает аренду; возвращает fencing token или None, если она занята"""
+
+    @abstractmethod
+    async def renew(self, name: str, holder: str, token: int, ttl: float) -> bool:
+        """Продлевает аренду; False, если она потеряна"""
+
+    @abstractmethod
+    async def release(self, name: str, holder: str, token: int):
+        """Освобождает аренду"""
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """Аренда в таблице job_leases общей базы данных бота"""
+
+    async def acquire(self, name: str, holder: str, ttl: float) -> Optional[int]:
+        from database import acquire_job_lease
+        return await acquire_job_lease(name, holder, ttl, time.time())
+
+    async def renew(self, name: str, holder: str, token: int, ttl: float) -> bool:
+        from database import renew_job_lease
+        return await renew_job_lease(name, holder, token, ttl, time.time())
+
+    async def release(self, name: str, holder: str, token: int):
+        from database import release_job_lease
+        await release_job_lease(name, holder, token)
+
+
+class Lease:
+    """Захваченная аренда; lost выставляется, если продлить ее не удалось"""
+
+    def __init__(self, name: str, token: int):
+        self.name = name
+        self.token = token
+        self.lost = asyncio.Event()
+
+
+class LeaseManager:
+    """Захват аренды с автоматическим продлением"""
+
+    def __init__(self, backend: LeaseBackend, instance_id: str = None, ttl: float = LEASE_TTL):
+        self.backend = backend
+        self.instance_id = instance_id or default_instance_id()
+        self.ttl = ttl
+
+    @asynccontextmanager
+    async def hold(self, name: str) -> AsyncIterator[Optional[Lease]]:
+        """
+        Захватывает аренду на время блока
+
+        Внутри блока доступна Lease или None, если аренда занята другим
+        экземпляром. Ошибка хранилища при захвате считается занятой арендой:
+        лучше пропустить запуск, чем выполнить задачу дважды.
+        """
+        try:
+            token = await self.backend.acquire(name, self.instance_id, self.ttl)
+        except Exception as e:
+            logger.error(f"Ошибка захвата аренды {name}: {e}")
+            token = None
+        if token is None:
+            yield None
+            return
+
+        lease = Lease(name, token)
+        renewal = asyncio.create_task(self._renew_loop(lease))
+        try:
+            yield lease
+        finally:
+            renewal.cancel()
+            try:
+                await renewal
+            except asyncio.CancelledError:
+                pass
+            if not lease.lost.is_set():
+                await self.backend.release(name, self.instance_id, token)
+
+    async def _renew_loop(self, lease: Lease):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                renewed = await self.backend.renew(lease.name, self.instance_id, lease.token, self.ttl)
+            except Exception as e:
+                # Аренда еще действует до истечения срока, попробуем снова
+                logger.error(f"Ошибка продления аренды {lease.name}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Аренда {lease.name} (токен {lease.token}) перешла другому экземпляру")
+                lease.lost.set()
+                return
+
+
+_lease_manager: Optional[LeaseManager] = None
+
+
+def set_lease_manager(manager: LeaseManager) -> LeaseManager:
+    """Регистрирует общий LeaseManager экземпляра (периодические задачи, рассылки)"""
+    global _lease_manager
+    _lease_manager = manager
+    return manager
+
+
+def get_lease_manager() -> LeaseManager:
+    """Общий LeaseManager; если не зарегистрирован — аренда в SQLite с параметрами по умолчанию"""
+    global _lease_manager
+    if _lease_manager is None:
+        _lease_manager = LeaseManager(SQLiteLeaseBackend())
+    return _lease_manager
@@ -3,13 +3,16 @@
 """
 
 import logging
+import os
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from aiogram import Bot
 from aiogram.enums import ParseMode
+from aiogram.types import BufferedInputFile, FSInputFile, InputFile
 
-logger = logging.getLogger(__name__)
+from .broadcast_jobs import classify_send_error, create_broadcast, run_broadcast_job
 
+logger = logging.getLogger(__name__)
 
 class NotificationService:
     """Сервис для отправки уведомлений"""
@@ -26,14 +29,91 @@ class NotificationService:
         
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+            reason = classify_send_error(e)
+            if reason:
+                from database import mark_users_unreachable
+                await mark_users_unreachable({user_id: reason})
             return False
     
-    async def send_to_all_users(self, message: str, parse_mode: ParseMode = ParseMode.HTML) -> Dict[str, Any]:
+    async def upload_media(self, media: Union[str, bytes, InputFile], media_type: str = 'photo',
+                           filename: str = None) -> str:
+        """
+        Загружает файл в Telegram один раз и возвращает его file_id
+        
+        Файл отправляется в BROADCAST_STORAGE_CHAT_ID; получателям рассылки
+        затем отправляется только file_id, поэтому объем загрузки не зависит
+        от числа получателей.
+        
+        Args:
+            media: Путь к файлу, содержимое, InputFile или уже готовый file_id
+            media_type: photo или document
+            filename: Имя файла для содержимого в bytes
+        """
+        from config import BROADCAST_STORAGE_CHAT_ID
+        
+        if isinstance(media, str) and not os.path.exists(media):
+            return media  # file_id уже загруженного файла
+        if isinstance(media, str):
+            media = FSInputFile(media)
+        elif isinstance(media, bytes):
+            media = BufferedInputFile(media, filename or ('photo.jpg' if media_type == 'photo' else 'file'))
+        
+        if media_type == 'photo':
+            sent = await self.bot.send_photo(BROADCAST_STORAGE_CHAT_ID, media, disable_notification=True)
+            file_id = sent.photo[-1].file_id
+        elif media_type == 'document':
+            sent = await self.bot.send_document(BROADCAST_STORAGE_CHAT_ID, media, disable_notification=True)
+            file_id = sent.document.file_id
+        else:
+            raise ValueError(f"Неподдерживаемый тип вложения: {media_type}")
+        
+        logger.info(f"Файл рассылки загружен в чат {BROADCAST_STORAGE_CHAT_ID}")
+        return file_id
+    
+    async def _broadcast(self, users: List, message: Optional[str], parse_mode: ParseMode, audience: str = None,
+                         media_type: str = None, file_id: str = None, admin_id: int = None,
+                         **extra) -> Dict[str, Any]:
+        """
+        Создает задание рассылки и выполняет его через общий движок рассылки
+        
+        admin_id — администратор, запустивший рассылку: ему показывается ход
+        рассылки с кнопкой остановки.
+        """
+        user_ids = [user[0] for user in users]  # Первый элемент - ID пользователя
+        
+        job_id = await create_broadcast(user_ids, message, parse_mode, audience=audience, created_by=admin_id,
+                                        media_type=media_type, file_id=file_id)
+        result = await run_broadcast_job(self.bot, job_id, progress_chat_id=admin_id)
+        if result is None:
+            return {
+                'success': False,
+                'error': f'Рассылка #{job_id} уже выполняется в другом экземпляре бота или не найдена',
+                'job_id': job_id,
+                'sent_count': 0,
+                'total_count': len(users)
+            }
+        failed_users = list(result['failed'])
+        
+        return {
+            'success': True,
+            'job_id': job_id,
+            'sent_count': len(result['sent']),
+            'failed_count': len(failed_users),
+            'total_count': len(users),
+            'failed_users': failed_users,
+            'unreachable_count': len(result.get('unreachable', {})),
+            'cancelled': result.get('cancelled', False),
+            **extra,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    async def send_to_all_users(self, message: str, parse_mode: ParseMode = ParseMode.HTML,
+                                admin_id: int = None) -> Dict[str, Any]:
         """Отправляет сообщение всем авторизованным пользователям"""
         try:
             from database import get_authorized_users
             
-            users = await get_authorized_users()
+            users = await get_authorized_users(reachable_only=True)
             if not users:
                 return {
                     'success': False,
@@ -42,32 +122,43 @@ class NotificationService:
                     'total_count': 0
                 }
             
-            sent_count = 0
-            failed_users = []
-            
-            for user in users:
-                user_id = user[0]  # Первый элемент - ID пользователя
-                
-                try:
-                    await self.bot.send_message(user_id, message, parse_mode=parse_mode)
-                    sent_count += 1
-                    logger.debug(f"Уведомление отправлено пользователю {user_id}")
-                
-                except Exception as e:
-                    logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
-                    failed_users.append(user_id)
-            
+            return await self._broadcast(users, message, parse_mode, audience='all', admin_id=admin_id)
+        
+        except Exception as e:
+            logger.error(f"Ошибка массовой отправки уведомлений: {e}")
             return {
-                'success': True,
-                'sent_count': sent_count,
-                'failed_count': len(failed_users),
-                'total_count': len(users),
-                'failed_users': failed_users,
-                'timestamp': datetime.now().isoformat()
+                'success': False,
+                'error': str(e),
+                'sent_count': 0,
+                'total_count': 0
             }
+    
+    async def send_media_to_all_users(self, media: Union[str, bytes, InputFile], media_type: str = 'photo',
+                                      caption: str = None, parse_mode: ParseMode = ParseMode.HTML,
+                                      filename: str = None, admin_id: int = None) -> Dict[str, Any]:
+        """
+        Отправляет фото или документ всем авторизованным пользователям
+        
+        Файл загружается один раз (upload_media), рассылка идет по file_id.
+        """
+        try:
+            from database import get_authorized_users
+            
+            users = await get_authorized_users(reachable_only=True)
+            if not users:
+                return {
+                    'success': False,
+                    'error': 'Нет авторизованных пользователей',
+                    'sent_count': 0,
+                    'total_count': 0
+                }
+            
+            file_id = await self.upload_media(media, media_type, filename)
+            return await self._broadcast(users, caption, parse_mode, audience='all',
+                                         media_type=media_type, file_id=file_id, admin_id=admin_id)
         
         except Exception as e:
-            logger.error(f"Ошибка массовой отправки уведомлений: {e}")
+            logger.error(f"Ошибка массовой отправки вложения: {e}")
             return {
                 'success': False,
                 'error': str(e),
@@ -103,7 +194,7 @@ class NotificationService:
         try:
             from database import get_users_by_roles
             
-            users = await get_users_by_roles(roles)
+            users = await get_users_by_roles(roles, reachable_only=True)
             if not users:
                 return {
                     'success': False,
@@ -112,29 +203,7 @@ class NotificationService:
                     'total_count': 0
                 }
             
-            sent_count = 0
-            failed_users = []
-            
-            for user in users:
-                user_id = user[0]  # Первый элемент - ID пользователя
-                
-                try:
-                    await self.bot.send_message(user_id, message, parse_mode=parse_mode)
-                    sent_count += 1
-                
-                except Exception as e:
-                    logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
-                    failed_users.append(user_id)
-            
-            return {
-                'success': True,
-                'sent_count': sent_count,
-                'failed_count': len(failed_users),
-                'total_count': len(users),
-                'failed_users': failed_users,
-                'roles': roles,
-                'timestamp': datetime.now().isoformat()
-            }
+            return await self._broadcast(users, message, parse_mode, audience=f"roles:{','.join(roles)}", roles=roles)
         
         except Exception as e:
             logger.error(f"Ошибка отправки по ролям: {e}")
@@ -0,0 +1,185 @@
+"""
+Диспетчер исходящих запросов бота с приоритетными очередями
+
+Все запросы бота к чатам проходят через middleware сессии aiogram. Общий
+token bucket держит скорость бота в пределах лимита Telegram, для каждого
+чата соблюдается собственный лимит. Интерактивные ответы (меню, результаты
+поиска) получают токены раньше массовых отправок (рассылки, напоминания о
+кофе), поэтому рассылка не замедляет работу с ботом.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from utils.rate_limit import TokenBucket
+
+# Очереди в порядке приоритета
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+# Общий лимит бота: около 30 сообщений в секунду; небольшой запас токенов,
+# чтобы в первую секунду рассылки не уйти заметно выше лимита
+OUTBOUND_RATE = 30.0
+OUTBOUND_BURST = 3
+# Лимиты одного чата: личный чат — сообщение в секунду, группа — 20 в минуту;
+# допускается короткая серия из CHAT_BURST сообщений
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+CHAT_BURST = 3
+
+_lane: ContextVar[str] = ContextVar('outbound_lane', default=INTERACTIVE)
+
+
+@contextmanager
+def outbound_lane(lane: str):
+    """Отправляет запросы внутри блока через указанную очередь"""
+    if lane not in LANES:
+        raise ValueError(f"Неизвестная очередь отправки: {lane}")
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def bulk_sends():
+    """Массовые отправки: уступают интерактивным ответам"""
+    return outbound_lane(BULK)
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """
+    Middleware сессии aiogram: лимиты Telegram и приоритет интерактивных ответов
+
+    Запросы без chat_id (getUpdates, answerCallbackQuery и т.п.) проходят без
+    ожидания. При TelegramRetryAfter общий лимит снижается и выдача токенов
+    приостанавливается на указанное время.
+    """
+
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: int = OUTBOUND_BURST,
+                 private_interval: float = PRIVATE_CHAT_INTERVAL,
+                 group_interval: float = GROUP_CHAT_INTERVAL, chat_burst: int = CHAT_BURST):
+        self.limiter = TokenBucket(rate, burst)
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.chat_burst = chat_burst
+        self._queues: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._granted = {lane: 0 for lane in LANES}
+        self._waited = {lane: 0.0 for lane in LANES}
+        self._chat_tat: Dict[Any, float] = {}
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        lane = _lane.get()
+        started = time.monotonic()
+        await self._wait_for_chat(chat_id)
+        await self._acquire(lane)
+        self._waited[lane] += time.monotonic() - started
+
+        try:
+            response = await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.limiter.penalize(e.retry_after)
+            raise
+        self.limiter.reward()
+        return response
+
+    async def _wait_for_chat(self, chat_id: Any):
+        """Лимит одного чата (GCRA): допускается серия из chat_burst сообщений"""
+        interval = self.group_interval if isinstance(chat_id, str) or chat_id < 0 else self.private_interval
+        now = time.monotonic()
+        if len(self._chat_tat) > 10000:
+            self._chat_tat = {chat: tat for chat, tat in self._chat_tat.items() if tat > now}
+        tat = max(now, self._chat_tat.get(chat_id, now))
+        self._chat_tat[chat_id] = tat + interval
+        delay = tat - now - interval * (self.chat_burst - 1)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, lane: str):
+        """Ставит запрос в очередь и ждет токена общего лимита"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues[lane].append(future)
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        self._wakeup.set()
+        await future
+
+    async def _pump(self):
+        """Выдает токены ожидающим запросам: сначала интерактивным, затем массовым"""
+        while True:
+            for queue in self._queues.values():
+                while queue and queue[0].done():  # Запрос отменен, пока ждал
+                    queue.popleft()
+            if not any(self._queues.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self.limiter.acquire()
+            for lane in LANES:
+                queue = self._queues[lane]
+                while queue and queue[0].done():
+                    queue.popleft()
+                if queue:
+                    queue.popleft().set_result(None)
+                    self._granted[lane] += 1
+                    break
+
+    def metrics(self) -> Dict[str, Any]:
+        """Глубина очередей, число отправленных запросов и среднее ожидание по очередям"""
+        lanes = {}
+        for lane in LANES:
+            granted = self._granted[lane]
+            lanes[lane] = {
+                'queued': sum(1 for future in self._queues[lane] if not future.done()),
+                'sent': granted,
+                'avg_wait': round(self._waited[lane] / granted, 3) if granted else 0.0
+            }
+        return {'lanes': lanes, 'rate': round(self.limiter.rate, 2)}
+
+    async def close(self):
+        """Останавливает выдачу токенов"""
+        if self._pump_task:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+
+
+_dispatcher: Optional[OutboundDispatcher] = None
+
+
+def get_outbound_dispatcher() -> OutboundDispatcher:
+    """Общий для процесса диспетчер: лимиты Telegram действуют на весь бот"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+
+def setup_outbound_dispatcher(bot: Bot) -> OutboundDispatcher:
+    """Подключает общий диспетчер к сессии бота (повторный вызов ничего не меняет)"""
+    dispatcher = get_outbound_dispatcher()
+    if dispatcher not in bot.session.middleware:
+        bot.session.middleware.register(dispatcher)
+    return dispatcher
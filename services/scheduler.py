@@ -0,0 +1,273 @@
+"""
+Планировщик периодических задач бота
+
+Задачи описываются cron-выражениями и хранятся в куче по времени
+следующего запуска; планировщик спит ровно до ближайшей задачи. Время
+последнего выполненного запуска каждой задачи сохраняется в базе данных:
+после перезапуска пропущенный запуск выполняется один раз (если прошло не
+больше catch_up_window секунд), а уже выполненный не повторяется.
+
+При нескольких экземплярах бота с LeaseManager задачу выполняет только
+экземпляр, захвативший ее аренду. Остальные повторяют попытку через срок
+аренды: если владелец упал, задачу выполнит другой экземпляр, а если он
+успел ее выполнить, запуск уже записан в базе и повторно не выполняется.
+Если владелец потерял аренду во время работы (не смог вовремя ее продлить),
+задача у него отменяется: ее выполняет экземпляр, захвативший аренду.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .leases import Lease, LeaseManager
+
+logger = logging.getLogger(__name__)
+
+# Планировщик просыпается не реже раза в столько секунд, чтобы учесть перевод системных часов
+MAX_SLEEP = 3600.0
+
+
+class CronSpec:
+    """
+    Cron-выражение из пяти полей: минута, час, день месяца, месяц, день недели
+
+    Поддерживаются *, числа, списки (1,15), диапазоны (1-5) и шаг (*/10).
+    День недели: 0-6, 0 — воскресенье (7 тоже воскресенье). Если заданы и
+    день месяца, и день недели, подходит любой из них, как в cron.
+    """
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron-выражение должно содержать 5 полей: {expression!r}")
+        self.expression = expression
+        values = [self._parse(part, low, high) for part, (_, low, high) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(part: str, low: int, high: int) -> List[int]:
+        values = set()
+        for item in part.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                step = int(step_text)
+                if step < 1:
+                    raise ValueError(f"Неверный шаг в cron-выражении: {part!r}")
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(value) for value in item.split('-', 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"Значение вне диапазона {low}-{high} в cron-выражении: {part!r}")
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        day_ok = day.day in self.days
+        weekday_ok = (day.isoweekday() % 7) in self.weekdays
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return weekday_ok
+        if self.any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайшее время запуска строго после moment (с точностью до минуты)"""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        # Поиск не дальше чем на 5 лет вперед: хватает для 29 февраля
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron-выражение никогда не срабатывает: {self.expression!r}")
+
+    def __repr__(self) -> str:
+        return f"CronSpec({self.expression!r})"
+
+
+@dataclass
+class ScheduledJob:
+    """Периодическая задача планировщика"""
+    name: str
+    spec: CronSpec
+    func: Callable[[], Awaitable[None]]
+    # Сколько секунд после пропущенного запуска его еще имеет смысл выполнить
+    catch_up_window: float = 0.0
+    last_run: Optional[datetime] = field(default=None, compare=False)
+
+
+class JobScheduler:
+    """Выполняет задачи по расписанию; одна и та же задача не запускается параллельно"""
+
+    def __init__(self, leases: LeaseManager = None):
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.leases = leases
+        # (когда запустить, порядковый номер, задача, запуск по расписанию)
+        self._heap: List[Tuple[datetime, int, str, datetime]] = []
+        self._counter = itertools.count()
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+    def add_job(self, name: str, cron: str, func: Callable[[], Awaitable[None]],
+                catch_up_window: float = 0.0) -> ScheduledJob:
+        """Регистрирует задачу (до или после запуска планировщика)"""
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        job = ScheduledJob(name, CronSpec(cron), func, catch_up_window)
+        self.jobs[name] = job
+        self._push(job, job.spec.next_after(datetime.now()))
+        self._wakeup.set()
+        return job
+
+    def _push(self, job: ScheduledJob, run_at: datetime, slot: datetime = None):
+        heapq.heappush(self._heap, (run_at, next(self._counter), job.name, slot or run_at))
+
+    async def _load_last_runs(self):
+        """Загружает время последних запусков и выполняет пропущенные"""
+        from database import get_scheduled_job_runs
+
+        last_runs = await get_scheduled_job_runs()
+        now = datetime.now()
+        for job in self.jobs.values():
+            job.last_run = last_runs.get(job.name)
+            if job.last_run is None or not job.catch_up_window:
+                continue
+            # Несколько пропущенных запусков выполняются один раз, по времени последнего из них
+            missed = None
+            slot = job.spec.next_after(job.last_run)
+            while slot <= now:
+                missed, slot = slot, job.spec.next_after(slot)
+            if missed and (now - missed).total_seconds() <= job.catch_up_window:
+                logger.info(f"Задача {job.name}: выполняется пропущенный запуск {missed:%d.%m.%Y %H:%M}")
+                self._start(job, missed)
+
+    def _start(self, job: ScheduledJob, slot: datetime):
+        if job.name in self._running:
+            logger.warning(f"Задача {job.name} еще выполняется, запуск {slot:%d.%m.%Y %H:%M} пропущен")
+            return
+        if job.last_run is not None and job.last_run >= slot:
+            return  # Этот запуск уже выполнен (например, до перезапуска бота)
+        self._running.add(job.name)
+        task = asyncio.create_task(self._execute(job, slot))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: ScheduledJob, slot: datetime):
+        """Выполняет задачу (под арендой, если она настроена) и сохраняет время запуска"""
+        try:
+            if self.leases is None:
+                await self._run_job(job, slot)
+                return
+            async with self.leases.hold(f"scheduler:{job.name}") as lease:
+                if lease is None:
+                    self._retry_later(job, slot)
+                    return
+                from database import get_scheduled_job_runs
+                last_run = (await get_scheduled_job_runs()).get(job.name)
+                if last_run is not None and last_run >= slot:
+                    job.last_run = last_run  # Запуск уже выполнил другой экземпляр
+                    return
+                await self._run_job(job, slot, lease=lease)
+        finally:
+            self._running.discard(job.name)
+
+    async def _run_job(self, job: ScheduledJob, slot: datetime, lease: Lease = None):
+        from database import save_scheduled_job_run
+
+        status, error = 'ok', None
+        try:
+            logger.info(f"Запуск задачи {job.name} ({slot:%d.%m.%Y %H:%M})")
+            if lease is None:
+                await job.func()
+            elif not await self._run_leased(job, lease):
+                logger.warning(f"Задача {job.name}: аренда потеряна, выполнение остановлено")
+                return
+        except Exception as e:
+            status, error = 'error', str(e)
+            logger.error(f"Ошибка задачи {job.name}: {e}")
+        job.last_run = slot
+        fence = (lease.name, lease.token) if lease else None
+        if not await save_scheduled_job_run(job.name, slot, status, error, lease=fence) and lease:
+            logger.warning(f"Задача {job.name}: аренда потеряна, запуск {slot:%d.%m.%Y %H:%M} не записан")
+
+    @staticmethod
+    async def _run_leased(job: ScheduledJob, lease: Lease) -> bool:
+        """
+        Выполняет задачу, пока аренда действует
+
+        Returns:
+            False, если аренда потеряна и задача отменена
+        """
+        task = asyncio.create_task(job.func())
+        lost = asyncio.create_task(lease.lost.wait())
+        try:
+            await asyncio.wait((task, lost), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            lost.cancel()
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if task.cancelled():
+            return False
+        task.result()  # Ошибка задачи обрабатывается в _run_job
+        return True
+
+    def _retry_later(self, job: ScheduledJob, slot: datetime):
+        """Аренда занята: проверим запуск снова, когда истечет ее срок"""
+        retry_at = datetime.now() + timedelta(seconds=self.leases.ttl)
+        window = max(job.catch_up_window, 3 * self.leases.ttl)
+        if (retry_at - slot).total_seconds() > window:
+            logger.info(f"Задача {job.name}: запуск {slot:%d.%m.%Y %H:%M} выполняет другой экземпляр")
+            return
+        self._push(job, retry_at, slot)
+        self._wakeup.set()
+
+    async def run(self):
+        """Основной цикл: спит до ближайшей задачи и запускает ее"""
+        await self._load_last_runs()
+        try:
+            while True:
+                self._wakeup.clear()
+                if self._heap:
+                    delay = (self._heap[0][0] - datetime.now()).total_seconds()
+                else:
+                    delay = MAX_SLEEP
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, MAX_SLEEP))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                run_at, _, name, slot = heapq.heappop(self._heap)
+                job = self.jobs[name]
+                self._start(job, slot)
+                if run_at == slot:  # Повторные попытки не планируют следующий запуск
+                    self._push(job, job.spec.next_after(max(slot, datetime.now())))
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
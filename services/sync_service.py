@@ -6,7 +6,7 @@ import logging
 import asyncio
 from datetime import datetime
 from typing import Dict, Any, List
-from config import BITRIX24_WEBHOOK, EXCEL_FILE
+from config import BITRIX24_WEBHOOK, BITRIX24_SYNC_TARGET, EXCEL_FILE
 
 logger = logging.getLogger(__name__)
 
@@ -17,22 +17,32 @@ class SyncService:
     def __init__(self):
         self.webhook_url = BITRIX24_WEBHOOK
         self.excel_file = EXCEL_FILE
+        self.sync_target = BITRIX24_SYNC_TARGET
     
     async def sync_with_bitrix24(self) -> Dict[str, Any]:
-        """Синхронизация с Bitrix24"""
+        """
+        Синхронизация с Bitrix24
+        
+        Данные загружаются из Bitrix24 один раз; статус до синхронизации,
+        изменения и файл контактов строятся из этого снимка. При
+        BITRIX24_SYNC_TARGET=sqlite снимок записывается в справочник SQLite,
+        а файл контактов выгружается из него.
+        """
         try:
             # Импортируем здесь, чтобы избежать циклических импортов
-            from bitrix24_sync import sync_bitrix24_to_excel, get_sync_status
+            from bitrix24_sync import Bitrix24Client, fetch_snapshot, apply_snapshot, apply_snapshot_to_sqlite
             
-            # Получаем статус перед синхронизацией
-            status = await get_sync_status(self.webhook_url)
+            async with Bitrix24Client(self.webhook_url) as client:
+                snapshot = await fetch_snapshot(client)
             
-            # Запускаем синхронизацию
-            result = await sync_bitrix24_to_excel(self.webhook_url)
+            if self.sync_target == 'sqlite':
+                result = await apply_snapshot_to_sqlite(snapshot, self.excel_file)
+            else:
+                result = await apply_snapshot(snapshot, self.excel_file)
             
             return {
                 'success': result.get('success', False),
-                'before_sync': status,
+                'before_sync': result.get('before', {}),
                 'sync_result': result,
                 'timestamp': datetime.now().isoformat()
             }
@@ -102,6 +112,21 @@ class SyncService:
                 'timestamp': datetime.now().isoformat()
             }
     
+    async def get_bitrix24_status(self) -> Dict[str, Any]:
+        """Облегченный статус Bitrix24: total из API и кэшированное число строк файла"""
+        try:
+            from bitrix24_sync import get_sync_status
+            
+            return await get_sync_status(self.webhook_url, self.excel_file)
+        
+        except ImportError:
+            logger.error("Модуль bitrix24_sync не найден")
+            return {
+                'excel_records': 0,
+                'bitrix_users': 0,
+                'error': 'Модуль bitrix24_sync не найден'
+            }
+    
     async def get_sync_status(self) -> Dict[str, Any]:
         """Получает общий статус синхронизации"""
         try:
@@ -0,0 +1,132 @@
+"""
+Замер полной синхронизации справочника Bitrix24 в SQLite
+
+    python -m tests.bench_bitrix24_directory [число сотрудников ...]
+
+Каждый размер запускается в отдельном процессе (пиковый RSS считается по
+ru_maxrss процесса). Поддельный портал отвечает с задержкой 20 мс, во
+время синхронизации другое соединение раз в 10 мс пишет в bot.db.
+
+    first row  — от начала синхронизации до записи первой страницы
+    swap       — сколько держится блокировка записи bot.db (перенос в справочник)
+    max wait   — худшая задержка записи другого соединения во время синхронизации
+    RSS        — пиковый RSS процесса и прирост относительно состояния до синхронизации
+
+Результаты (Python 3.11, SQLite 3.40):
+
+    users   total   first row   swap     max wait   RSS peak (+sync)
+     1000   0.81 s    0.04 s    0.01 s   0.047 s   225 MB (+7 MB)
+     5000   4.08 s    0.04 s    0.03 s   0.056 s   237 MB (+15 MB)
+    20000  14.92 s    0.04 s    0.09 s   0.253 s   266 MB (+30 MB)
+
+Когда все страницы писались в одной транзакции bot.db, запись другого
+соединения ждала до конца синхронизации и на тех же данных завершалась
+ошибкой «database is locked».
+"""
+
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from tests import support  # noqa: F401  (окружение до импорта модулей бота)
+
+import aiosqlite
+
+import bitrix24_sync
+import database
+from bitrix24_sync import Bitrix24Client, DepartmentTree
+from tests.bitrix24_mock import MockBitrix24, make_users, run_mock_bitrix24
+
+SIZES = (1000, 5000, 20000)
+
+
+def _rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _probe_writes(path: str, stop: asyncio.Event) -> float:
+    worst = 0.0
+    async with aiosqlite.connect(path, timeout=60) as conn:
+        while not stop.is_set():
+            started = time.perf_counter()
+            await conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('bench', '1')")
+            await conn.commit()
+            worst = max(worst, time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+    return worst
+
+
+async def run_once(users: int) -> dict:
+    timings = {}
+    write, apply = database.Bitrix24DirectoryWriter.write, database.Bitrix24DirectoryWriter.apply
+
+    async def timed_write(self, rows):
+        result = await write(self, rows)
+        timings.setdefault('first_row', time.perf_counter())
+        return result
+
+    async def timed_apply(self, removed_ids=()):
+        started = time.perf_counter()
+        try:
+            return await apply(self, removed_ids)
+        finally:
+            timings['swap'] = time.perf_counter() - started
+
+    database.Bitrix24DirectoryWriter.write = timed_write
+    database.Bitrix24DirectoryWriter.apply = timed_apply
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bot.db')
+        await database.init_db()
+        await database.init_sync_state_table()
+        async with run_mock_bitrix24(MockBitrix24(make_users(users))) as mock:
+            mock.delay = 0.02
+            rss_before = _rss_mb()
+            stop = asyncio.Event()
+            probe = asyncio.create_task(_probe_writes(database.DB_PATH, stop))
+            started = time.perf_counter()
+            async with Bitrix24Client(mock.url, rate_limit=1000, burst=1000) as client:
+                await bitrix24_sync._write_directory(
+                    client.iter_users(), DepartmentTree(mock.departments), datetime.now().astimezone(),
+                    replace=True
+                )
+            total = time.perf_counter() - started
+            stop.set()
+            max_wait = await probe
+
+    return {
+        'users': users,
+        'total': total,
+        'first_row': timings['first_row'] - started,
+        'swap': timings['swap'],
+        'max_wait': max_wait,
+        'rss_peak': _rss_mb(),
+        'rss_sync': _rss_mb() - rss_before,
+    }
+
+
+def main(argv):
+    if len(argv) == 2 and argv[0] == '--one':
+        result = asyncio.run(run_once(int(argv[1])))
+        print(' '.join(f'{key}={value}' for key, value in result.items()))
+        return
+
+    print('users   total   first row   swap     max wait   RSS peak (+sync)')
+    for users in [int(arg) for arg in argv] or SIZES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'tests.bench_bitrix24_directory', '--one', str(users)],
+            check=True, capture_output=True, text=True
+        ).stdout.split()[-7:]
+        r = {key: float(value) for key, value in (item.split('=') for item in output)}
+        print(f"{int(r['users']):>6}  {r['total']:5.2f} s   {r['first_row']:5.2f} s   {r['swap']:5.2f} s  "
+              f"{r['max_wait']:6.3f} s   {r['rss_peak']:.0f} MB (+{r['rss_sync']:.0f} MB)")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,129 @@
+"""
+Замер маршрутизации нажатий кнопок со всеми обработчиками бота
+
+    python -m tests.bench_callback_router [число повторов]
+
+Обработчики регистрируются register_all_handlers в настоящем Dispatcher.
+Для сравнения второй Dispatcher получает те же callback_data в том же
+порядке в прежнем виде — по фильтру `lambda c: c.data == ...` или
+`c.data.startswith(...)` на обработчик, с разбором `data.split("_")` в
+обработчике. Тела обработчиков заменены пустыми функциями, чтобы мерить
+только выбор обработчика: время — feed_update одного callback-запроса,
+включая middleware aiogram.
+
+Результаты (Python 3.11, aiogram 3.31, 29 обработчиков, 2000 повторов):
+
+    callback_data               filters    router
+    admin_panel                 1573 µs    165 µs
+    search_by_department         902 µs    185 µs
+    approve_123                 1744 µs    219 µs
+    approve_news_7              1567 µs    257 µs
+    broadcast_cancel_15         2317 µs    257 µs
+    unknown                     3031 µs    351 µs
+    CallbackRouter.resolve:     0.2–3.2 µs на callback_data
+
+Фильтры проверяются по очереди, поэтому время растет с позицией кнопки
+в списке регистрации; у маршрутизатора оно от позиции не зависит.
+"""
+
+import asyncio
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from tests import support  # noqa: F401  (окружение до импорта модулей бота)
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Update, User
+
+from handlers import register_all_handlers
+from handlers.callback_router import CallbackRouter
+
+REPEATS = 2000
+SAMPLES = ('admin_panel', 'search_by_department', 'approve_123', 'approve_news_7', 'broadcast_cancel_15', 'unknown')
+
+
+async def _noop(callback_query: CallbackQuery, **kwargs: Any):
+    return None
+
+
+def _registered_routes() -> Tuple[Dispatcher, List[Tuple[str, str, Dict[str, Callable[[str], Any]]]]]:
+    """Dispatcher со всеми обработчиками бота и маршруты в порядке регистрации"""
+    routes = []
+    exact, prefix = CallbackRouter.exact, CallbackRouter.prefix
+
+    def record_exact(self, data, handler):
+        routes.append(('exact', data, {}))
+        exact(self, data, _noop)
+
+    def record_prefix(self, key, handler, **payload):
+        routes.append(('prefix', key, payload))
+        prefix(self, key, _noop, **payload)
+
+    CallbackRouter.exact, CallbackRouter.prefix = record_exact, record_prefix
+    try:
+        dp = Dispatcher()
+        register_all_handlers(dp)
+    finally:
+        CallbackRouter.exact, CallbackRouter.prefix = exact, prefix
+    return dp, routes
+
+
+def _legacy_dispatcher(routes) -> Dispatcher:
+    """Прежняя регистрация: один фильтр на обработчик"""
+    dp = Dispatcher()
+    for kind, key, payload in routes:
+        if kind == 'exact':
+            dp.callback_query.register(_noop, lambda c, key=key: c.data == key)
+            continue
+
+        async def handler(callback_query: CallbackQuery, payload=payload, **kwargs: Any):
+            parts = callback_query.data.split('_')
+            return [convert(part) for convert, part in zip(payload.values(), parts[-len(payload):])]
+
+        dp.callback_query.register(handler, lambda c, key=key: c.data.startswith(key))
+    return dp
+
+
+def _update(data: str) -> Update:
+    return Update(update_id=1, callback_query=CallbackQuery(
+        id='1', from_user=User(id=1, is_bot=False, first_name='Бенчмарк'), chat_instance='1', data=data
+    ))
+
+
+async def _per_update(dp: Dispatcher, bot: Bot, data: str, repeats: int) -> float:
+    update = _update(data)
+    for _ in range(min(repeats, 100)):
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / repeats
+
+
+async def run(repeats: int):
+    dp, routes = _registered_routes()
+    legacy = _legacy_dispatcher(routes)
+    router: CallbackRouter = dp['callback_router']
+    bot = Bot('123456:TEST-TOKEN')
+    try:
+        print(f'{len(routes)} обработчиков, {repeats} повторов')
+        print('callback_data               filters    router')
+        for data in SAMPLES:
+            before = await _per_update(legacy, bot, data, repeats)
+            after = await _per_update(dp, bot, data, repeats)
+            print(f'{data:<24} {before * 1e6:7.0f} µs {after * 1e6:6.0f} µs')
+
+        timings = []
+        for data in SAMPLES:
+            started = time.perf_counter()
+            for _ in range(repeats * 10):
+                router.resolve(data)
+            timings.append((time.perf_counter() - started) / (repeats * 10))
+        print(f'CallbackRouter.resolve:     {min(timings) * 1e6:.1f}–{max(timings) * 1e6:.1f} µs на callback_data')
+    finally:
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else REPEATS))
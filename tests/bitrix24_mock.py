@@ -0,0 +1,178 @@
+"""
+Локальный сервер, имитирующий REST API Bitrix24 (входящий вебхук)
+
+Поддерживаются user.get (страницы по 50 записей, фильтры ID, ACTIVE,
+>TIMESTAMP_X), department.get и batch. Сбои задаются через поля сервера:
+
+    limit_exceeded     — сколько следующих вызовов ответят QUERY_LIMIT_EXCEEDED (HTTP 503)
+    drop_batch_commands — сколько команд выбросить из ответа каждого batch,
+                          пока счетчик не обнулится (команды «теряются» порталом)
+    delay              — задержка каждого ответа, секунд
+
+Все вызовы записываются в calls: (метод, параметры).
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+PAGE_SIZE = 50
+
+
+def make_users(count: int, start_id: int = 1, department: int = 1) -> List[Dict[str, Any]]:
+    """Активные пользователи в формате user.get"""
+    return [{
+        'ID': str(user_id),
+        'ACTIVE': True,
+        'NAME': f'Имя{user_id}',
+        'LAST_NAME': f'Фамилия{user_id}',
+        'SECOND_NAME': '',
+        'WORK_POSITION': 'Инженер',
+        'EMAIL': f'user{user_id}@example.com',
+        'PERSONAL_MOBILE': f'+7900{user_id:07d}',
+        'UF_DEPARTMENT': [department],
+        'TIMESTAMP_X': '2026-01-01T10:00:00+03:00',
+        'DATE_REGISTER': '2025-01-01T10:00:00+03:00',
+    } for user_id in range(start_id, start_id + count)]
+
+
+def parse_php_query(query: str) -> Dict[str, Any]:
+    """Разбирает строку вида FILTER[ID][0]=1&start=50 во вложенный словарь"""
+    result: Dict[str, Any] = {}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        parts = key.replace(']', '').split('[')
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+
+def _values(value: Any) -> List[str]:
+    if isinstance(value, dict):
+        return [str(item) for item in value.values()]
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+class MockBitrix24:
+    """Состояние поддельного портала"""
+
+    def __init__(self, users: List[Dict[str, Any]] = None, departments: List[Dict[str, Any]] = None):
+        self.users = users if users is not None else make_users(120)
+        self.departments = departments if departments is not None else [
+            {'ID': '1', 'NAME': 'Компания'},
+            {'ID': '2', 'NAME': 'Разработка', 'PARENT': '1'},
+        ]
+        self.limit_exceeded = 0
+        self.drop_batch_commands = 0
+        self.delay = 0.0
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.url = ''
+
+    def calls_of(self, method: str) -> List[Dict[str, Any]]:
+        return [params for name, params in self.calls if name == method]
+
+    def _list(self, items: List[Dict[str, Any]], params: Dict[str, Any]) -> Dict[str, Any]:
+        start = int(params.get('start') or 0)
+        page = items[start:start + PAGE_SIZE]
+        response = {'result': page, 'total': len(items)}
+        if start + PAGE_SIZE < len(items):
+            response['next'] = start + PAGE_SIZE
+        return response
+
+    def _filter_users(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        users = self.users
+        filters = dict(params.get('FILTER') or {})
+        if 'ACTIVE' in params:
+            filters.setdefault('ACTIVE', params['ACTIVE'])
+        for key, value in filters.items():
+            if key == 'ID':
+                ids = set(_values(value))
+                users = [user for user in users if str(user['ID']) in ids]
+            elif key == 'ACTIVE':
+                active = value in (True, 'Y', 'true', '1', 1)
+                users = [user for user in users if bool(user.get('ACTIVE')) == active]
+            elif key.startswith('>'):
+                field = key[1:]
+                users = [user for user in users if str(user.get(field, '')) > str(value)]
+        return users
+
+    def execute(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Ответ на вызов метода (без batch)"""
+        if method == 'user.get':
+            return self._list(self._filter_users(params), params)
+        if method == 'department.get':
+            return self._list(self.departments, params)
+        return {'error': 'ERROR_METHOD_NOT_FOUND', 'error_description': f'Method not found: {method}'}
+
+    def batch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        results, errors, totals = {}, {}, {}
+        commands = dict(params.get('cmd') or {})
+        for key, command in commands.items():
+            if self.drop_batch_commands > 0:
+                self.drop_batch_commands -= 1
+                continue
+            method, _, query = command.partition('?')
+            response = self.execute(method, parse_php_query(query))
+            if 'error' in response:
+                errors[key] = {'error': response['error'], 'error_description': response['error_description']}
+            else:
+                results[key] = response['result']
+                totals[key] = response.get('total')
+        return {'result': {
+            'result': results or [],  # PHP отдает пустой массив списком
+            'result_error': errors or [],
+            'result_total': totals or [],
+        }}
+
+
+MOCK_KEY = web.AppKey('mock', MockBitrix24)
+
+
+async def _handle(request: web.Request) -> web.Response:
+    mock = request.app[MOCK_KEY]
+    method = request.match_info['method']
+    if request.can_read_body and request.content_type == 'application/json':
+        params = await request.json()
+    else:
+        params = parse_php_query(await request.text() if request.can_read_body else request.query_string)
+    mock.calls.append((method, params))
+
+    if mock.delay:
+        await asyncio.sleep(mock.delay)
+    if mock.limit_exceeded > 0:
+        mock.limit_exceeded -= 1
+        return web.json_response({'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many requests'},
+                                 status=503)
+    if method == 'batch':
+        return web.json_response(mock.batch(params))
+    response = mock.execute(method, params)
+    return web.json_response(response, status=400 if 'error' in response else 200)
+
+
+def create_app(mock: MockBitrix24) -> web.Application:
+    app = web.Application()
+    app[MOCK_KEY] = mock
+    app.router.add_route('*', '/rest/1/token/{method}', _handle)
+    return app
+
+
+@asynccontextmanager
+async def run_mock_bitrix24(mock: Optional[MockBitrix24] = None) -> AsyncIterator[MockBitrix24]:
+    """Запускает поддельный портал на свободном порту; mock.url — адрес вебхука"""
+    mock = mock or MockBitrix24()
+    runner = web.AppRunner(create_app(mock))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    mock.url = f'http://127.0.0.1:{port}/rest/1/token/'
+    try:
+        yield mock
+    finally:
+        await runner.cleanup()
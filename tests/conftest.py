@@ -0,0 +1,16 @@
+import asyncio
+
+import pytest
+
+from tests import support  # noqa: F401  (окружение до импорта модулей бота)
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Пустая база бота во временном каталоге"""
+    import database
+
+    path = str(tmp_path / 'bot.db')
+    monkeypatch.setattr(database, 'DB_PATH', path)
+    asyncio.run(database.init_db())
+    return path
@@ -0,0 +1,32 @@
+"""
+Общая подготовка окружения для тестов и бенчмарков
+
+config.py читает обязательные переменные окружения при импорте, поэтому
+значения по умолчанию задаются до импорта модулей бота.
+"""
+
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+for name, value in {
+    'BOT_TOKEN': '123456:TEST-TOKEN',
+    'ADMIN_ID': '1',
+    'CHAT_ID': '-1001',
+    'TELEGRAM_API_ID': '1',
+    'TARGET_CHANNEL': '-1002',
+}.items():
+    os.environ.setdefault(name, value)
+
+# Обработчики импортируют клавиатуры через `from keyboards import *`, но модуля
+# keyboards в репозитории нет; функции клавиатур нужны только при вызове
+# обработчиков, поэтому для их регистрации достаточно пустого модуля
+if 'keyboards' not in sys.modules:
+    try:
+        import keyboards  # noqa: F401
+    except ImportError:
+        sys.modules['keyboards'] = types.ModuleType('keyboards')
@@ -0,0 +1,30 @@
+"""Запуск поддельного Bot API (fake_telegram_server.py) на свободном порту для тестов"""
+
+import socket
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from aiohttp import web
+
+from fake_telegram_server import FakeTelegram, create_app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def run_fake_telegram() -> AsyncIterator[FakeTelegram]:
+    """Поддельный Bot API; адрес для TELEGRAM_API_SERVER — в fake.api_server"""
+    fake = FakeTelegram()
+    runner = web.AppRunner(create_app(fake))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    fake.api_server = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        yield fake
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,172 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bitrix24_sync
+from bitrix24_sync import Bitrix24Client, Bitrix24Error
+from tests.bitrix24_mock import MockBitrix24, make_users, run_mock_bitrix24
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Повторы без реальных задержек"""
+    monkeypatch.setattr(bitrix24_sync, 'backoff_delay', lambda attempt: 0)
+
+
+def client_for(mock: MockBitrix24, **kwargs) -> Bitrix24Client:
+    return Bitrix24Client(mock.url, rate_limit=1000, burst=1000, **kwargs)
+
+
+def test_iter_users_reads_all_pages_in_order():
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(5 * 50 + 7))) as mock:
+            async with client_for(mock) as client:
+                pages = [page async for page in client.iter_users()]
+            return mock, pages
+
+    mock, pages = asyncio.run(scenario())
+    ids = [int(user['ID']) for page in pages for user in page]
+    assert ids == list(range(1, 5 * 50 + 8))
+    # Первая страница обычным вызовом, остальные пять — одним batch
+    assert len(mock.calls_of('user.get')) == 1
+    assert len(mock.calls_of('batch')) == 1
+    assert len(mock.calls_of('batch')[0]['cmd']) == 5
+
+
+def test_iter_pages_splits_batches_by_batch_size():
+    async def scenario():
+        users = make_users((bitrix24_sync.BATCH_SIZE + 3) * 50)
+        async with run_mock_bitrix24(MockBitrix24(users)) as mock:
+            async with client_for(mock) as client:
+                count = sum([len(page) async for page in client.iter_users()])
+            return mock, count
+
+    mock, count = asyncio.run(scenario())
+    assert count == (bitrix24_sync.BATCH_SIZE + 3) * 50
+    sizes = sorted(len(params['cmd']) for params in mock.calls_of('batch'))
+    assert sizes == [2, bitrix24_sync.BATCH_SIZE]
+
+
+def test_batch_resends_only_missing_commands():
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(4 * 50))) as mock:
+            mock.drop_batch_commands = 2
+            async with client_for(mock) as client:
+                users = await client.get_users()
+            return mock, users
+
+    mock, users = asyncio.run(scenario())
+    assert len(users) == 200
+    assert len({user['ID'] for user in users}) == 200
+    batches = mock.calls_of('batch')
+    assert len(batches) == 2
+    assert len(batches[0]['cmd']) == 3
+    # Повторно отправлены только две потерянные команды
+    assert len(batches[1]['cmd']) == 2
+    assert set(batches[1]['cmd']) < set(batches[0]['cmd'])
+
+
+def test_batch_gives_up_when_commands_never_answered(monkeypatch):
+    monkeypatch.setattr(bitrix24_sync, 'MAX_RETRIES', 2)
+
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(100))) as mock:
+            mock.drop_batch_commands = 10 ** 6
+            async with client_for(mock) as client:
+                await client.get_users()
+
+    with pytest.raises(Bitrix24Error) as error:
+        asyncio.run(scenario())
+    assert error.value.code == 'BATCH_INCOMPLETE'
+
+
+def test_query_limit_exceeded_is_retried_and_slows_down():
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(30))) as mock:
+            mock.limit_exceeded = 3
+            async with client_for(mock) as client:
+                total = await client.get_users_total()
+                rate = client.limiter.rate
+            return mock, total, rate
+
+    mock, total, rate = asyncio.run(scenario())
+    assert total == 30
+    assert len(mock.calls_of('user.get')) == 4
+    assert rate < 1000
+
+
+def test_query_limit_exceeded_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(bitrix24_sync, 'MAX_RETRIES', 2)
+
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(30))) as mock:
+            mock.limit_exceeded = 10
+            async with client_for(mock) as client:
+                with pytest.raises(Bitrix24Error) as error:
+                    await client.get_users_total()
+            return error.value, len(mock.calls_of('user.get'))
+
+    error, calls = asyncio.run(scenario())
+    assert error.code == 'QUERY_LIMIT_EXCEEDED'
+    assert calls == 3
+
+
+def test_non_retryable_error_is_raised_immediately():
+    async def scenario():
+        async with run_mock_bitrix24() as mock:
+            async with client_for(mock) as client:
+                with pytest.raises(Bitrix24Error) as error:
+                    await client._call('unknown.method')
+            return error.value, len(mock.calls)
+
+    error, calls = asyncio.run(scenario())
+    assert error.code == 'ERROR_METHOD_NOT_FOUND'
+    assert calls == 1
+
+
+def test_get_users_by_ids_uses_id_filter():
+    async def scenario():
+        async with run_mock_bitrix24() as mock:
+            async with client_for(mock) as client:
+                return await client.get_users_by_ids([3, 7, 999])
+
+    users = asyncio.run(scenario())
+    assert sorted(user['ID'] for user in users) == ['3', '7']
+
+
+class StubMessage:
+    def __init__(self):
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+class StubCallback:
+    def __init__(self, user_id: int):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = StubMessage()
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+def test_admin_sync_report_shows_bitrix24_status(db_path, tmp_path, monkeypatch):
+    from config import ADMIN_ID
+    from handlers import admin_handlers
+    from services import sync_service
+
+    monkeypatch.setattr(sync_service, 'EXCEL_FILE', str(tmp_path / 'contacts.xlsx'))
+    callback = StubCallback(ADMIN_ID)
+
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(75))) as mock:
+            monkeypatch.setattr(sync_service, 'BITRIX24_WEBHOOK', mock.url)
+            await admin_handlers.sync_data_callback(callback)
+            return mock.calls
+
+    calls = asyncio.run(scenario())
+    # Один запрос total без загрузки всех сотрудников
+    assert [method for method, params in calls] == ['user.get']
+    assert 'Сотрудников в Bitrix24: 75' in callback.message.answers[-1]
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from datetime import datetime
+
+import aiosqlite
+import pytest
+
+import bitrix24_sync
+import database
+from bitrix24_sync import Bitrix24Client, Bitrix24Error, DepartmentTree
+from tests.bitrix24_mock import MockBitrix24, make_users, run_mock_bitrix24
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bitrix24_sync, 'backoff_delay', lambda attempt: 0)
+
+
+async def sync_directory(mock: MockBitrix24, replace: bool = True, **kwargs):
+    async with Bitrix24Client(mock.url, rate_limit=1000, burst=1000, max_concurrency=1, **kwargs) as client:
+        departments = DepartmentTree(mock.departments)
+        return await bitrix24_sync._write_directory(
+            client.iter_users(), departments, datetime.now().astimezone(), replace=replace
+        )
+
+
+def test_full_sync_replaces_directory(db_path):
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(130))) as mock:
+            first = await sync_directory(mock)
+            mock.users = make_users(100, start_id=31)
+            second = await sync_directory(mock)
+        return first, second, await database.get_bitrix24_users()
+
+    first, second, rows = asyncio.run(scenario())
+    assert first['initial_count'] == 0 and first['final_count'] == 130
+    assert len(first['diff']['added']) == 130
+    assert second['initial_count'] == 130 and second['final_count'] == 100
+    assert len(second['diff']['removed']) == 30
+    assert second['diff']['unchanged_count'] == 100
+    assert sorted(int(row['bitrix_id']) for row in rows) == list(range(31, 131))
+
+
+def test_failed_sync_leaves_directory_unchanged(db_path, monkeypatch):
+    monkeypatch.setattr(bitrix24_sync, 'MAX_RETRIES', 1)
+
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(80))) as mock:
+            await sync_directory(mock)
+            mock.users = make_users(200, start_id=500)
+            # Первая страница загружается, batch с остальными — нет
+            mock.drop_batch_commands = 10 ** 6
+            with pytest.raises(Bitrix24Error):
+                await sync_directory(mock)
+        return await database.get_bitrix24_users()
+
+    rows = asyncio.run(scenario())
+    assert sorted(int(row['bitrix_id']) for row in rows) == list(range(1, 81))
+
+
+def test_sync_does_not_block_other_writers(db_path):
+    """Пока страницы загружаются из API, другие соединения пишут в bot.db без ожидания"""
+    async def writer_latency(stop: asyncio.Event) -> float:
+        worst = 0.0
+        async with aiosqlite.connect(db_path, timeout=30) as conn:
+            while not stop.is_set():
+                started = time.perf_counter()
+                await conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('probe', '1')")
+                await conn.commit()
+                worst = max(worst, time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+        return worst
+
+    async def scenario():
+        await database.init_sync_state_table()
+        async with run_mock_bitrix24(MockBitrix24(make_users(4 * 50))) as mock:
+            mock.delay = 0.2
+            stop = asyncio.Event()
+            probe = asyncio.create_task(writer_latency(stop))
+            await sync_directory(mock)
+            stop.set()
+            return await probe
+
+    assert asyncio.run(scenario()) < 0.2
+
+
+def test_incremental_sync_removes_users_deleted_on_portal(db_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(bitrix24_sync, 'Bitrix24Client', lambda url: Bitrix24Client(url, rate_limit=1000, burst=1000))
+    excel_file = str(tmp_path / 'contacts.xlsx')
+
+    async def incremental(mock):
+        mock.calls.clear()
+        result = await bitrix24_sync.sync_bitrix24_to_sqlite(mock.url, excel_file, incremental=True)
+        assert result['success'], result
+        return [(method, params.get('FILTER')) for method, params in mock.calls if method == 'user.get']
+
+    async def scenario():
+        async with run_mock_bitrix24(MockBitrix24(make_users(60))) as mock:
+            assert (await bitrix24_sync.sync_bitrix24_to_sqlite(mock.url, excel_file))['success']
+
+            # Изменение одного пользователя: фильтры и один запрос total, без загрузки всех
+            mock.users[4]['WORK_POSITION'] = 'Руководитель'
+            mock.users[4]['TIMESTAMP_X'] = '2099-01-01T10:00:00+03:00'
+            changed_calls = await incremental(mock)
+
+            # Удаление на портале фильтры не показывают: его находит сверка с total
+            del mock.users[9]
+            deleted_calls = await incremental(mock)
+        return changed_calls, deleted_calls, {row['bitrix_id']: row for row in await database.get_bitrix24_users()}
+
+    changed_calls, deleted_calls, users = asyncio.run(scenario())
+    assert len(changed_calls) == 3 and changed_calls[-1][1] is None
+    assert len(deleted_calls) == 4
+    assert users['5']['position'] == 'Руководитель'
+    assert '10' not in users and len(users) == 59
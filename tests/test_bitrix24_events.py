@@ -0,0 +1,128 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+
+import bitrix24_events
+import config
+import database
+from bitrix24_events import Bitrix24EventReceiver, create_app
+from tests.bitrix24_mock import MockBitrix24, make_users, run_mock_bitrix24
+
+TOKEN = 'app-token'
+PATH = '/bitrix24/events'
+
+
+@pytest.fixture(autouse=True)
+def fast_events(monkeypatch):
+    monkeypatch.setattr(bitrix24_events, 'EVENT_DEBOUNCE_SECONDS', 0.05)
+    monkeypatch.setattr(bitrix24_events, 'DEPARTMENT_RECONCILE_DELAY', 0.2)
+    monkeypatch.setattr(config, 'BITRIX24_SYNC_TARGET', 'sqlite')
+
+
+def event(name: str, user_id=None, token: str = TOKEN) -> dict:
+    form = {'event': name, 'auth[application_token]': token}
+    if user_id is not None:
+        form['data[FIELDS][ID]'] = str(user_id)
+    return form
+
+
+async def wait_for(condition, timeout: float = 10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await condition():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось"
+        await asyncio.sleep(0.05)
+
+
+async def directory() -> dict:
+    return {row['bitrix_id']: row for row in await database.get_bitrix24_users()}
+
+
+async def directory_size() -> int:
+    return len(await directory())
+
+
+async def _equals(value, expected) -> bool:
+    return await value == expected
+
+
+def test_receiver_requires_application_token():
+    with pytest.raises(ValueError):
+        Bitrix24EventReceiver('http://bitrix24.invalid/rest/1/token/', '')
+    with pytest.raises(ValueError):
+        create_app(Bitrix24EventReceiver('http://bitrix24.invalid/rest/1/token/', None))
+
+
+def test_event_with_wrong_token_is_rejected():
+    async def scenario():
+        async with run_mock_bitrix24() as mock:
+            receiver = Bitrix24EventReceiver(mock.url, TOKEN, reconcile_interval=0)
+            async with TestServer(create_app(receiver, PATH)) as server, aiohttp.ClientSession() as session:
+                for token in ('wrong', ''):
+                    async with session.post(server.make_url(PATH), data=event('ONUSERUPDATE', 5, token)) as response:
+                        assert response.status == 403
+            return receiver.pending_users, mock.calls
+
+    pending, calls = asyncio.run(scenario())
+    assert pending == set()
+    assert calls == []
+
+
+def test_user_events_are_replayed_into_directory(db_path, tmp_path):
+    async def scenario():
+        await database.init_bitrix24_tables()
+        async with run_mock_bitrix24(MockBitrix24(make_users(60))) as mock:
+            receiver = Bitrix24EventReceiver(mock.url, TOKEN, reconcile_interval=0,
+                                             excel_file=str(tmp_path / 'contacts.xlsx'))
+            async with TestServer(create_app(receiver, PATH)) as server, aiohttp.ClientSession() as session:
+                async def post(form):
+                    async with session.post(server.make_url(PATH), data=form) as response:
+                        assert response.status == 200
+
+                # Справочник пуст: событие приводит к полной синхронизации
+                await post(event('ONUSERADD', 1))
+                await wait_for(lambda: _equals(directory_size(), 60))
+
+                mock.calls.clear()
+                mock.users[4]['WORK_POSITION'] = 'Руководитель'
+                mock.users[6]['ACTIVE'] = False
+                for user_id in (5, 7, 5, 7):
+                    await post(event('ONUSERUPDATE', user_id))
+
+                async def applied():
+                    users = await directory()
+                    return users['5']['position'] == 'Руководитель' and '7' not in users
+                await wait_for(applied)
+            return mock.calls_of('user.get'), await directory()
+
+    calls, users = asyncio.run(scenario())
+    assert len(users) == 59
+    # Повторные события одних пользователей применены одним запросом по ID
+    assert len(calls) == 1
+    assert sorted(str(user_id) for user_id in calls[0]['FILTER']['ID']) == ['5', '7']
+
+
+def test_department_events_schedule_one_reconcile_and_release_task():
+    async def scenario():
+        async with run_mock_bitrix24() as mock:
+            receiver = Bitrix24EventReceiver(mock.url, TOKEN, reconcile_interval=0)
+            reconciled = []
+
+            async def reconcile(refresh_departments=False):
+                receiver.reconcile_requested = False
+                reconciled.append(refresh_departments)
+
+            receiver.reconcile = reconcile
+            async with TestServer(create_app(receiver, PATH)) as server, aiohttp.ClientSession() as session:
+                for name in ('ONDEPARTMENTADD', 'ONDEPARTMENTUPDATE'):
+                    async with session.post(server.make_url(PATH), data=event(name)) as response:
+                        assert response.status == 200
+                await wait_for(lambda: _equals(asyncio.sleep(0, len(reconciled)), 1))
+                await asyncio.sleep(0)
+                # Остался только обработчик событий пользователей
+                return reconciled, len(receiver._tasks)
+
+    reconciled, tasks = asyncio.run(scenario())
+    assert reconciled == [True]
+    assert tasks == 1
@@ -0,0 +1,77 @@
+import asyncio
+import gc
+import warnings
+from datetime import datetime
+
+import aiohttp
+from aiogram import types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import handlers.common_handlers
+from handlers.moderator_handlers import process_moderator_news
+from services import bot_registry
+from services.bot_registry import create_bot, set_bot
+from tests.telegram_fake import run_fake_telegram
+
+INVOCATIONS = 100
+
+
+def count_instances(monkeypatch, cls) -> list:
+    created = []
+    init = cls.__init__
+
+    def counting_init(self, *args, **kwargs):
+        created.append(self)
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(cls, '__init__', counting_init)
+    return created
+
+
+def news_message(bot, number: int) -> types.Message:
+    user = types.User(id=42, is_bot=False, first_name='Модератор')
+    return types.Message(
+        message_id=number, date=datetime.now(), chat=types.Chat(id=42, type='private'),
+        from_user=user, text=f'Новость {number}'
+    ).as_(bot)
+
+
+def test_handlers_share_one_session_without_leaks(db_path, monkeypatch):
+    monkeypatch.setattr(bot_registry, '_bot', None)
+
+    async def no_menu(message, user_id=None):
+        pass
+
+    monkeypatch.setattr(handlers.common_handlers, 'send_main_menu', no_menu)
+    bot_sessions = count_instances(monkeypatch, AiohttpSession)
+    client_sessions = count_instances(monkeypatch, aiohttp.ClientSession)
+    loop_errors = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: loop_errors.append(context))
+        async with run_fake_telegram() as fake:
+            bot = set_bot(create_bot('123456:TEST-TOKEN', api_server=fake.api_server))
+            storage = MemoryStorage()
+            state = FSMContext(storage=storage, key=StorageKey(bot_id=bot.id, chat_id=42, user_id=42))
+            for start in range(0, INVOCATIONS, 20):
+                await asyncio.gather(*(
+                    process_moderator_news(news_message(bot, number), state)
+                    for number in range(start, start + 20)
+                ))
+            await bot.session.close()
+            return fake.sent
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        sent = asyncio.run(scenario())
+        gc.collect()
+
+    # Новость в канал и ответ модератору на каждый вызов
+    assert len(sent) == 2 * INVOCATIONS
+    assert len(bot_sessions) == 1
+    assert len(client_sessions) == 1
+    assert not [context for context in loop_errors if 'Unclosed' in context.get('message', '')]
+    assert not [warning for warning in caught if 'Unclosed' in str(warning.message)]
@@ -0,0 +1,225 @@
+import asyncio
+import sqlite3
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+import database
+from services import leases, outbound
+from services.broadcast_jobs import BroadcastProgress, create_broadcast, run_broadcast_job
+from services.notification_service import NotificationService
+from services.leases import LeaseBackend, LeaseManager, SQLiteLeaseBackend, set_lease_manager
+
+
+@pytest.fixture(autouse=True)
+def reset_lease_manager(monkeypatch):
+    monkeypatch.setattr(leases, '_lease_manager', None)
+
+
+class StubBot:
+    """Бот, который «отправляет» сообщения в список; ошибки задаются по chat_id"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        error = self.errors.get(chat_id)
+        if error:
+            raise error
+        self.sent.append(chat_id)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(outbound._lane.get())
+
+
+def forbidden(message: str) -> TelegramForbiddenError:
+    return TelegramForbiddenError(SendMessage(chat_id=0, text=''), message)
+
+
+def add_users(db_path: str, user_ids):
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany('INSERT INTO authorized_users (user_id, username, fio, position) VALUES (?, ?, ?, ?)',
+                         [(user_id, f'user{user_id}', f'Пользователь {user_id}', '') for user_id in user_ids])
+
+
+def unreachable(db_path: str) -> dict:
+    with sqlite3.connect(db_path) as conn:
+        return dict(conn.execute(
+            'SELECT user_id, unreachable_reason FROM authorized_users WHERE unreachable_at IS NOT NULL'
+        ))
+
+
+def test_run_broadcast_job_marks_unreachable_recipients(db_path):
+    add_users(db_path, [1, 2, 3, 4])
+    bot = StubBot({
+        2: forbidden('Forbidden: bot was blocked by the user'),
+        3: TelegramBadRequest(SendMessage(chat_id=0, text=''), 'Bad Request: message text is empty'),
+    })
+
+    async def scenario():
+        job_id = await create_broadcast([1, 2, 3, 4], 'Привет')
+        return await run_broadcast_job(bot, job_id)
+
+    result = asyncio.run(scenario())
+    assert sorted(bot.sent) == [1, 4]
+    assert sorted(result['failed']) == [2, 3]
+    # Временная ошибка (3) не делает получателя недоступным
+    assert result['unreachable'] == {2: 'blocked'}
+    assert unreachable(db_path) == {2: 'blocked'}
+
+
+def test_queued_job_marks_unreachable_without_notification_service(db_path):
+    add_users(db_path, [5, 6])
+    bot = StubBot({6: forbidden('Forbidden: user is deactivated')})
+
+    async def scenario():
+        job_id = await create_broadcast([5, 6], 'Из веб-интерфейса', queued=True)
+        await run_broadcast_job(bot, job_id)
+        return await database.get_broadcast_job(job_id)
+
+    job = asyncio.run(scenario())
+    assert job['status'] == 'done'
+    assert unreachable(db_path) == {6: 'deactivated'}
+
+
+def test_progress_edits_use_bulk_lane():
+    bot = StubBot()
+
+    async def scenario():
+        progress = BroadcastProgress(bot, chat_id=1, job_id=7)
+        progress.message_id, progress.total = 10, 3
+        progress.record(None)
+        await progress._edit(progress.render())
+        await progress.finish('done')
+
+    asyncio.run(scenario())
+    assert bot.edits == [outbound.BULK, outbound.BULK]
+
+
+def delivery_statuses(db_path: str, job_id: int) -> dict:
+    with sqlite3.connect(db_path) as conn:
+        return dict(conn.execute('SELECT user_id, status FROM broadcast_deliveries WHERE job_id = ?', (job_id,)))
+
+
+def test_queued_job_is_claimed_once(db_path):
+    async def scenario():
+        job_id = await create_broadcast([1, 2], 'Текст', queued=True)
+        claims = await asyncio.gather(*(database.claim_broadcast_job(job_id) for _ in range(5)))
+        return claims, await database.get_broadcast_job(job_id)
+
+    claims, job = asyncio.run(scenario())
+    assert sorted(claims) == [False] * 4 + [True]
+    assert job['status'] == 'running'
+
+
+def test_job_leased_by_another_instance_is_left_alone(db_path):
+    bot = StubBot()
+    first = LeaseManager(SQLiteLeaseBackend(), 'first', ttl=30)
+    set_lease_manager(LeaseManager(SQLiteLeaseBackend(), 'second', ttl=30))
+
+    async def scenario():
+        job_id = await create_broadcast([1, 2, 3], 'Текст')
+        # Первый экземпляр выполняет задание и уже начал отправку получателю 1
+        async with database.broadcast_delivery_log(job_id) as deliveries:
+            assert await deliveries.start(1)
+        async with first.hold(f'broadcast:{job_id}') as lease:
+            assert lease is not None
+            busy = await run_broadcast_job(bot, job_id)
+            during = delivery_statuses(db_path, job_id)
+        # Аренда освобождена (или истекла): задание продолжает второй экземпляр
+        result = await run_broadcast_job(bot, job_id)
+        return job_id, busy, during, result
+
+    job_id, busy, during, result = asyncio.run(scenario())
+    assert busy is None
+    assert during == {1: 'sending', 2: 'pending', 3: 'pending'}
+    assert sorted(result['sent']) == [2, 3]
+    assert delivery_statuses(db_path, job_id) == {1: 'unknown', 2: 'sent', 3: 'sent'}
+    assert sorted(bot.sent) == [2, 3]
+
+
+class LosingBackend(LeaseBackend):
+    """Аренда, которую не удается продлить: ее забрал другой экземпляр"""
+
+    async def acquire(self, name, holder, ttl):
+        return 1
+
+    async def renew(self, name, holder, token, ttl):
+        return False
+
+    async def release(self, name, holder, token):
+        pass
+
+
+class SlowBot(StubBot):
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.05)
+        await super().send_message(chat_id, text, **kwargs)
+
+
+def test_lost_lease_stops_job_without_finishing_it(db_path):
+    set_lease_manager(LeaseManager(LosingBackend(), 'first', ttl=0.3))
+    bot = SlowBot()
+
+    async def scenario():
+        job_id = await create_broadcast(range(1, 201), 'Текст')
+        result = await run_broadcast_job(bot, job_id)
+        return result, await database.get_broadcast_job(job_id)
+
+    result, job = asyncio.run(scenario())
+    assert 0 < len(bot.sent) < 200
+    assert result['cancelled'] is False
+    # Задание остается незавершенным: его продолжит новый владелец аренды
+    assert job['status'] == 'running'
+    assert job['sent'] == len(bot.sent)
+    assert job['pending'] == 200 - len(bot.sent)
+
+
+def test_web_helpers_match_async_api(db_path):
+    job_id = database.create_broadcast_job_sync('{"text": "x", "parse_mode": null}', [1, 2, 2], audience='web')
+    job = database.get_broadcast_job_sync(job_id)
+    assert job == asyncio.run(database.get_broadcast_job(job_id))
+    assert (job['status'], job['audience'], job['total'], job['pending']) == ('queued', 'web', 2, 2)
+
+
+def test_delivery_statuses_share_one_connection(db_path, monkeypatch):
+    connect = database.aiosqlite.connect
+    connections = []
+
+    def counting_connect(*args, **kwargs):
+        connections.append(args)
+        return connect(*args, **kwargs)
+
+    async def scenario():
+        job_id = await create_broadcast(range(1, 251), 'Текст')
+        monkeypatch.setattr(database.aiosqlite, 'connect', counting_connect)
+        result = await run_broadcast_job(StubBot(), job_id)
+        monkeypatch.setattr(database.aiosqlite, 'connect', connect)
+        return job_id, result
+
+    job_id, result = asyncio.run(scenario())
+    assert len(result['sent']) == 250
+    assert set(delivery_statuses(db_path, job_id).values()) == {'sent'}
+    # Не по два соединения на получателя, а несколько на весь запуск
+    assert len(connections) < 10
+
+
+class BusyBackend(LosingBackend):
+    """Аренда, которую держит другой экземпляр"""
+
+    async def acquire(self, name, holder, ttl):
+        return None
+
+
+def test_notification_reports_job_running_elsewhere(db_path):
+    add_users(db_path, [1, 2])
+    set_lease_manager(LeaseManager(BusyBackend(), 'first', ttl=30))
+    bot = StubBot()
+
+    result = asyncio.run(NotificationService(bot).send_to_all_users('Текст', admin_id=None))
+    assert result['success'] is False
+    assert result['job_id'] and result['error']
+    assert bot.sent == []
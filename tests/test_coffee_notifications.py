@@ -0,0 +1,28 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import database
+
+
+def test_notifications_join_users_by_normalized_fio(db_path):
+    today = datetime.now().strftime('%Y-%m-%d')
+    with sqlite3.connect(db_path) as conn:
+        # Пользователь, записанный в обход database.approve_user: fio_key заполнит init_db
+        conn.execute("INSERT INTO authorized_users (user_id, fio) VALUES (1, 'Петров  Пётр Петрович')")
+
+    async def scenario():
+        await database.init_db()
+        await database.add_coffee_schedule_entry('ПЕТРОВ Петр Петрович', today, created_by=9)
+        await database.add_coffee_schedule_entry('Сидоров Сидор', today, created_by=9)
+        return await database.get_coffee_notifications()
+
+    rows = asyncio.run(scenario())
+    assert [(fio, user_id) for _, fio, _, user_id in rows] == [('ПЕТРОВ Петр Петрович', 1)]
+
+    with sqlite3.connect(db_path) as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT c.id FROM coffee_schedule c '
+            'LEFT JOIN authorized_users u ON u.fio_key = c.fio_key WHERE c.date = ?', (today,)
+        ))
+    assert 'idx_authorized_users_fio_key' in plan
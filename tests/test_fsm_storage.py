@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import aiosqlite
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from services.fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=100)
+
+
+def test_state_survives_restart(db_path):
+    async def scenario():
+        storage = SQLiteStorage(db_path, flush_interval=60)
+        await storage.set_state(KEY, 'AuthStates:waiting_for_email')
+        await storage.update_data(KEY, {'email': 'user@example.com'})
+        # Изменения еще не записаны: их записывает close
+        await storage.close()
+
+        restarted = SQLiteStorage(db_path)
+        try:
+            return await restarted.get_state(KEY), await restarted.get_data(KEY)
+        finally:
+            await restarted.close()
+
+    state, data = asyncio.run(scenario())
+    assert state == 'AuthStates:waiting_for_email'
+    assert data == {'email': 'user@example.com'}
+
+
+def test_expired_state_reads_empty_and_is_swept(db_path):
+    async def scenario():
+        storage = SQLiteStorage(db_path, ttl=0.2)
+        await storage.set_state(KEY, 'SearchStates:waiting_for_query')
+        await storage.set_data(KEY, {'query': 'Иванов'})
+        await storage.flush()
+        fresh = await storage.get_state(KEY)
+        await asyncio.sleep(0.3)
+        expired = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.sweep()
+        await storage.close()
+        async with aiosqlite.connect(db_path) as conn:
+            async with conn.execute('SELECT COUNT(*) FROM fsm_states') as cursor:
+                rows = (await cursor.fetchone())[0]
+        return fresh, expired, rows
+
+    fresh, expired, rows = asyncio.run(scenario())
+    assert fresh == 'SearchStates:waiting_for_query'
+    assert expired == (None, {})
+    assert rows == 0
+
+
+def test_instances_see_each_others_changes(db_path):
+    async def scenario():
+        first, second = SQLiteStorage(db_path), SQLiteStorage(db_path)
+        try:
+            await first.set_state(KEY, 'A')
+            await first.flush()
+            seen_by_second = await second.get_state(KEY)
+            await second.set_state(KEY, 'B')
+            await second.flush()
+            seen_by_first = await first.get_state(KEY)
+
+            # Более старое незаписанное изменение не затирает более новое
+            await first.set_state(KEY, 'stale')
+            time.sleep(0.01)
+            await second.set_state(KEY, 'C')
+            await second.flush()
+            await first.flush()
+            return seen_by_second, seen_by_first, await second.get_state(KEY)
+        finally:
+            await first.close()
+            await second.close()
+
+    assert asyncio.run(scenario()) == ('A', 'B', 'C')
+
+
+def test_set_data_rejects_non_json_data(db_path):
+    async def scenario():
+        storage = SQLiteStorage(db_path)
+        try:
+            await storage.set_data(KEY, {'count': 1})
+            with pytest.raises(TypeError):
+                await storage.set_data(KEY, {'count': 2, 'callback': object()})
+            await storage.flush()
+            return await storage.get_data(KEY)
+        finally:
+            await storage.close()
+
+    assert asyncio.run(scenario()) == {'count': 1}
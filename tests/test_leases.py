@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime
+
+import database
+from services.leases import LeaseManager, SQLiteLeaseBackend
+from services.scheduler import JobScheduler
+
+TTL = 0.3
+
+
+class StalledBackend(SQLiteLeaseBackend):
+    """Аренда в SQLite, продление которой можно «заморозить» (экземпляр завис или потерял связь с базой)"""
+
+    def __init__(self):
+        self.renewing = True
+
+    async def renew(self, name, holder, token, ttl):
+        if not self.renewing:
+            raise ConnectionError("база недоступна")
+        return await super().renew(name, holder, token, ttl)
+
+
+def test_second_manager_takes_over_when_first_stops_renewing(db_path):
+    stalled = StalledBackend()
+    first = LeaseManager(stalled, 'first', ttl=TTL)
+    second = LeaseManager(SQLiteLeaseBackend(), 'second', ttl=TTL)
+
+    async def scenario():
+        async with first.hold('job') as lease:
+            assert lease is not None
+            # Пока первый продлевает аренду, второй ее не получает
+            await asyncio.sleep(TTL * 1.5)
+            async with second.hold('job') as busy:
+                assert busy is None
+            assert not lease.lost.is_set()
+
+            stalled.renewing = False
+            await asyncio.sleep(TTL * 1.5)
+            async with second.hold('job') as taken:
+                assert taken is not None and taken.token > lease.token
+                stalled.renewing = True
+                await asyncio.wait_for(lease.lost.wait(), TTL * 2)
+                # Результат бывшего владельца не записывается, нового — записывается
+                slot = datetime(2026, 1, 1, 10, 0)
+                stale = await database.save_scheduled_job_run('job', slot, 'ok', lease=('job', lease.token))
+                fresh = await database.save_scheduled_job_run('job', slot, 'ok', lease=('job', taken.token))
+                return stale, fresh
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_scheduler_cancels_job_when_lease_is_lost(db_path):
+    stalled = StalledBackend()
+    first = JobScheduler(LeaseManager(stalled, 'first', ttl=TTL))
+    second = JobScheduler(LeaseManager(SQLiteLeaseBackend(), 'second', ttl=TTL))
+    slot = datetime(2026, 1, 1, 10, 0)
+    events = []
+
+    def job_func(instance):
+        async def func():
+            events.append((instance, 'start'))
+            try:
+                await asyncio.sleep(TTL * 10 if instance == 'first' else 0)
+            except asyncio.CancelledError:
+                events.append((instance, 'cancelled'))
+                raise
+            events.append((instance, 'done'))
+        return func
+
+    async def scenario():
+        job_first = first.add_job('report', '0 10 * * *', job_func('first'))
+        job_second = second.add_job('report', '0 10 * * *', job_func('second'))
+        running = asyncio.create_task(first._execute(job_first, slot))
+        await asyncio.sleep(TTL / 2)
+        stalled.renewing = False
+        # Аренда первого истекает, второй экземпляр выполняет запуск
+        await asyncio.sleep(TTL * 1.5)
+        await second._execute(job_second, slot)
+        stalled.renewing = True
+        await asyncio.wait_for(running, TTL * 3)
+        return job_first.last_run, await database.get_scheduled_job_runs()
+
+    first_last_run, runs = asyncio.run(scenario())
+    assert events == [('first', 'start'), ('second', 'start'), ('second', 'done'), ('first', 'cancelled')]
+    assert first_last_run is None
+    assert runs == {'report': slot}
@@ -0,0 +1,135 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiogram import Dispatcher, types
+from aiogram.filters import Command
+
+import bot as bot_module
+from services import outbound
+from services.bot_registry import create_bot
+from tests.telegram_fake import free_port, run_fake_telegram
+
+TOKEN = '123456:TEST-TOKEN'
+SECRET = 'webhook-secret_1'
+PATH = '/telegram/webhook'
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message(Command('start'))
+    async def start(message: types.Message):
+        await message.answer(f"pong {message.from_user.id}")
+
+    return dp
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось"
+        await asyncio.sleep(0.02)
+
+
+async def run_bot(fake, delete_on_shutdown: bool, scenario):
+    """Запускает run_webhook против поддельного Bot API и выполняет scenario(session, webhook_url)"""
+    bot = create_bot(TOKEN, api_server=fake.api_server)
+    port = free_port()
+    stop = asyncio.Event()
+    server = asyncio.create_task(bot_module.run_webhook(
+        create_dispatcher(), bot, url=f'http://127.0.0.1:{port}', path=PATH, secret=SECRET,
+        host='127.0.0.1', port=port, delete_on_shutdown=delete_on_shutdown, stop=stop
+    ))
+    try:
+        await wait_for(lambda: fake.webhook.get('url') or server.done())
+        async with aiohttp.ClientSession() as session:
+            await scenario(session, fake.webhook['url'])
+    finally:
+        stop.set()
+        await server
+        await bot.session.close()
+
+
+def test_webhook_delivers_updates_and_keeps_webhook_on_shutdown():
+    async def main():
+        async with run_fake_telegram() as fake:
+            async def scenario(session, webhook_url):
+                async with session.post(f'{fake.api_server}/_fake/update',
+                                        json={'text': '/start', 'user_id': 42}) as response:
+                    delivery = await response.json()
+                assert delivery['delivered'] == 'webhook' and delivery['status'] == 200
+                await wait_for(lambda: any(sent.get('text') == 'pong 42' for sent in fake.sent))
+
+                # Запрос без верного секрета отклоняется и не обрабатывается
+                async with session.post(webhook_url, json={'update_id': 99},
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as response:
+                    assert response.status == 401
+
+            await run_bot(fake, False, scenario)
+            return fake
+
+    fake = asyncio.run(main())
+    # Webhook остался зарегистрированным: обновления во время перезапуска дождутся нового процесса
+    assert fake.webhook['secret_token'] == SECRET
+    assert fake.webhook['url'].endswith(PATH)
+    assert [sent['chat_id'] for sent in fake.sent if sent['method'] == 'sendmessage'] == [42]
+
+
+def test_webhook_is_deleted_on_shutdown_when_configured():
+    async def main():
+        async with run_fake_telegram() as fake:
+            async def scenario(session, webhook_url):
+                assert fake.webhook['url'] == webhook_url
+
+            await run_bot(fake, True, scenario)
+            return fake.webhook
+
+    assert asyncio.run(main()) == {}
+
+
+@pytest.mark.parametrize('secret', [None, '', 'with space'])
+def test_webhook_requires_valid_secret(secret):
+    async def main():
+        async with run_fake_telegram() as fake:
+            bot = create_bot(TOKEN, api_server=fake.api_server)
+            try:
+                with pytest.raises(ValueError):
+                    await bot_module.run_webhook(create_dispatcher(), bot, url='http://127.0.0.1:1', secret=secret,
+                                                 stop=asyncio.Event())
+            finally:
+                await bot.session.close()
+            return fake.webhook
+
+    assert asyncio.run(main()) == {}
+
+
+def test_main_notifies_before_closing_outbound_dispatcher(monkeypatch):
+    dispatcher = bot_module.outbound_dispatcher
+    closed = []
+
+    async def on_startup():
+        return True
+
+    async def no_updates():
+        pass
+
+    async def forever(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    async def on_shutdown():
+        # Уведомление администратора проходит через диспетчер исходящих сообщений
+        await dispatcher._acquire(outbound.INTERACTIVE)
+        closed.append(dispatcher._pump_task is None)
+
+    monkeypatch.setattr(bot_module, 'BOT_MODE', 'polling')
+    monkeypatch.setattr(bot_module, 'on_startup', on_startup)
+    monkeypatch.setattr(bot_module, 'run_polling', no_updates)
+    monkeypatch.setattr(bot_module, 'broadcast_job_worker', forever)
+    monkeypatch.setattr(bot_module.scheduler, 'run', forever)
+    monkeypatch.setattr(bot_module, 'on_shutdown', on_shutdown)
+
+    asyncio.run(bot_module.main())
+    # Во время on_shutdown диспетчер еще работал, после main — остановлен
+    assert closed == [False]
+    assert dispatcher._pump_task is None
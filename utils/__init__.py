@@ -4,6 +4,7 @@
 
 from .helpers import *
 from .decorators import *
+from .rate_limit import *
 
 __all__ = [
     'admin_required',
@@ -12,5 +13,8 @@ __all__ = [
     'escape_html',
     'format_user_info',
     'validate_fio',
-    'validate_phone'
+    'normalize_fio',
+    'validate_phone',
+    'TokenBucket',
+    'backoff_delay'
 ] 
\ No newline at end of file
@@ -42,6 +42,13 @@ def validate_fio(fio: str) -> bool:
     return bool(re.match(pattern, fio.strip()))
 
 
+def normalize_fio(fio: str) -> str:
+    """Нормализует ФИО для сравнения: без учета регистра, ё → е, одиночные пробелы"""
+    if not fio:
+        return ''
+    return ' '.join(str(fio).casefold().replace('ё', 'е').split())
+
+
 def validate_phone(phone: str) -> bool:
     """Проверяет корректность номера телефона"""
     if not phone:
@@ -0,0 +1,79 @@
+"""
+Ограничение частоты запросов к внешним API
+"""
+
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель частоты запросов (token bucket)
+
+    Токены пополняются со скоростью rate в секунду, но не больше capacity.
+    Скорость адаптивная: penalize() при ответе «слишком много запросов»
+    снижает ее вдвое, reward() после успешных запросов постепенно
+    возвращает к номинальной.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: float = None,
+                 recovery_step: float = 0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 8
+        self.capacity = capacity
+        self.recovery_step = recovery_step
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ожидает, пока не станет доступно tokens токенов (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def penalize(self, delay: float = 0.0):
+        """Снижает скорость вдвое, обнуляет запас токенов и приостанавливает выдачу на delay секунд"""
+        self._refill(time.monotonic())
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        if delay > 0:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def reward(self):
+        """Постепенно возвращает скорость к номинальной после успешного запроса"""
+        if self.rate < self.max_rate:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery_step)
+
+    @property
+    def available(self) -> float:
+        """Текущий запас токенов"""
+        self._refill(time.monotonic())
+        return self._tokens
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Экспоненциальная задержка с джиттером: половина фиксирована, половина случайна"""
+    delay = min(cap, base * (2 ** max(attempt - 1, 0)))
+    return delay / 2 + random.uniform(0, delay / 2)